@@ -31,30 +31,242 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 
 import os
+import json
+import hashlib
 import jarray
+import time
 import inspect
-from java.io import File
+import threading
+from collections import OrderedDict
+from java.io import FileOutputStream
 from java.lang import Class
+from java.lang import Long
+from java.lang import Runtime
+from java.lang import System
+from java.security import MessageDigest
+from java.util.concurrent import Callable
+from java.util.concurrent import Executors
+from java.util.concurrent import ExecutorCompletionService
+from java.util.concurrent import ExecutionException
+from java.util.concurrent import TimeUnit
 from java.util.logging import Level
 from java.sql import DriverManager
 from java.sql import SQLException
 from org.sleuthkit.datamodel import SleuthkitCase
 from org.sleuthkit.datamodel import BlackboardArtifact
 from org.sleuthkit.datamodel import BlackboardAttribute
-from org.sleuthkit.autopsy.datamodel import ContentUtils
+from org.sleuthkit.datamodel import TskCoreException
+from org.sleuthkit.datamodel import TskDataException
+from org.sleuthkit.datamodel import Account
+from org.sleuthkit.datamodel import Relationship
+from org.sleuthkit.datamodel import TskData
+from org.sleuthkit.datamodel.Blackboard import BlackboardException
 from org.sleuthkit.autopsy.ingest import IngestModule
 from org.sleuthkit.autopsy.ingest import DataSourceIngestModule
+from org.sleuthkit.autopsy.ingest import FileIngestModule
 from org.sleuthkit.autopsy.ingest import IngestModuleFactoryAdapter
 from org.sleuthkit.autopsy.ingest import IngestMessage
 from org.sleuthkit.autopsy.ingest import IngestServices
+from org.sleuthkit.autopsy.ingest import ModuleDataEvent
+from org.sleuthkit.autopsy.ingest import ModuleContentEvent
 from org.sleuthkit.autopsy.coreutils import Logger
 from org.sleuthkit.autopsy.casemodule import Case
+from protonmail_core import PM_TABLES
+from protonmail_core import PM_LOOKUP_ATTRIBUTES
+from protonmail_core import SQLITE_HEADER_SIZE
+from protonmail_core import SQLITE_SIDECARS
+from protonmail_core import CARVE_READ_PAGES
+from protonmail_core import ProtonMailQueryError
+from protonmail_core import ProtonMailContactIndex
+from protonmail_core import ProtonMailRecordLayout
+from protonmail_core import parseSqliteHeader
+from protonmail_core import emailAddresses
+from protonmail_core import selectColumns
+from protonmail_core import tableColumns
+from protonmail_core import carveDeletedRows
+
+
+# size of the buffer used to stream each database out of the image
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+# keep a ledger of ingested databases in the case directory so re-running the
+# module skips databases it has already seen and only picks up new rows in
+# ones that changed
+USE_INGEST_LEDGER = True
+
+# number of databases copied and parsed at the same time, 0 uses one worker
+# per processor core
+WORKER_COUNT = 0
+
+# run as a file ingest module instead of a data source one: each 'proton.db'
+# is picked out by name as the file pipeline reaches it and parsed on that
+# file ingest thread, alongside hashing and the other file modules, rather
+# than looked up and parsed once the file pipeline is done.  Autopsy's file
+# ingest threads take the place of WORKER_COUNT.
+FILE_LEVEL_INGEST = False
+
+# tables are read in pages of this many rows, ordered by rowid, so memory use
+# stays flat no matter how big the mailbox is
+PAGE_SIZE = 1000
+
+# rows the SQLite driver fetches per round trip while reading a page
+FETCH_SIZE = 250
+
+# check for cancellation and update the progress text every this many rows
+PROGRESS_INTERVAL = 500
+
+# plan the work before parsing: estimate the rows in each database from its
+# size, parse the biggest databases first so one large mailbox doesn't start
+# last and hold up the end of the job, and show progress in rows with an
+# estimate of the time left rather than in files.  Each estimate is replaced
+# by a max(rowid) probe of every table once its database is open.  Only used
+# by the data source module, the file pipeline picks its own order.
+PLAN_WORK = True
+
+# bytes of database (with its WAL and journal) per row assumed until the
+# first databases have been probed, after which their ratio is used
+PLAN_BYTES_PER_ROW = 4096
+
+# how much longer carving a row's worth of database takes than reading a row,
+# assumed until both have been timed in this job
+PLAN_CARVE_WEIGHT = 4.0
+
+# milliseconds between progress bar updates while planning is on
+PROGRESS_UPDATE_MS = 1000
+
+# for quick triage runs: read at most this many rows from each table of each
+# database, and stop once the ingest job has run for this many seconds (0 for
+# no limit).  A database that was cut short is recorded in the ingest ledger
+# as far as it got, without being carved, so a later run without the limits
+# picks up the rest.
+MAX_ROWS_PER_TABLE = 0
+TIME_BUDGET_SECONDS = 0
+
+# post how long each stage of the ingest took and what it did to the ingest
+# inbox, and write the same figures as JSON to the case module directory
+# (ProtonMail/metrics) so runs can be compared
+REPORT_METRICS = True
+
+# number of rows to collect before writing them to the case database in one
+# transaction.  Bigger chunks mean fewer round trips but more memory; anything
+# in the 500 - 5000 range works well.
+ARTIFACT_BATCH_SIZE = 1000
+
+# submit new artifacts to the keyword search index as each chunk is written
+INDEX_ARTIFACTS = True
+
+# attributes that are stored on the artifact but kept out of the keyword index.
+# Message headers are large and rarely worth searching.  When one is offloaded
+# (see OFFLOAD_LARGE_FIELDS) its derived file isn't added to the ingest job
+# either, which would have it indexed as a file.
+INDEX_EXCLUDED_ATTRIBUTES = ("TSK_PM_CONTACTMESSAGE_HEADER",)
+
+# write message bodies and headers longer than OFFLOAD_THRESHOLD characters out
+# as derived files under their 'proton.db' instead of storing them as
+# attributes.  Identical contents are only stored once.
+OFFLOAD_LARGE_FIELDS = True
+OFFLOAD_THRESHOLD = 4096
+
+# characters of an offloaded body or header kept on the artifact as a preview
+PREVIEW_LENGTH = 256
+
+# recover deleted rows of the CARVE_TABLES from free pages, free space inside
+# pages and old WAL frames the first time a database is ingested.  Recovered
+# rows get a "Recovered From" attribute saying where they were found.
+CARVE_DELETED_RECORDS = True
+CARVE_TABLES = ("message", "contact", "notification")
+
+# only add a message once per case, however many copies of 'proton.db' it turns
+# up in (backups, restored app data, carved copies).  Later copies add an "Also
+# Present In" attribute to the first artifact instead of a new artifact.
+DEDUP_MESSAGES = True
+
+# add the names of the sender's and recipients' contacts and of the labels to
+# each message, looked up in the same database's contact and label tables
+# (see PM_LOOKUP_ATTRIBUTES)
+RESOLVE_CONTACTS = True
+
+# write 'message' rows as standard e-mail messages (TSK_EMAIL_MSG) so they show
+# up in the Communications view and the Timeline, and add their senders and
+# recipients as e-mail accounts with a relationship for each message.  Columns
+# listed in PM_EMAIL_ATTRIBUTES use the standard attribute, the others keep
+# their ProtonMail one.
+EMAIL_ARTIFACTS = False
+
+# bits in the in-memory filter in front of the case's dedup index.  32M bits is
+# 4 MB and keeps false positives, which only cost an index lookup, rare up to a
+# few million messages.
+DEDUP_FILTER_BITS = 32 * 1024 * 1024
+
+# artifacts the writer keeps after creating them, so copies of a message that
+# turn up soon after it (from another copy of the mailbox parsed alongside)
+# get their "Also Present In" attribute without fetching it back from the
+# case database.  The others are fetched in one query per chunk.
+DEDUP_ARTIFACT_CACHE = 10000
+
+# The tables and columns we parse (PM_TABLES), the contact and label lookups
+# on them (PM_LOOKUP_ATTRIBUTES), the sidecar files copied with each database
+# (SQLITE_SIDECARS) and the pages the carver reads at a time
+# (CARVE_READ_PAGES) are in protonmail_core.py, which the standalone
+# extractor shares.
+
+# Columns that are written out to derived files when OFFLOAD_LARGE_FIELDS is
+# on.  The artifact keeps a preview in the column's own attribute plus the
+# size, SHA-256 and object ID of the derived file, in attributes named after
+# the column's with _SIZE, _SHA256 and _FILEID on the end:
+#
+#   attribute type: (derived file name prefix, display name prefix)
+PM_OFFLOAD_COLUMNS = {
+    "TSK_PM_CONTACTMESSAGE_BODY": ("body", "Body"),
+    "TSK_PM_CONTACTMESSAGE_HEADER": ("header", "Header"),
+}
+
+# Tables whose rows are deduplicated across databases when DEDUP_MESSAGES is on.
+# A row's fingerprint is built from the key columns if the database has all of
+# them, otherwise from the fallback columns it has:
+#
+#   table: (also present in attribute type, display name,
+#           key columns, fallback key columns)
+PM_DEDUP_TABLES = {
+    "message": ("TSK_PM_CONTACTMESSAGE_ALSOPRESENTIN", "Also Present In", ("ID",),
+                ("Time", "SenderAddress", "Subject", "ToListString", "TotalSize")),
+}
+
+# The standard artifact type each table's rows are written as when
+# EMAIL_ARTIFACTS is on, and the standard attribute types that replace
+# ProtonMail ones on them:
+#
+#   table: standard artifact type
+#   ProtonMail attribute type: standard attribute type
+PM_EMAIL_ARTIFACTS = {
+    "message": "TSK_EMAIL_MSG",
+}
+PM_EMAIL_ATTRIBUTES = {
+    "TSK_PM_CONTACTMESSAGE_TIME": "TSK_DATETIME_SENT",
+    "TSK_PM_CONTACTMESSAGE_TO": "TSK_EMAIL_TO",
+    "TSK_PM_CONTACTMESSAGE_REPLYTO": "TSK_EMAIL_REPLYTO",
+    "TSK_PM_CONTACTMESSAGE_SENDERADDRESS": "TSK_EMAIL_FROM",
+    "TSK_PM_CONTACTMESSAGE_SUBJECT": "TSK_SUBJECT",
+    "TSK_PM_CONTACTMESSAGE_BODY": "TSK_EMAIL_CONTENT_PLAIN",
+    "TSK_PM_CONTACTMESSAGE_HEADER": "TSK_HEADERS",
+    "TSK_PM_CONTACTMESSAGE_BCCLIST": "TSK_EMAIL_BCC",
+    "TSK_PM_CONTACTMESSAGE_CCLIST": "TSK_EMAIL_CC",
+    "TSK_PM_CONTACTMESSAGE_ID": "TSK_MSG_ID",
+}
+
+# the ResultSet getter used to read each attribute value type.  The numeric
+# ones return 0 for NULL, so their values are checked with wasNull().
+VALUE_GETTERS = {"STRING": "getString",
+                 "INTEGER": "getInt",
+                 "LONG": "getLong",
+                 "DATETIME": "getLong"}
 
 
 # Factory that defines the name and details of the module and allows Autopsy
 # to create instances of the modules that will do the analysis.
 class ProtonMailDataSourceIngestModuleFactory(IngestModuleFactoryAdapter):
     moduleName = "ProtonMail"
+    moduleVersion = "1.0"
 
     def getModuleDisplayName(self):
         return self.moduleName
@@ -63,179 +275,490 @@ class ProtonMailDataSourceIngestModuleFactory(IngestModuleFactoryAdapter):
         return "Parse the ProtonMail SQLite database"
 
     def getModuleVersionNumber(self):
-        return "1.0"
+        return self.moduleVersion
 
     def isDataSourceIngestModuleFactory(self):
-        return True
+        return not FILE_LEVEL_INGEST
 
     def createDataSourceIngestModule(self, ingestOptions):
         return ProtonMailDataSourceIngestModule()
 
+    def isFileIngestModuleFactory(self):
+        return FILE_LEVEL_INGEST
 
-# Data Source-level ingest module.  One gets created per data source.
-class ProtonMailDataSourceIngestModule(DataSourceIngestModule):
+    def createFileIngestModule(self, ingestOptions):
+        return ProtonMailFileIngestModule()
+
+
+# Copies and parses single 'proton.db' files.  Shared by the data source and
+# file ingest modules, which provide 'context', 'metrics' and showProgress().
+class ProtonMailDatabaseParser(object):
     _logger = Logger.getLogger(ProtonMailDataSourceIngestModuleFactory.moduleName)
 
     def log(self, level, msg):
         self._logger.logp(level, self.__class__.__name__, inspect.stack()[1][3], msg)
 
+    # show what's being worked on, where the module has somewhere to show it
+    def showProgress(self, text):
+        pass
+
+    # tables the contact index couldn't read
+    def logContactIndex(self, msg):
+        self._logger.logp(Level.INFO, "ProtonMailContactIndex", "read", msg)
+
+    # True once the user has cancelled or the TIME_BUDGET_SECONDS are up
+    def stopRequested(self):
+        return self.context.isJobCancelled() or (self.deadline is not None and time.time() > self.deadline)
+
+    # add the files 'writer' derived since last time to the ingest job.
+    # Offloaded bodies go through the file pipeline so they are keyword
+    # indexed like any other file, headers are kept out of the index.
+    def queueNewFiles(self, writer):
+        newFiles = writer.takeNewFiles()
+        if newFiles:
+            self.context.addFilesToJob(newFiles)
+
+    # Copy, open and parse a single 'proton.db' along with its 'sidecars'
+    # (suffix -> file).  Runs on a worker or file ingest thread, so everything
+    # here is local to this database apart from the shared writer, ingest
+    # ledger and metrics.
+    def processDatabase(self, file, sidecars, mappings, writer, ledger):
+        # check if the user pressed cancel (or time ran out) while we were busy
+        if self.stopRequested():
+            if not self.context.isJobCancelled():
+                self.metrics.count("databases skipped, out of time")
+            return
+
+        # start processing
+        self.log(Level.INFO, "Processing file: " + file.getName())
+
+        # check the SQLite header straight from the image so that carved,
+        # fragmentary or misnamed hits are thrown away without being copied
+        with self.metrics.stage("header check"):
+            dbHeader = readSqliteHeader(file)
+        if dbHeader is None:
+            self.log(Level.INFO, "Skipping " + file.getName() + " (" + str(file.getId()) + "), not a SQLite database")
+            self.metrics.count("databases skipped, not SQLite")
+        elif dbHeader["truncated"]:
+            self.log(Level.WARNING, "Skipping " + file.getName() + " (" + str(file.getId()) + "), header expects " +
+                     str(dbHeader["pageCount"] * dbHeader["pageSize"]) + " bytes but the file only has " + str(file.getSize()))
+            message = IngestMessage.createMessage(
+                IngestMessage.MessageType.DATA,
+                "ProtonMail",
+                "Skipped truncated database " + file.getName() + " (" + str(file.getId()) + ")")
+            IngestServices.getInstance().postMessage(message)
+            self.metrics.count("databases skipped, truncated")
+        else:
+            # the database and its sidecars are copied next to each other so
+            # SQLite finds them
+            lclDbPath = os.path.join(Case.getCurrentCase().getTempDirectory(),
+                                     str(file.getId()) + ".db")
+            sources = [(file, lclDbPath)] + [(sidecars[suffix], lclDbPath + suffix) for suffix in sorted(sidecars)]
+
+            # skip databases that were already ingested, if Autopsy has hashed
+            # the files we know before copying anything
+            md5 = contentHash([source.getMd5Hash() for source, path in sources])
+            if ledger is not None and md5 and ledger.isUnchanged(file, md5):
+                self.log(Level.INFO, "Skipping " + file.getName() + " (" + str(file.getId()) + "), already ingested")
+                self.metrics.count("databases skipped, unchanged")
+                return
+
+            # stream the files into the case temp directory, hashing them on
+            # the way if Autopsy hasn't already.  A copy that doesn't finish,
+            # cancelled or failing to read the image, is removed.
+            digests = []
+            copiedAll = False
+            try:
+                for source, path in sources:
+                    digest = None
+                    if ledger is not None and not md5:
+                        digest = MessageDigest.getInstance("MD5")
+                    with self.metrics.stage("copy"):
+                        copied = copyToLocal(source, path, self.context, digest)
+                    if not copied:
+                        # cancelled part way through the copy
+                        return
+                    self.metrics.count("bytes copied", source.getSize())
+                    digests.append(digest)
+                copiedAll = True
+            finally:
+                if not copiedAll:
+                    removeLocalCopy(lclDbPath)
+            if ledger is not None and not md5:
+                md5 = contentHash(["".join(["%02x" % (b & 0xff) for b in digest.digest()]) for digest in digests])
+                if ledger.isUnchanged(file, md5):
+                    self.log(Level.INFO, "Skipping " + file.getName() + " (" + str(file.getId()) + "), already ingested")
+                    self.metrics.count("databases skipped, unchanged")
+                    removeLocalCopy(lclDbPath)
+                    return
+
+            # for a database that changed since the last run only rows past the
+            # highest rowid seen last time are new
+            lastRowids = {}
+            if ledger is not None:
+                lastRowids = ledger.lastRowids(file)
+            rowids = dict(lastRowids)
+
+            try:
+                with self.metrics.stage("open"):
+                    Class.forName("org.sqlite.JDBC").newInstance()
+                    dbConn = DriverManager.getConnection("jdbc:sqlite:%s" % lclDbPath)
+            except SQLException as e:
+                message = IngestMessage.createMessage(
+                    IngestMessage.MessageType.DATA,
+                    "ProtonMail",
+                    "Failed to open " + file.getName()+ " as SQLite")
+                IngestServices.getInstance().postMessage(message)
+                removeLocalCopy(lclDbPath)
+                return
+
+            # close the connection and remove the copy however we leave
+            try:
+                # now that it's open, the plan's guess at this database's rows
+                # can be replaced with the rowid range of each table
+                if self.plan is not None:
+                    with self.metrics.stage("plan"):
+                        self.plan.probe(file, jdbcQuery(dbConn), mappings, lastRowids)
+
+                # this worker's artifacts go out to the shared writer in chunks
+                batch = writer.newBatch()
+                complete = True
+
+                # the contacts and labels the messages are resolved against,
+                # read before any table is streamed
+                contacts = None
+                if any([mapping.lookups for mapping in mappings]):
+                    with self.metrics.stage("contact index"):
+                        contacts = ProtonMailContactIndex.read(jdbcQuery(dbConn), self.logContactIndex)
+
+                # each table is read on its own so a table or column this
+                # version of ProtonMail doesn't have only costs us that table
+                # or column
+                cutShort = False
+                for mapping in mappings:
+                    try:
+                        stopped = self.extractTable(file, dbConn, mapping, batch, rowids, contacts)
+                    except (SQLException, ProtonMailQueryError) as e:
+                        self.log(Level.INFO, "Error reading table '" + mapping.table + "' from " + file.getName() +
+                                 " (" + str(e) + ")")
+                        complete = False
+                        continue
+                    batch.flush()
+                    if stopped:
+                        complete = False
+                        cutShort = not self.context.isJobCancelled()
+                        if self.stopRequested():
+                            break
+                if cutShort:
+                    self.metrics.count("databases cut short")
+
+                # recover deleted rows, once per database.  This has to happen
+                # before the connection is closed, which checkpoints the WAL
+                # into the database and deletes it.
+                carved = ledger is not None and ledger.wasCarved(file)
+                if CARVE_DELETED_RECORDS and not carved and complete:
+                    try:
+                        with self.metrics.stage("carve"):
+                            carved = not self.carveDatabase(file, dbConn, lclDbPath, dbHeader["pageSize"], mappings,
+                                                            batch, contacts)
+                    except (SQLException, ProtonMailQueryError, IOError, OSError) as e:
+                        self.log(Level.WARNING, "Unable to recover deleted rows from " + file.getName() +
+                                 " (" + str(file.getId()) + "): " + str(e))
+                        carved = True
+
+                # write out whatever was read before an error stopped us
+                batch.close()
+
+                # remember how far we got, unless some of it never made it into
+                # the case database, in which case the next run tries those
+                # rows again.  A database we didn't get all the way through is
+                # recorded without its hash so the next run picks up where
+                # this one stopped.
+                if ledger is not None:
+                    if batch.failedCount == 0:
+                        if self.stopRequested():
+                            complete = False
+                        ledger.record(file, md5 if complete else None, rowids, carved)
+                    else:
+                        self.log(Level.WARNING, "Not updating the ingest ledger for " + file.getName() + ", " +
+                                 str(batch.failedCount) + " artifact(s) failed to write")
+
+                self.metrics.count("databases ingested")
+            finally:
+                dbConn.close()
+                removeLocalCopy(lclDbPath)
+
+    # Read the rows of one table past rowids[mapping.table] and queue an
+    # artifact for each, with the mapping's lookups resolved against
+    # 'contacts' (a ProtonMailContactIndex, or None).  Only the columns this
+    # database actually has are selected, and the table is paged in rowid
+    # order so memory stays flat.  Returns True if it stopped before the end of
+    # the table: the user cancelled, the time budget ran out or
+    # MAX_ROWS_PER_TABLE rows were read.
+    def extractTable(self, file, dbConn, mapping, batch, rowids, contacts=None):
+        present = tableColumns(jdbcQuery(dbConn), mapping.table)
+        if not present:
+            self.log(Level.INFO, file.getName() + " has no '" + mapping.table + "' table")
+            self.metrics.count("tables missing: " + mapping.table)
+            return False
+        columns = [column for column in mapping.columns if column[0].lower() in present]
+        if len(columns) < len(mapping.columns):
+            self.log(Level.INFO, file.getName() + " table '" + mapping.table + "' is missing column(s) " +
+                     ", ".join([column[0] for column in mapping.columns if column[0].lower() not in present]))
+        if not columns:
+            return False
+
+        # the columns this database's rows are fingerprinted on, if the table
+        # is deduplicated
+        keyColumns = dedupColumns(mapping, present)
+
+        # lookups read their columns by position too, selecting the ones that
+        # aren't attributes as well (rowid is column 1)
+        selected, lookups = selectColumns([column[0] for column in columns],
+                                          mapping.lookups if contacts is not None else (), present)
+        lookups = [(attributeType, lookup, [index + 2 for index in indexes])
+                   for attributeType, lookup, indexes in lookups]
+
+        # paging on rowid (rather than OFFSET) keeps every page an index seek
+        pageQuery = dbConn.prepareStatement("select rowid, " +
+                                            ", ".join(['"' + name + '"' for name in selected]) +
+                                            ' from "' + mapping.table + '" where rowid > ? order by rowid limit ?;')
+        pageQuery.setFetchSize(FETCH_SIZE)
+        lastRowid = rowids.get(mapping.table, 0)
+        rowCount = 0
+        reported = 0
+
+        # time spent waiting for the writer isn't reading
+        started = System.nanoTime()
+        waited = batch.waitSeconds
+        reportedAt = started
+        try:
+            while True:
+                pageLimit = PAGE_SIZE
+                if MAX_ROWS_PER_TABLE > 0:
+                    pageLimit = min(PAGE_SIZE, MAX_ROWS_PER_TABLE - rowCount)
+                    if pageLimit <= 0:
+                        self.metrics.count("tables cut short")
+                        return True
+                pageQuery.setLong(1, lastRowid)
+                pageQuery.setInt(2, pageLimit)
+                resultSet = pageQuery.executeQuery()
+
+                # columns are read by position, rowid is column 1
+                readers = [(index + 2, attributeType, getattr(resultSet, VALUE_GETTERS[valueType]), offload,
+                            name.lower() in keyColumns, valueType != "STRING")
+                           for index, (name, attributeType, valueType, offload) in enumerate(columns)]
+
+                pageRows = 0
+                while resultSet.next():
+                    pageRows += 1
+                    attributes = []
+                    derived = []
+                    key = []
+                    for index, attributeType, getter, offload, keyed, numeric in readers:
+                        value = getter(index)
+                        if numeric and resultSet.wasNull():
+                            value = None
+                        if keyed:
+                            key.append(value)
+                        if value is None:
+                            continue
+                        if offload is not None and len(value) > OFFLOAD_THRESHOLD:
+                            self.offloadValue(file, value, attributeType, offload, attributes, derived)
+                        else:
+                            attributes.append(BlackboardAttribute(attributeType, ProtonMailDataSourceIngestModuleFactory.moduleName, value))
+                    for attributeType, lookup, positions in lookups:
+                        value = contacts.resolve(lookup, [resultSet.getString(position) for position in positions])
+                        if value:
+                            attributes.append(BlackboardAttribute(attributeType, ProtonMailDataSourceIngestModuleFactory.moduleName, value))
+                    lastRowid = resultSet.getLong(1)
+                    if attributes:
+                        dedupKey = None
+                        if keyColumns and None not in key:
+                            dedupKey = (fingerprint(key), mapping.dedup[0], u"%d" % (lastRowid,))
+                        batch.add(file, mapping.artifactType, attributes, derived, dedupKey)
+
+                    # check if the user pressed cancel every so often
+                    rowCount += 1
+                    if rowCount % PROGRESS_INTERVAL == 0:
+                        if self.plan is not None:
+                            now = System.nanoTime()
+                            self.plan.advance(file, rowCount - reported, (now - reportedAt) / 1e9)
+                            reported = rowCount
+                            reportedAt = now
+                        if self.stopRequested():
+                            resultSet.close()
+                            return True
+                        self.showProgress("ProtonMail: " + file.getName() + " (" + str(file.getId()) + "), " +
+                                          str(rowCount) + " " + mapping.table + " rows")
+                resultSet.close()
+                if pageRows < pageLimit:
+                    return False
+        finally:
+            rowids[mapping.table] = lastRowid
+            pageQuery.close()
+            if self.plan is not None:
+                self.plan.advance(file, rowCount - reported, (System.nanoTime() - reportedAt) / 1e9)
+            self.metrics.addTime("read table: " + mapping.table,
+                                 (System.nanoTime() - started) / 1e9 - (batch.waitSeconds - waited))
+            self.metrics.count("rows read: " + mapping.table, rowCount)
+
+    # Write a large body or header to the module output directory, named by
+    # its SHA-256 so identical contents share one file, and add its preview,
+    # size and hash to 'attributes'.  The derived file itself is added to the
+    # case by the writer, which fills in the file ID attribute.
+    def offloadValue(self, file, value, attributeType, offload, attributes, derived):
+        prefix, sizeType, sha256Type, fileIdType = offload
+        data = value.encode("utf-8")
+        sha256 = hashlib.sha256(data).hexdigest()
+        name = prefix + "-" + sha256 + ".txt"
+        relPath = os.path.join(Case.getCurrentCase().getModuleOutputDirectoryRelativePath(),
+                               ProtonMailDataSourceIngestModuleFactory.moduleName, "content", sha256[:2], name)
+        path = os.path.join(Case.getCurrentCase().getCaseDirectory(), relPath)
+        existed = os.path.exists(path)
+        if not existed:
+            writeFileAtomically(path, data)
+
+        moduleName = ProtonMailDataSourceIngestModuleFactory.moduleName
+        attributes.append(BlackboardAttribute(attributeType, moduleName, value[:PREVIEW_LENGTH]))
+        attributes.append(BlackboardAttribute(sizeType, moduleName, Long(len(data))))
+        attributes.append(BlackboardAttribute(sha256Type, moduleName, sha256))
+        derived.append((file, name, relPath, len(data), existed, attributeType, fileIdType))
+
+    # Recover deleted rows of the CARVE_TABLES from the free space of the local
+    # copy of 'file' (with pages of 'pageSize' bytes) and its WAL and queue an
+    # artifact for each one that isn't still a live row.  Returns True if the
+    # user cancelled or the time budget ran out part way through.
+    def carveDatabase(self, file, dbConn, lclDbPath, pageSize, mappings, batch, contacts=None):
+        query = jdbcQuery(dbConn)
+        layouts = []
+        for mapping in mappings:
+            if mapping.recoveredType is not None:
+                layout = ProtonMailRecordLayout.read(query, mapping)
+                if layout is not None:
+                    layouts.append(layout)
+        if not layouts:
+            return False
+
+        # the carver checks whether to stop once per CARVE_READ_PAGES pages,
+        # which is also when the plan hears how far it has got
+        isStopped = self.stopRequested
+        if self.plan is not None:
+            step = self.plan.carveStep(file, CARVE_READ_PAGES * pageSize)
+            lastStep = [System.nanoTime()]
+            def isStopped():
+                now = System.nanoTime()
+                self.plan.advance(file, step, (now - lastStep[0]) / 1e9, True)
+                lastStep[0] = now
+                return self.stopRequested()
+
+        self.showProgress("ProtonMail: " + file.getName() + " (" + str(file.getId()) + "), recovering deleted rows")
+        records = carveDeletedRows(query, lclDbPath, layouts, isStopped, CARVE_READ_PAGES, PAGE_SIZE)
+        if records is None:
+            return True
+
+        moduleName = ProtonMailDataSourceIngestModuleFactory.moduleName
+        recovered = 0
+        for layout, rowid, values, source in records:
+            mapping = layout.mapping
+            attributes = []
+            derived = []
+            key = []
+            keyColumns = dedupColumns(mapping, layout.index)
+            for column, attributeType, valueType, offload in mapping.columns:
+                index = layout.index.get(column.lower())
+                value = None
+                if index is not None:
+                    value = carvedValue(values[index], valueType)
+                if column.lower() in keyColumns:
+                    key.append(value)
+                if value is None:
+                    continue
+                if offload is not None and len(value) > OFFLOAD_THRESHOLD:
+                    self.offloadValue(file, value, attributeType, offload, attributes, derived)
+                else:
+                    attributes.append(BlackboardAttribute(attributeType, moduleName, value))
+            if contacts is not None:
+                for attributeType, lookup, lookupColumns in mapping.lookups:
+                    texts = [carvedValue(values[layout.index[name.lower()]], "STRING") for name in lookupColumns
+                             if name.lower() in layout.index]
+                    value = contacts.resolve(lookup, texts)
+                    if value:
+                        attributes.append(BlackboardAttribute(attributeType, moduleName, value))
+            if not attributes:
+                continue
+            attributes.append(BlackboardAttribute(mapping.recoveredType, moduleName, source))
+            dedupKey = None
+            if keyColumns and None not in key:
+                dedupKey = (fingerprint(key), mapping.dedup[0], carvedRowKey(rowid, values))
+            batch.add(file, mapping.artifactType, attributes, derived, dedupKey)
+            recovered += 1
+        batch.flush()
+
+        self.metrics.count("rows recovered", recovered)
+        self.log(Level.INFO, "Recovered " + str(recovered) + " deleted row(s) from " + file.getName() +
+                 " (" + str(file.getId()) + ")")
+        return False
+
+
+# Data Source-level ingest module.  One gets created per data source.
+class ProtonMailDataSourceIngestModule(ProtonMailDatabaseParser, DataSourceIngestModule):
+
     def __init__(self):
         self.context = None
+        self.progressBar = None
+        self.metrics = None
+        self.plan = None
+        self.deadline = None
+        self.activity = ""
 
     # setup code
     def startUp(self, context):
         self.context = context
         pass
 
+    # with a plan, the text goes up with the rows and time left on the next
+    # progress bar update
+    def showProgress(self, text):
+        if self.plan is not None:
+            self.activity = text
+        else:
+            self.progressBar.progress(text)
+
+    def updateProgress(self):
+        done, total, remaining = self.plan.status()
+        if total != self.progressTotal:
+            self.progressBar.switchToDeterminate(total)
+            self.progressTotal = total
+        text = self.activity or "ProtonMail"
+        if remaining is not None:
+            text += " (" + formatDuration(remaining) + " left)"
+        self.progressBar.progress(text, done)
+
     # parsing stage
     def process(self, dataSource, progressBar):
         # we don't know how much work there is yet
+        self.progressBar = progressBar
         progressBar.switchToIndeterminate()
+        self.metrics = ProtonMailIngestMetrics(dataSource)
+        self.deadline = budgetDeadline()
 
-        # create new artifacts
+        # create the artifact and attribute types for the tables we parse, or
+        # look them up if an earlier run already did
         skCase = Case.getCurrentCase().getSleuthkitCase();
-        skCase_Tran = skCase.beginTransaction()
-        try:
-            self.log(Level.INFO, "Creating New Artifacts")
-            artPMContact = skCase.addArtifactType( "TSK_PM_CONTACT", "ProtonMail Contact")
-            artPMContactData = skCase.addArtifactType( "TSK_PM_CONTACTDATA", "ProtonMail Contact Data")
-            artPMContactEmails = skCase.addArtifactType( "TSK_PM_CONTACTEMAILS", "ProtonMail Contact Emails")
-            artPMContactLabel = skCase.addArtifactType( "TSK_PM_CONTACTLABEL", "ProtonMail User Labels")
-            artPMContactMessage = skCase.addArtifactType( "TSK_PM_CONTACTMESSAGE", "ProtonMail Messages")
-            artPMContactNotification = skCase.addArtifactType( "TSK_PM_CONTACTNOTIFICATION", "ProtonMail Notifications")
-        except:
-            self.log(Level.INFO, "Artifact Creation failed.  They may already exist.")
-            artPMContact = skCase.getArtifactTypeID("TSK_PM_CONTACT")
-            artPMContactData = skCase.getArtifactTypeID("TSK_PM_CONTACTDATA")
-            artPMContactEmails = skCase.getArtifactTypeID("TSK_PM_CONTACTEMAILS")
-            artPMContactLabel = skCase.getArtifactTypeID("TSK_PM_CONTACTLABEL")
-            artPMContactMessage = skCase.getArtifactTypeID("TSK_PM_CONTACTMESSAGE")
-            artPMContactNotification = skCase.getArtifactTypeID("TSK_PM_CONTACTNOTIFICATION")
-
-        # create new attributes
-        try:
-            #
-            # 'contact' table attributes
-            #
-            attPMContactName = skCase.addArtifactAttributeType("TSK_PM_CONTACT_NAME",
-                                                               BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                               "Name")
-            attPMContactCreateTime = skCase.addArtifactAttributeType("TSK_PM_CONTACT_CREATETIME",
-                                                                     BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.DATETIME,
-                                                                     "Create Time")
-            attPMContactModifyTime = skCase.addArtifactAttributeType("TSK_PM_CONTACT_MODIFYTIME",
-                                                                     BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.DATETIME,
-                                                                     "Modify Time")
-            #
-            # 'contact_data' table attributes
-            #
-            attPMContactDataName = skCase.addArtifactAttributeType("TSK_PM_CONTACTDATA_NAME",
-                                                                   BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                   "Name")
-            attPMContactDataPrimaryEmail = skCase.addArtifactAttributeType("TSK_PM_CONTACTDATA_PRIMARYEMAIL",
-                                                                           BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                           "Primary Email")
-            #
-            # 'contact_emails' table attributes
-            #
-            attPMContactEmailsName = skCase.addArtifactAttributeType("TSK_PM_CONTACTEMAILS_NAME",
-                                                                     BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                     "Name")
-            attPMContactEmailsEmail = skCase.addArtifactAttributeType("TSK_PM_CONTACTEMAILS_EMAIL",
-                                                                      BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                      "Email")
-            #
-            # 'label' table attributes
-            #
-            attPMContactLabelName = skCase.addArtifactAttributeType("TSK_PM_CONTACTLABEL_NAME",
-                                                                    BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                    "Name")
-            attPMContactLabelColor = skCase.addArtifactAttributeType("TSK_PM_CONTACTLABEL_COLOR",
-                                                                     BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                     "Color")
-            #
-            # 'message' table attributes
-            #
-            attPMContactMessageBCCList = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_BCCLIST",
-                                                                         BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                         "BCC List")
-            attPMContactMessageBody = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_BODY",
-                                                                      BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                      "Body")
-            attPMContactMessageCCList = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_CCLIST",
-                                                                        BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                        "CC List")
-            attPMContactMessageHeader = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_HEADER",
-                                                                        BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                        "Header")
-            attPMContactMessageIsDownloaded = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_ISDOWNLOADED",
-                                                                              BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                              "Is Downloaded?")
-            attPMContactMessageIsEncrypted = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_ISENCRYPTED",
-                                                                             BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                             "Is Encrypted?")
-            attPMContactMessageIsForwarded = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_ISFORWARDED",
-                                                                             BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                             "Is Forwarded?")
-            attPMContactMessageIsRead = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_ISREAD",
-                                                                        BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                        "Is Read?")
-            attPMContactMessageIsReplied = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_ISREPLIED",
-                                                                           BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                           "Is Replied?")
-            attPMContactMessageIsRepliedAll = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_ISREPLIEDALL",
-                                                                              BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                              "Is Replied All?")
-            attPMContactMessageReplyTo = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_REPLYTO",
-                                                                         BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                         "Reply To")
-            attPMContactMessageSenderAddress = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_SENDERADDRESS",
-                                                                               BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                               "Sender Address")
-            attPMContactMessageSenderName = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_SENDERNAME",
-                                                                            BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                            "From")
-            attPMContactMessageTotalSize = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_TOTALSIZE",
-                                                                           BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                           "Total Size")
-            attPMContactMessageSpamScore = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_SPAMSCORE",
-                                                                           BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                           "Spam Score")
-            attPMContactMessageStarred = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_STARRED",
-                                                                         BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                         "Starred")
-            attPMContactMessageSubject = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_SUBJECT",
-                                                                         BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                         "Subject")
-            attPMContactMessageTime = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_TIME",
-                                                                      BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.DATETIME,
-                                                                      "Time")
-            attPMContactMessageTo = skCase.addArtifactAttributeType("TSK_PM_CONTACTMESSAGE_TO",
-                                                                    BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                    "To")
-
-            #
-            # 'notification' table attributes
-            #
-            attPMContactNotificationNotificationBody = skCase.addArtifactAttributeType("TSK_PM_CONTACTNOTIFICATION_NOTIFICATIONBODY",
-                                                                                       BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                                       "Notification Body")
-            attPMContactNotificationNotificationTitle = skCase.addArtifactAttributeType("TSK_PM_CONTACTNOTIFICATION_NOTIFICATIONTITLE",
-                                                                                        BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING,
-                                                                                        "Notification Title")
-        except:
-            self.log(Level.INFO, "Attributes Creation Error.")
-
+        mappings = ProtonMailTypeCache.getMappings(skCase, self._logger)
 
         # for message posting
         PostBoard=IngestServices.getInstance()
 
-        # use blackboard class to index blackboard artifacts for keyword search
-        blackboard = Case.getCurrentCase().getServices().getBlackboard()
-
         # find all "proton.db" files
         fileManager = Case.getCurrentCase().getServices().getFileManager()
-        files = fileManager.findFiles(dataSource, "proton.db")
+        with self.metrics.stage("discovery"):
+            files = fileManager.findFiles(dataSource, "proton.db")
+
+            # and their WAL and journal files, by folder
+            sidecars = groupSidecars(fileManager.findFiles(dataSource, "proton.db-%"))
+        self.metrics.count("files found", len(files))
 
         # count the number of files, start processing, and write it out to the message board
         # to the "Ingest inbox".
@@ -246,189 +769,1551 @@ class ProtonMailDataSourceIngestModule(DataSourceIngestModule):
             "Starting to analyze " + str(numFiles) + " file(s)")
         PostBoard.postMessage(message)
 
-        progressBar.switchToDeterminate(numFiles)
+        # artifacts are queued by each worker, written to the case database in
+        # chunks by a single writer thread and indexed a chunk at a time
+        writer = ProtonMailArtifactWriter(skCase, self._logger, self.metrics)
+
+        # databases that were already ingested on an earlier run are skipped
+        ledger = None
+        if USE_INGEST_LEDGER:
+            ledger = ProtonMailIngestLedger.load(self._logger)
+
+        # estimate the work, biggest databases first
+        if PLAN_WORK:
+            with self.metrics.stage("plan"):
+                self.plan = ProtonMailWorkPlan(files, sidecars, ledger)
+            files = self.plan.files
+            self.progressTotal = None
+            self.updateProgress()
+        else:
+            progressBar.switchToDeterminate(numFiles)
         fileCount = 0
 
-        for file in files:
-            # check if the user pressed cancel while we were busy
-            if self.context.isJobCancelled():
-                return IngestModule.ProcessResult.OK
+        # each database is copied and parsed on its own worker thread
+        workerCount = WORKER_COUNT
+        if workerCount <= 0:
+            workerCount = Runtime.getRuntime().availableProcessors()
+        workerCount = max(1, min(workerCount, numFiles))
+        pool = Executors.newFixedThreadPool(workerCount)
+        completion = ExecutorCompletionService(pool)
+        try:
+            for file in files:
+                completion.submit(ProtonMailDatabaseTask(self, file, sidecars.get(file.getParentPath(), {}),
+                                                         mappings, writer, ledger))
 
-            # start processing
-            self.log(Level.INFO, "Processing file: " + file.getName())
-            fileCount += 1
+            # update the progress bar as each database finishes, or with a plan
+            # every PROGRESS_UPDATE_MS as the rows are read
+            while fileCount < numFiles:
+                if self.plan is None:
+                    future = completion.take()
+                else:
+                    future = completion.poll(PROGRESS_UPDATE_MS, TimeUnit.MILLISECONDS)
+                if future is not None:
+                    try:
+                        future.get()
+                    except ExecutionException as e:
+                        self.log(Level.SEVERE, "Failed to process database (" + str(e.getCause()) + ")")
+                    fileCount += 1
+                if self.plan is not None:
+                    self.updateProgress()
+                elif future is not None:
+                    progressBar.progress("ProtonMail (" + str(fileCount) + " of " + str(numFiles) + ")", fileCount)
+        finally:
+            pool.shutdown()
+            writer.close()
 
-            # this is a comment, I like comments
-            progressBar.progress(fileCount)
-            progressBar.progress("ProtonMail")
+        self.queueNewFiles(writer)
 
-            # try load up the SQLite database
-            lclDbPath = os.path.join(Case.getCurrentCase().getTempDirectory(),
-                                     str(file.getId()) + ".db")
-            ContentUtils.writeToFile(file, File(lclDbPath))
-            binary_file = open(lclDbPath, "rb")
-            data = binary_file.read(15)
-            binary_file.close()
-            if str(data) == "SQLite format 3":
-                try:
-                    Class.forName("org.sqlite.JDBC").newInstance()
-                    dbConn = DriverManager.getConnection("jdbc:sqlite:%s" % lclDbPath)
-                except SQLException as e:
-                    message = IngestMessage.createMessage(
-                        IngestMessage.MessageType.DATA,
-                        "ProtonMail",
-                        "Failed to open " + file.getName()+ " as SQLite",
-                        str(msgcounter))
-                    IngestServices.getInstance().postMessage(message)
-
-                # query the tables in the database then jam the results into the attributes
+        # where the time went
+        if REPORT_METRICS:
+            self.metrics.report(self._logger, self.context.isJobCancelled())
+
+        # check if the user pressed cancel while we were busy
+        if self.context.isJobCancelled():
+            return IngestModule.ProcessResult.OK
+
+        # done processing
+        postFinishedMessages(fileCount, self.metrics)
+
+        return IngestModule.ProcessResult.OK
+
+
+# File-level ingest module, used instead of the data source module when
+# FILE_LEVEL_INGEST is on.  Autopsy creates one per file ingest thread and
+# each parses the 'proton.db' files that reach its thread; the modules of one
+# ingest job share the types, writer, ledger and metrics in a
+# ProtonMailJobState.
+class ProtonMailFileIngestModule(ProtonMailDatabaseParser, FileIngestModule):
+
+    def __init__(self):
+        self.context = None
+        self.metrics = None
+        self.job = None
+        self.plan = None
+        self.deadline = None
+
+    def startUp(self, context):
+        self.context = context
+        self.job = ProtonMailJobState.acquire(context, self._logger)
+        self.metrics = self.job.metrics
+        self.deadline = self.job.deadline
+
+    def process(self, file):
+        # every file in the data source comes through here, so only look at
+        # the name
+        if file.getName().lower() != "proton.db" or not file.isFile():
+            return IngestModule.ProcessResult.OK
+        if self.context.isJobCancelled():
+            return IngestModule.ProcessResult.OK
+        self.metrics.count("files found")
+
+        # its WAL and journal files are in the same folder
+        with self.metrics.stage("discovery"):
+            sidecars = self.job.sidecars(file)
+
+        started = System.nanoTime()
+        try:
+            self.processDatabase(file, sidecars, self.job.mappings, self.job.writer, self.job.ledger)
+        finally:
+            self.metrics.database(file, (System.nanoTime() - started) / 1e9)
+
+        self.queueNewFiles(self.job.writer)
+        return IngestModule.ProcessResult.OK
+
+    def shutDown(self):
+        if self.job is not None:
+            ProtonMailJobState.release(self.context)
+            self.job = None
+
+
+# What the file ingest modules of one ingest job share: the resolved types,
+# the artifact writer, the ingest ledger and the metrics.  The ledger and the
+# writer's dedup index belong to the case, and jobs running at the same time
+# get the same ones.  The first module of a job to start up creates it and the
+# last one to shut down waits for the writer and reports on the job.
+class ProtonMailJobState(object):
+    _lock = threading.Lock()
+    _jobs = {}
+
+    def __init__(self, context, logger):
+        self._logger = logger
+        self.references = 0
+        self.dataSource = context.getDataSource()
+        self.fileManager = Case.getCurrentCase().getServices().getFileManager()
+        self.metrics = ProtonMailIngestMetrics(self.dataSource)
+        skCase = Case.getCurrentCase().getSleuthkitCase()
+        self.mappings = ProtonMailTypeCache.getMappings(skCase, logger)
+        self.writer = ProtonMailArtifactWriter(skCase, logger, self.metrics)
+        self.ledger = None
+        if USE_INGEST_LEDGER:
+            self.ledger = ProtonMailIngestLedger.load(logger)
+        self.deadline = budgetDeadline()
+
+    @staticmethod
+    def acquire(context, logger):
+        with ProtonMailJobState._lock:
+            job = ProtonMailJobState._jobs.get(context.getJobId())
+            if job is None:
+                job = ProtonMailJobState(context, logger)
+                ProtonMailJobState._jobs[context.getJobId()] = job
+            job.references += 1
+            return job
+
+    @staticmethod
+    def release(context):
+        with ProtonMailJobState._lock:
+            job = ProtonMailJobState._jobs[context.getJobId()]
+            job.references -= 1
+            if job.references > 0:
+                return
+            del ProtonMailJobState._jobs[context.getJobId()]
+        job.finish(context.isJobCancelled())
+
+    # the WAL and journal files next to 'file', as suffix -> file
+    def sidecars(self, file):
+        found = self.fileManager.findFiles(self.dataSource, "proton.db-%", file.getParentPath())
+        return groupSidecars(found).get(file.getParentPath(), {})
+
+    def finish(self, cancelled):
+        self.writer.close()
+        if REPORT_METRICS:
+            self.metrics.report(self._logger, cancelled)
+        if cancelled:
+            return
+        postFinishedMessages(self.metrics.counters.get("files found", 0), self.metrics)
+
+
+# One table from PM_TABLES with its artifact type and the attribute type for
+# each column resolved against the case database.  'columns' is a list of
+# (column, attribute type, value type, offload) tuples, where offload is None
+# or (file name prefix, size type, SHA-256 type, file ID type) for columns
+# in PM_OFFLOAD_COLUMNS.  'dedup' is None or (also present in attribute type,
+# key columns, fallback key columns) for tables in PM_DEDUP_TABLES,
+# 'recoveredType' is the "Recovered From" attribute type for CARVE_TABLES and
+# 'lookups' lists (attribute type, lookup, columns) for PM_LOOKUP_ATTRIBUTES.
+class ProtonMailTableMapping(object):
+
+    def __init__(self, table, artifactType, columns, dedup=None, recoveredType=None, lookups=()):
+        self.table = table
+        self.artifactType = artifactType
+        self.columns = columns
+        self.dedup = dedup
+        self.recoveredType = recoveredType
+        self.lookups = lookups
+
+
+# Creates (or looks up) the artifact and attribute types in PM_TABLES once per
+# case and keeps the results, so later data sources and databases in the same
+# case don't go back to the case database for them.
+class ProtonMailTypeCache(object):
+    _lock = threading.Lock()
+    _mappings = {}
+
+    @staticmethod
+    def getMappings(skCase, logger):
+        caseDir = Case.getCurrentCase().getCaseDirectory()
+        with ProtonMailTypeCache._lock:
+            mappings = ProtonMailTypeCache._mappings.get(caseDir)
+            if mappings is None:
+                mappings = ProtonMailTypeCache._resolve(skCase, logger)
+                ProtonMailTypeCache._mappings = {caseDir: mappings}
+            return mappings
+
+    @staticmethod
+    def _resolve(skCase, logger):
+        logger.logp(Level.INFO, "ProtonMailTypeCache", "_resolve", "Creating New Artifacts")
+        mappings = []
+        for table, artifactName, artifactDisplayName, columns in PM_TABLES:
+            email = EMAIL_ARTIFACTS and table in PM_EMAIL_ARTIFACTS
+            if email:
+                artifactType = skCase.getArtifactType(PM_EMAIL_ARTIFACTS[table])
+            else:
                 try:
-                    sqlQuery = dbConn.createStatement()
+                    skCase.addArtifactType(artifactName, artifactDisplayName)
+                except (TskCoreException, TskDataException):
+                    # it already exists from an earlier run
+                    pass
+                artifactType = skCase.getArtifactType(artifactName)
+
+            resolved = []
+            for column, attributeName, valueType, attributeDisplayName in columns:
+                if email and attributeName in PM_EMAIL_ATTRIBUTES:
+                    attributeType = skCase.getAttributeType(PM_EMAIL_ATTRIBUTES[attributeName])
+                else:
+                    attributeType = ProtonMailTypeCache._attributeType(skCase, attributeName, valueType, attributeDisplayName)
+                offload = None
+                if OFFLOAD_LARGE_FIELDS and attributeName in PM_OFFLOAD_COLUMNS:
+                    prefix, displayPrefix = PM_OFFLOAD_COLUMNS[attributeName]
+                    offload = (prefix,
+                               ProtonMailTypeCache._attributeType(skCase, attributeName + "_SIZE", "LONG", displayPrefix + " Size"),
+                               ProtonMailTypeCache._attributeType(skCase, attributeName + "_SHA256", "STRING", displayPrefix + " SHA-256"),
+                               ProtonMailTypeCache._attributeType(skCase, attributeName + "_FILEID", "LONG", displayPrefix + " File ID"))
+                resolved.append((column, attributeType, valueType, offload))
+            dedup = None
+            if DEDUP_MESSAGES and table in PM_DEDUP_TABLES:
+                attributeName, attributeDisplayName, key, fallbackKey = PM_DEDUP_TABLES[table]
+                dedup = (ProtonMailTypeCache._attributeType(skCase, attributeName, "STRING", attributeDisplayName),
+                         key, fallbackKey)
+            recoveredType = None
+            if CARVE_DELETED_RECORDS and table in CARVE_TABLES:
+                recoveredType = ProtonMailTypeCache._attributeType(skCase, "TSK_PM_RECOVERED", "STRING", "Recovered From")
+            lookups = []
+            if RESOLVE_CONTACTS and table in PM_LOOKUP_ATTRIBUTES:
+                for attributeName, attributeDisplayName, lookup, lookupColumns in PM_LOOKUP_ATTRIBUTES[table]:
+                    lookups.append((ProtonMailTypeCache._attributeType(skCase, attributeName, "STRING", attributeDisplayName),
+                                    lookup, lookupColumns))
+            mappings.append(ProtonMailTableMapping(table, artifactType, resolved, dedup, recoveredType, lookups))
+        return mappings
+
+    @staticmethod
+    def _attributeType(skCase, name, valueType, displayName):
+        try:
+            return skCase.addArtifactAttributeType(name,
+                                                   getattr(BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE, valueType),
+                                                   displayName)
+        except (TskCoreException, TskDataException):
+            # it already exists from an earlier run
+            return skCase.getAttributeType(name)
+
+
+# Writes artifacts to the case database in chunks instead of one round trip
+# per row.  All chunks, from every worker, go through a single writer thread so
+# the case database is never written from two threads at once.  Each chunk is
+# created inside a single case database transaction (rolled back if anything in
+# it fails) and, once committed, the whole chunk is posted to the blackboard in
+# one call so keyword search indexes it in bulk.  Attributes listed in
+# INDEX_EXCLUDED_ATTRIBUTES are attached after the post, in a second
+# transaction, so they never reach the text index.  Rows already in the case's
+# dedup index (see ProtonMailDedupIndex) are folded into the artifact they
+# duplicate rather than written again.  With EMAIL_ARTIFACTS on, the
+# relationships for a chunk's e-mail messages are added once it's committed.
+class ProtonMailArtifactWriter(object):
+
+    def __init__(self, skCase, logger, metrics):
+        self.skCase = skCase
+        self.blackboard = skCase.getBlackboard()
+        self._logger = logger
+        self.metrics = metrics
+        self.index = INDEX_ARTIFACTS
+
+        # attribute types kept out of the keyword index, whose offloaded
+        # values stay out of the ingest job too
+        self.excludedTypes = set(INDEX_EXCLUDED_ATTRIBUTES)
+        if EMAIL_ARTIFACTS:
+            self.excludedTypes.update([PM_EMAIL_ATTRIBUTES[name] for name in INDEX_EXCLUDED_ATTRIBUTES
+                                       if name in PM_EMAIL_ATTRIBUTES])
+        self.indexExcluded = set()
+        if INDEX_ARTIFACTS:
+            self.indexExcluded = self.excludedTypes
+        self.executor = Executors.newSingleThreadExecutor()
+        self.artifactCount = 0
+        self.failedCount = 0
+
+        # derived file object IDs by name, and the ones added by this job that
+        # are to be indexed but haven't been handed to the file pipeline yet
+        self.derivedFiles = {}
+        self.newFiles = []
+        self.newFilesLock = threading.Lock()
+
+        # messages already in the case, and the unique paths of the databases
+        # duplicates were found in
+        self.dedup = None
+        if DEDUP_MESSAGES:
+            self.dedup = ProtonMailDedupIndex.acquire(logger)
+        self.duplicateCount = 0
+        self.uniquePaths = {}
+        self.artifactCache = OrderedDict()
+
+        # e-mail accounts of each database, for the message relationships
+        self.accounts = None
+        if EMAIL_ARTIFACTS:
+            self.accounts = ProtonMailAccountIndex(skCase, logger, metrics)
+
+    def log(self, level, msg):
+        self._logger.logp(level, self.__class__.__name__, inspect.stack()[1][3], msg)
+
+    # a queue for one worker to collect its artifacts in
+    def newBatch(self, batchSize=ARTIFACT_BATCH_SIZE):
+        return ProtonMailArtifactBatch(self, batchSize)
+
+    # hand a chunk to the writer thread; the future returns the number of rows
+    # that made it into the case database
+    def submit(self, pending):
+        return self.executor.submit(ProtonMailWriteTask(self, pending))
+
+    # the derived files to index added since the last call, to add to the
+    # ingest job
+    def takeNewFiles(self):
+        with self.newFilesLock:
+            newFiles = self.newFiles
+            self.newFiles = []
+        return newFiles
+
+    # wait for everything submitted so far to be written
+    def close(self):
+        self.executor.shutdown()
+        self.executor.awaitTermination(Long.MAX_VALUE, TimeUnit.SECONDS)
+        if self.dedup is not None:
+            self.dedup.release()
+
+    # write a chunk of (content, artifact type, attributes, derived, dedup key)
+    # tuples.  Only ever called on the writer thread.  Returns the number of
+    # rows written, counting duplicates that were folded into an existing
+    # artifact.
+    def write(self, pending):
+        if self.dedup is None:
+            return self._write(pending)
+        # the writers of other ingest jobs share the dedup index, and two of
+        # them creating the same new message at once would both miss it
+        with self.dedup.lock:
+            return self._write(pending)
 
+    def _write(self, pending):
+        rowCount = len(pending)
+
+        # leave out rows the case already has
+        alsoPresent = []
+        fingerprints = []
+        occurrences = []
+        if self.dedup is not None:
+            with self.metrics.stage("dedup"):
+                pending, alsoPresent, fingerprints, occurrences = self._dedup(pending)
+
+        # add the derived files for offloaded bodies and headers first, the
+        # artifacts refer to them by object ID
+        with self.metrics.stage("derived files"):
+            rows = []
+            parents = {}
+            for content, artifactType, attributes, derived, dedupKey in pending:
+                for parent, name, relPath, size, existed, sourceType, fileIdType in derived:
+                    indexed = sourceType.getTypeName() not in self.excludedTypes
+                    fileId = self._derivedFile(parent, name, relPath, size, existed, indexed, parents)
+                    if fileId is not None:
+                        attributes.append(BlackboardAttribute(fileIdType, ProtonMailDataSourceIngestModuleFactory.moduleName, Long(fileId)))
+                rows.append((content, artifactType, attributes))
+            pending = rows
+            for parent in parents.values():
+                IngestServices.getInstance().fireModuleContentEvent(ModuleContentEvent(parent))
+
+        # split off the attributes that have to stay out of the keyword index
+        deferred = []
+        if self.indexExcluded:
+            for i, (content, artifactType, attributes) in enumerate(pending):
+                kept = []
+                excluded = []
+                for attribute in attributes:
+                    if attribute.getAttributeType().getTypeName() in self.indexExcluded:
+                        excluded.append(attribute)
+                    else:
+                        kept.append(attribute)
+                if excluded:
+                    pending[i] = (content, artifactType, kept)
+                deferred.append(excluded)
+
+        artifacts = []
+        # anything that stops us short of the commit, not just the errors
+        # handled here, rolls the chunk back
+        committed = False
+        transaction = self.skCase.beginTransaction()
+        try:
+            with self.metrics.stage("artifact creation"):
+                for content, artifactType, attributes in pending:
+                    artifacts.append(self.blackboard.newDataArtifact(artifactType,
+                                                                     content.getId(),
+                                                                     content.getDataSourceObjectId(),
+                                                                     attributes,
+                                                                     None,
+                                                                     transaction))
+                if alsoPresent:
+                    found = self._artifacts([artifactId for artifactId, attributes in alsoPresent])
+                    for artifactId, attributes in alsoPresent:
+                        if artifactId in found:
+                            found[artifactId].addAttributes(attributes, transaction)
+            with self.metrics.stage("commit"):
+                transaction.commit()
+                committed = True
+        except (TskCoreException, BlackboardException) as e:
+            self.log(Level.SEVERE, "Failed to write " + str(len(pending)) + " artifact(s), rolling back (" + e.getMessage() + ")")
+            self.failedCount += rowCount
+            self.metrics.count("artifacts failed", rowCount)
+            return 0
+        finally:
+            if not committed:
+                self._rollback(transaction)
+        self.artifactCount += len(artifacts)
+        self.duplicateCount += rowCount - len(artifacts)
+        self.metrics.count("artifacts written", len(artifacts))
+        self.metrics.count("duplicates merged", rowCount - len(artifacts))
+
+        if self.accounts is not None:
+            with self.metrics.stage("relationships"):
+                self.accounts.addRelationships(pending, artifacts)
+
+        # artifacts whose held back attributes didn't make it count as failed,
+        # so the ledger has their database read again
+        incomplete = set()
+        with self.metrics.stage("indexing"):
+            if self.index:
+                self._post(artifacts)
+                if not self._attachDeferred(artifacts, deferred):
+                    incomplete = set([i for i, attributes in enumerate(deferred) if attributes])
+            else:
+                self._announce(pending, artifacts)
+        if incomplete:
+            self.failedCount += len(incomplete)
+            self.metrics.count("artifacts failed", len(incomplete))
+
+        # only now that they're committed can others be deduplicated against.
+        # Incomplete ones are left out so the next run writes them again.
+        fingerprints = [entry for entry in fingerprints if entry[1] not in incomplete]
+        if fingerprints or occurrences:
+            self.dedup.add([(fp, artifacts[i].getArtifactID(), objId, rowKey) for fp, i, objId, rowKey in fingerprints],
+                           occurrences)
+            for fp, i, objId, rowKey in fingerprints:
+                self._cacheArtifact(artifacts[i])
+        return rowCount - len(incomplete)
+
+    # Split 'pending' into the rows to create and the duplicates.  A duplicate
+    # of a row in the index adds an "also present in" attribute to the indexed
+    # artifact, a duplicate of an earlier row in the same chunk adds it to that
+    # row.  A row that was already seen, the same row of the same database (a
+    # re-run), is dropped.  Another row of a database the message was already
+    # found in isn't a copy of it and gets an artifact of its own.  Returns the
+    # rows to create, (artifact ID, attributes) for existing artifacts,
+    # (fingerprint, row index, object ID, row key) for each created row that
+    # should go in the index, and (fingerprint, object ID, row key) for every
+    # other row that matched one.
+    def _dedup(self, pending):
+        known = self.dedup.lookup([row[4][0] for row in pending if row[4] is not None])
+        moduleName = ProtonMailDataSourceIngestModuleFactory.moduleName
+        kept = []
+        fingerprints = []
+        firstInChunk = {}
+        alsoPresent = {}
+        occurrences = []
+        for row in pending:
+            content, artifactType, attributes, derived, dedupKey = row
+            if dedupKey is None:
+                kept.append(row)
+                continue
+            fp, alsoPresentType, rowKey = dedupKey
+            objId = content.getId()
+            occurrence = (objId, rowKey)
+            if fp in known:
+                first = None
+                artifactId, seen = known[fp]
+            elif fp in firstInChunk:
+                first, seen = firstInChunk[fp]
+            else:
+                firstInChunk[fp] = (row, set([occurrence]))
+                fingerprints.append((fp, len(kept), objId, rowKey))
+                kept.append(row)
+                continue
+            # a row key of None is from an index that only kept databases
+            if occurrence in seen or (objId, None) in seen:
+                continue
+            sameDatabase = objId in [seenObjId for seenObjId, seenRowKey in seen]
+            seen.add(occurrence)
+            occurrences.append((fp, objId, rowKey))
+            if sameDatabase:
+                kept.append(row)
+                continue
+            attribute = BlackboardAttribute(alsoPresentType, moduleName, self._uniquePath(content))
+            if first is None:
+                alsoPresent.setdefault(artifactId, []).append(attribute)
+            else:
+                first[2].append(attribute)
+        return kept, list(alsoPresent.items()), fingerprints, occurrences
+
+    # The artifacts with 'artifactIds', by ID, from the cache where they're
+    # still in it and from the case database in one query otherwise.  One
+    # that's no longer in the case is logged and left out.
+    def _artifacts(self, artifactIds):
+        found = {}
+        missing = []
+        for artifactId in artifactIds:
+            artifact = self.artifactCache.get(artifactId)
+            if artifact is None:
+                missing.append(artifactId)
+            else:
+                found[artifactId] = artifact
+        if missing:
+            # the clause goes straight after "FROM blackboard_artifacts"
+            whereClause = "WHERE artifact_id IN (" + ", ".join([str(artifactId) for artifactId in missing]) + ")"
+            for artifact in self.skCase.getMatchingArtifacts(whereClause):
+                found[artifact.getArtifactID()] = artifact
+        for artifactId in artifactIds:
+            if artifactId in found:
+                self._cacheArtifact(found[artifactId])
+            else:
+                self.log(Level.WARNING, "Artifact " + str(artifactId) + " is no longer in the case, not adding where " +
+                         "its duplicates were found")
+        return found
+
+    # keep 'artifact' for later duplicates, dropping the least recently used
+    # one once there are DEDUP_ARTIFACT_CACHE
+    def _cacheArtifact(self, artifact):
+        artifactId = artifact.getArtifactID()
+        self.artifactCache.pop(artifactId, None)
+        self.artifactCache[artifactId] = artifact
+        while len(self.artifactCache) > DEDUP_ARTIFACT_CACHE:
+            self.artifactCache.popitem(False)
+
+    # where a duplicate was found, as shown in its "also present in" attribute
+    def _uniquePath(self, content):
+        path = self.uniquePaths.get(content.getId())
+        if path is None:
+            try:
+                path = content.getUniquePath()
+            except TskCoreException:
+                path = content.getName() + " (" + str(content.getId()) + ")"
+            self.uniquePaths[content.getId()] = path
+        return path
+
+    # The object ID of the derived file 'name', adding it under 'parent' if this
+    # is the first time it's been seen, and queueing it for the ingest job if
+    # it's 'indexed'.  A file that was already on disk may have been added by
+    # an earlier run, so look for it before adding another.
+    def _derivedFile(self, parent, name, relPath, size, existed, indexed, parents):
+        fileId = self.derivedFiles.get(name)
+        if fileId is not None:
+            return fileId
+        try:
+            if existed:
+                found = self.skCase.findAllFilesWhere("name = '" + name + "'")
+                if found:
+                    fileId = found[0].getId()
+            if fileId is None:
+                derivedFile = self.skCase.addDerivedFile(name, relPath, size,
+                                                         0, 0, 0, 0, True, parent, "",
+                                                         ProtonMailDataSourceIngestModuleFactory.moduleName,
+                                                         ProtonMailDataSourceIngestModuleFactory.moduleVersion,
+                                                         "", TskData.EncodingType.NONE)
+                fileId = derivedFile.getId()
+                if indexed:
+                    with self.newFilesLock:
+                        self.newFiles.append(derivedFile)
+                parents[parent.getId()] = parent
+                self.metrics.count("derived files added")
+        except TskCoreException as e:
+            self.log(Level.WARNING, "Unable to add derived file " + name + " (" + e.getMessage() + ")")
+            return None
+        self.derivedFiles[name] = fileId
+        return fileId
+
+    def _rollback(self, transaction):
+        try:
+            transaction.rollback()
+        except TskCoreException as e:
+            self.log(Level.SEVERE, "Rollback failed (" + e.getMessage() + ")")
+
+    # index the chunk for keyword search and let the UI know about it
+    def _post(self, artifacts):
+        try:
+            self.blackboard.postArtifacts(artifacts, ProtonMailDataSourceIngestModuleFactory.moduleName)
+        except BlackboardException as e:
+            self.log(Level.WARNING, "Unable to index " + str(len(artifacts)) + " artifact(s) (" + e.getMessage() + ")")
+
+    # add the attributes that were held back from the index.  Returns False if
+    # they couldn't be added.
+    def _attachDeferred(self, artifacts, deferred):
+        if not any(deferred):
+            return True
+        committed = False
+        transaction = self.skCase.beginTransaction()
+        try:
+            for art, attributes in zip(artifacts, deferred):
+                if attributes:
+                    art.addAttributes(attributes, transaction)
+            transaction.commit()
+            committed = True
+        except TskCoreException as e:
+            self.log(Level.SEVERE, "Failed to add unindexed attributes, rolling back (" + e.getMessage() + ")")
+        finally:
+            if not committed:
+                self._rollback(transaction)
+        return committed
+
+    # one event per artifact type for the whole chunk, used when not indexing
+    def _announce(self, pending, artifacts):
+        byType = {}
+        order = []
+        for (content, artifactType, attributes), art in zip(pending, artifacts):
+            typeName = artifactType.getTypeName()
+            if typeName not in byType:
+                byType[typeName] = (artifactType, [])
+                order.append(typeName)
+            byType[typeName][1].append(art)
+        for typeName in order:
+            artifactType, typeArtifacts = byType[typeName]
+            IngestServices.getInstance().fireModuleDataEvent(
+                ModuleDataEvent(ProtonMailDataSourceIngestModuleFactory.moduleName, artifactType, typeArtifacts))
+
+
+# Runs ProtonMailArtifactWriter.write() for one chunk on the writer thread
+class ProtonMailWriteTask(Callable):
+
+    def __init__(self, writer, pending):
+        self.writer = writer
+        self.pending = pending
+
+    def call(self):
+        return self.writer.write(self.pending)
+
+
+# Artifacts queued by one worker.  Full chunks are handed to the shared writer
+# while the worker carries on reading; at most one chunk per worker is in
+# flight so a slow writer holds the workers back instead of piling up memory.
+class ProtonMailArtifactBatch(object):
+
+    def __init__(self, writer, batchSize):
+        self.writer = writer
+        self.batchSize = max(1, batchSize)
+        self.pending = []
+        self.inFlight = None
+        self.inFlightCount = 0
+        self.artifactCount = 0
+        self.failedCount = 0
+        self.waitSeconds = 0.0
+
+    # queue an artifact of the given type with its attributes on 'content'.
+    # 'derived' lists the offloaded values the artifact refers to and
+    # 'dedupKey' is None or its (fingerprint, also present in attribute type,
+    # row key), the row key telling rows of the same database apart.
+    def add(self, content, artifactType, attributes, derived=(), dedupKey=None):
+        self.pending.append((content, artifactType, attributes, derived, dedupKey))
+        if len(self.pending) >= self.batchSize:
+            self.flush()
+
+    # send everything queued so far to the writer
+    def flush(self):
+        if not self.pending:
+            return
+        self._wait()
+        self.inFlight = self.writer.submit(self.pending)
+        self.inFlightCount = len(self.pending)
+        self.pending = []
+
+    # flush and wait until this worker's artifacts are all written
+    def close(self):
+        self.flush()
+        self._wait()
+
+    def _wait(self):
+        if self.inFlight is None:
+            return
+        started = System.nanoTime()
+        written = self.inFlight.get()
+        waited = (System.nanoTime() - started) / 1e9
+        self.waitSeconds += waited
+        self.writer.metrics.addTime("waiting for writer", waited)
+        self.artifactCount += written
+        self.failedCount += self.inFlightCount - written
+        self.inFlight = None
+
+
+# Runs ProtonMailDatabaseParser.processDatabase() for one file on a worker
+# thread
+class ProtonMailDatabaseTask(Callable):
+
+    def __init__(self, module, file, sidecars, mappings, writer, ledger):
+        self.module = module
+        self.file = file
+        self.sidecars = sidecars
+        self.mappings = mappings
+        self.writer = writer
+        self.ledger = ledger
+
+    def call(self):
+        started = System.nanoTime()
+        try:
+            self.module.processDatabase(self.file, self.sidecars, self.mappings, self.writer, self.ledger)
+        finally:
+            self.module.metrics.database(self.file, (System.nanoTime() - started) / 1e9)
+            if self.module.plan is not None:
+                self.module.plan.done(self.file)
+
+
+# The data source module's estimate of the work in its databases, in rows.
+# Before anything is copied each database is guessed at from its size, with
+# its WAL and journal, at PLAN_BYTES_PER_ROW, or at the bytes per row of the
+# databases probed so far once there are some.  When a worker opens one,
+# probe() replaces the guess with the rowid range of each table past what the
+# ledger says was read before, and once it's finished done() replaces that
+# with the work actually done.  A database that will be carved has its rows
+# counted again for the carve, weighted by how much slower carving has been
+# than reading so far (PLAN_CARVE_WEIGHT until both have been timed).
+# Workers report rows read and carved, and the time they took, with
+# advance(), and the module turns the totals into progress with status().
+class ProtonMailWorkPlan(object):
+
+    def __init__(self, files, sidecars, ledger):
+        self._lock = threading.Lock()
+        self.sizes = {}
+        self.carving = set()
+        for file in files:
+            found = sidecars.get(file.getParentPath(), {})
+            self.sizes[file.getId()] = file.getSize() + sum([sidecar.getSize() for sidecar in found.values()])
+            if CARVE_DELETED_RECORDS and (ledger is None or not ledger.wasCarved(file)):
+                self.carving.add(file.getId())
+        self.files = sorted(files, key=lambda file: -self.sizes[file.getId()])
+        self.probed = {}
+        self.finished = set()
+        self.rowsRead = {}
+        self.rowsCarved = {}
+        self.probedBytes = 0
+        self.probedRows = 0
+        self.readRows = 0
+        self.readSeconds = 0.0
+        self.carvedRows = 0
+        self.carveSeconds = 0.0
+        self.started = time.time()
+
+    # Estimate the rows left in the open database 'file' from the rowid range
+    # of each table.  A rowid range counts deleted rows too, so it errs on
+    # the high side.
+    def probe(self, file, query, mappings, lastRowids):
+        rows = 0
+        for mapping in mappings:
+            try:
+                first = query('select min(rowid) from "' + mapping.table + '" where rowid > ?;',
+                              (lastRowids.get(mapping.table, 0),))[0][0]
+                last = query('select max(rowid) from "' + mapping.table + '";')[0][0]
+            except ProtonMailQueryError:
+                # no such table
+                continue
+            if first is not None and last is not None:
+                rows += last - first + 1
+        with self._lock:
+            self.probed[file.getId()] = rows
+            # only whole databases say how big a row is
+            if not lastRowids:
+                self.probedBytes += self.sizes[file.getId()]
+                self.probedRows += rows
+
+    # 'rows' more rows of 'file' read (or carved) in 'seconds'
+    def advance(self, file, rows, seconds, carving=False):
+        with self._lock:
+            if carving:
+                self.rowsCarved[file.getId()] = self.rowsCarved.get(file.getId(), 0) + rows
+                self.carvedRows += rows
+                self.carveSeconds += seconds
+            else:
+                self.rowsRead[file.getId()] = self.rowsRead.get(file.getId(), 0) + rows
+                self.readRows += rows
+                self.readSeconds += seconds
+
+    # the rows' worth of 'file' in 'windowSize' bytes of it, for the carver
+    def carveStep(self, file, windowSize):
+        with self._lock:
+            rows = self.probed.get(file.getId(), self.sizes[file.getId()] // self._bytesPerRow())
+            return max(1, rows * windowSize // max(1, self.sizes[file.getId()]))
+
+    def done(self, file):
+        with self._lock:
+            self.finished.add(file.getId())
+
+    def _bytesPerRow(self):
+        if self.probedRows > 0:
+            return max(1, self.probedBytes // self.probedRows)
+        return PLAN_BYTES_PER_ROW
+
+    def _carveWeight(self):
+        if self.readRows > 0 and self.readSeconds > 0 and self.carvedRows > 0:
+            return max(0.1, (self.carveSeconds / self.carvedRows) / (self.readSeconds / self.readRows))
+        return PLAN_CARVE_WEIGHT
+
+    # (work done, estimated work in all, estimated seconds left or None),
+    # the work in rows read
+    def status(self):
+        with self._lock:
+            bytesPerRow = self._bytesPerRow()
+            carveWeight = self._carveWeight()
+            done = 0.0
+            total = 0.0
+            for file in self.files:
+                fileId = file.getId()
+                rowsRead = self.rowsRead.get(fileId, 0)
+                rowsCarved = self.rowsCarved.get(fileId, 0)
+                done += rowsRead + carveWeight * rowsCarved
+                if fileId in self.finished:
+                    total += rowsRead + carveWeight * rowsCarved
+                    continue
+                rows = self.probed.get(fileId, self.sizes[fileId] // bytesPerRow)
+                total += max(rowsRead, rows)
+                if fileId in self.carving:
+                    total += carveWeight * max(rowsCarved, rows)
+        total = max(total, 1)
+        remaining = None
+        elapsed = time.time() - self.started
+        if done > 0 and elapsed > 0:
+            remaining = (total - done) * elapsed / done
+        return int(min(done, total)), int(total), remaining
+
+
+# Remembers which 'proton.db' files have been ingested into this case, keyed by
+# object ID and checked against size and MD5 (of the database and its sidecar
+# files), along with the highest rowid read from each table and whether its
+# deleted rows have been recovered.  Kept as JSON in the case module directory so it
+# survives between ingest runs.
+class ProtonMailIngestLedger(object):
+    fileName = "ingest_ledger.json"
+
+    # the ledger of each case, by path, shared by every job so one job's save
+    # doesn't write over another's entries
+    _lock = threading.Lock()
+    _ledgers = {}
+
+    def __init__(self, path, logger, databases):
+        self.path = path
+        self._logger = logger
+        self.databases = databases
+        self.lock = threading.Lock()
+
+    def log(self, level, msg):
+        self._logger.logp(level, self.__class__.__name__, inspect.stack()[1][3], msg)
+
+    @staticmethod
+    def load(logger):
+        path = os.path.join(moduleOutputDirectory(), ProtonMailIngestLedger.fileName)
+        with ProtonMailIngestLedger._lock:
+            ledger = ProtonMailIngestLedger._ledgers.get(path)
+            if ledger is None:
+                ledger = ProtonMailIngestLedger._read(path, logger)
+                ProtonMailIngestLedger._ledgers = {path: ledger}
+            return ledger
+
+    @staticmethod
+    def _read(path, logger):
+        databases = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    databases = json.load(f)["databases"]
+            except (IOError, ValueError, KeyError) as e:
+                logger.logp(Level.WARNING, "ProtonMailIngestLedger", "load",
+                            "Ignoring unreadable ingest ledger " + path + " (" + str(e) + ")")
+        return ProtonMailIngestLedger(path, logger, databases)
+
+    # True if 'file' was fully ingested before and hasn't changed since
+    def isUnchanged(self, file, md5):
+        with self.lock:
+            entry = self.databases.get(str(file.getId()))
+        return entry is not None and entry["size"] == file.getSize() and entry["md5"] == md5
+
+    # highest rowid ingested from each table of 'file', empty if it's new
+    def lastRowids(self, file):
+        with self.lock:
+            entry = self.databases.get(str(file.getId()))
+        if entry is None:
+            return {}
+        return dict(entry["rowids"])
+
+    # True if the deleted rows of 'file' were recovered on an earlier run
+    def wasCarved(self, file):
+        with self.lock:
+            entry = self.databases.get(str(file.getId()))
+        return entry is not None and entry.get("carved", False)
+
+    # note that 'file' has been ingested up to 'rowids' and save the ledger
+    def record(self, file, md5, rowids, carved=False):
+        with self.lock:
+            self.databases[str(file.getId())] = {"name": file.getName(),
+                                                 "size": file.getSize(),
+                                                 "md5": md5,
+                                                 "rowids": rowids,
+                                                 "carved": carved}
+            self._save()
+
+    # write to a temp file first so a crash can't leave a half written ledger
+    def _save(self):
+        tmpPath = self.path + ".tmp"
+        try:
+            with open(tmpPath, "w") as f:
+                json.dump({"version": 1, "databases": self.databases}, f, indent=1, sort_keys=True)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmpPath, self.path)
+        except (IOError, OSError) as e:
+            self.log(Level.WARNING, "Unable to save the ingest ledger " + self.path + " (" + str(e) + ")")
+
+
+# Timings and counts for one ingest job, shared by the workers and the writer
+# thread.  Stage times are summed over every thread that ran the stage, so with
+# several workers they can add up to more than the job's wall clock time.
+class ProtonMailIngestMetrics(object):
+    directoryName = "metrics"
+
+    def __init__(self, dataSource):
+        self.lock = threading.Lock()
+        self.dataSourceName = dataSource.getName()
+        self.dataSourceId = dataSource.getId()
+        self.started = time.time()
+        self.startedNanos = System.nanoTime()
+        self.wallSeconds = None
+        self.cancelled = False
+
+        # stage -> [seconds, calls] and counter -> value, in the order first seen
+        self.stages = {}
+        self.stageOrder = []
+        self.counters = {}
+        self.counterOrder = []
+        self.databases = []
+
+    # a 'with' block timed as 'name'
+    def stage(self, name):
+        return ProtonMailStageTimer(self, name)
+
+    def addTime(self, name, seconds):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = [0.0, 0]
+                self.stageOrder.append(name)
+            stage[0] += seconds
+            stage[1] += 1
+
+    def count(self, name, amount=1):
+        with self.lock:
+            if name not in self.counters:
+                self.counters[name] = 0
+                self.counterOrder.append(name)
+            self.counters[name] += amount
+
+    # note how long one database took from start to finish
+    def database(self, file, seconds):
+        with self.lock:
+            self.databases.append({"id": file.getId(),
+                                   "name": file.getName(),
+                                   "path": file.getParentPath(),
+                                   "size": file.getSize(),
+                                   "seconds": round(seconds, 3)})
+
+    def finish(self, cancelled):
+        self.wallSeconds = (System.nanoTime() - self.startedNanos) / 1e9
+        self.cancelled = cancelled
+
+    # one line for the ingest inbox
+    def subject(self):
+        return "Wrote %d artifact(s) from %d database(s) in %.1f s%s" % (
+            self.counters.get("artifacts written", 0), self.counters.get("databases ingested", 0),
+            self.wallSeconds, " (cancelled)" if self.cancelled else "")
+
+    # the stage times and counters as HTML tables for the inbox message
+    def detailsHtml(self):
+        rows = ["<tr><td>%s</td><td align=\"right\">%.3f s</td><td align=\"right\">%d</td></tr>" %
+                (name, self.stages[name][0], self.stages[name][1]) for name in self.stageOrder]
+        counts = ["<tr><td>%s</td><td align=\"right\">%d</td></tr>" % (name, self.counters[name])
+                  for name in self.counterOrder]
+        return ("<p>Wall clock time %.3f s. Stage times are summed over all threads.</p>" % self.wallSeconds +
+                "<table><tr><th>Stage</th><th>Time</th><th>Calls</th></tr>" + "".join(rows) + "</table>" +
+                "<table><tr><th>Count</th><th></th></tr>" + "".join(counts) + "</table>")
+
+    # finish, save and post the metrics to the ingest inbox
+    def report(self, logger, cancelled):
+        self.finish(cancelled)
+        self.save(logger)
+        IngestServices.getInstance().postMessage(IngestMessage.createMessage(IngestMessage.MessageType.INFO,
+                                                                             "ProtonMail",
+                                                                             self.subject(),
+                                                                             self.detailsHtml()))
+
+    # write the metrics to a new JSON file named after the start time and
+    # data source.  Returns its path, or None if it couldn't be written.
+    def save(self, logger):
+        directory = os.path.join(moduleOutputDirectory(), self.directoryName)
+        path = os.path.join(directory, "metrics-%s-%d.json" % (time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)),
+                                                               self.dataSourceId))
+        metrics = {"version": 1,
+                   "moduleVersion": ProtonMailDataSourceIngestModuleFactory.moduleVersion,
+                   "dataSource": self.dataSourceName,
+                   "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                   "wallSeconds": round(self.wallSeconds, 3),
+                   "cancelled": self.cancelled,
+                   "settings": {"workerCount": WORKER_COUNT,
+                                "pageSize": PAGE_SIZE,
+                                "fetchSize": FETCH_SIZE,
+                                "artifactBatchSize": ARTIFACT_BATCH_SIZE,
+                                "indexArtifacts": INDEX_ARTIFACTS,
+                                "offloadLargeFields": OFFLOAD_LARGE_FIELDS,
+                                "dedupMessages": DEDUP_MESSAGES,
+                                "carveDeletedRecords": CARVE_DELETED_RECORDS},
+                   "stages": dict([(name, {"seconds": round(seconds, 3), "calls": calls})
+                                   for name, (seconds, calls) in self.stages.items()]),
+                   "counters": self.counters,
+                   "databases": self.databases}
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(path, "w") as f:
+                json.dump(metrics, f, indent=1, sort_keys=True)
+        except (IOError, OSError) as e:
+            logger.logp(Level.WARNING, "ProtonMailIngestMetrics", "save",
+                        "Unable to write ingest metrics " + path + " (" + str(e) + ")")
+            return None
+        return path
+
+
+# Adds the time spent in a 'with' block to a stage of ProtonMailIngestMetrics
+class ProtonMailStageTimer(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = System.nanoTime()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.metrics.addTime(self.name, (System.nanoTime() - self.started) / 1e9)
+        return False
+
+
+# The messages already added to this case, as a fingerprint -> (artifact ID,
+# object ID and row key of the row it came from) table plus the other rows,
+# from this or other databases, each was also found in, kept in a SQLite
+# database in the case module directory so it lasts as long as the case does.  A bit filter
+# kept in memory answers "never seen" for most new rows without touching the
+# index; only possible hits are looked up, a chunk at a time.  Memory use is
+# the filter plus one chunk, however many messages the case has.  Ingest jobs
+# running at the same time share the case's one index, see acquire(), and
+# their writer threads take turns with 'lock'.
+class ProtonMailDedupIndex(object):
+    fileName = "dedup_index.db"
+
+    # the open index of each case, by path
+    _lock = threading.Lock()
+    _shared = {}
+
+    # bit positions probed for each fingerprint
+    hashCount = 4
+
+    # fingerprints per lookup query, well under SQLite's parameter limit
+    lookupSize = 500
+
+    def __init__(self, path, dbConn, logger):
+        self.path = path
+        self.dbConn = dbConn
+        self._logger = logger
+        self.lock = threading.RLock()
+        self.references = 0
+        self.bitCount = max(8, DEDUP_FILTER_BITS)
+        self.bits = bytearray((self.bitCount + 7) // 8)
+
+    def log(self, level, msg):
+        self._logger.logp(level, self.__class__.__name__, inspect.stack()[1][3], msg)
+
+    # the case's index, opened by the first job to ask for it.  Each call is
+    # matched by a release().
+    @staticmethod
+    def acquire(logger):
+        path = os.path.join(moduleOutputDirectory(), ProtonMailDedupIndex.fileName)
+        with ProtonMailDedupIndex._lock:
+            index = ProtonMailDedupIndex._shared.get(path)
+            if index is None:
+                index = ProtonMailDedupIndex._open(path, logger)
+                ProtonMailDedupIndex._shared[path] = index
+            index.references += 1
+            return index
+
+    # done with the index, which is closed once no job is using it
+    def release(self):
+        with ProtonMailDedupIndex._lock:
+            self.references -= 1
+            if self.references > 0:
+                return
+            del ProtonMailDedupIndex._shared[self.path]
+        with self.lock:
+            self.dbConn.close()
+
+    # open (or create) the index at 'path' and load it into the filter
+    @staticmethod
+    def _open(path, logger):
+        Class.forName("org.sqlite.JDBC").newInstance()
+        dbConn = DriverManager.getConnection("jdbc:sqlite:%s" % path)
+        statement = dbConn.createStatement()
+        try:
+            statement.executeUpdate("create table if not exists fingerprint (" +
+                                    "fp integer primary key, artifact_id integer not null, obj_id integer not null, " +
+                                    "row_key text);")
+            statement.executeUpdate("create table if not exists occurrence (" +
+                                    "fp integer not null, obj_id integer not null, row_key text, " +
+                                    "primary key (fp, obj_id, row_key));")
+
+            # an index from before row keys only knew which databases a
+            # message was in, which its rows keep as a row key of NULL
+            columns = []
+            resultSet = statement.executeQuery("PRAGMA table_info(fingerprint);")
+            while resultSet.next():
+                columns.append(resultSet.getString(2).lower())
+            resultSet.close()
+            if "row_key" not in columns:
+                statement.executeUpdate("alter table fingerprint add column row_key text;")
+            resultSet = statement.executeQuery("select 1 from sqlite_master where type = 'table' and name = 'copy';")
+            legacyCopies = resultSet.next()
+            resultSet.close()
+            if legacyCopies:
+                statement.executeUpdate("insert into occurrence (fp, obj_id, row_key) select fp, obj_id, null from copy;")
+                statement.executeUpdate("drop table copy;")
+        finally:
+            statement.close()
+        dbConn.setAutoCommit(False)
+
+        index = ProtonMailDedupIndex(path, dbConn, logger)
+        statement = dbConn.createStatement()
+        try:
+            statement.setFetchSize(FETCH_SIZE)
+            resultSet = statement.executeQuery("select fp from fingerprint;")
+            while resultSet.next():
+                index._remember(resultSet.getLong(1))
+            resultSet.close()
+        finally:
+            statement.close()
+        return index
+
+    # (artifact ID, set of (object ID, row key) it was seen in) for each of
+    # 'fingerprints' already in the index
+    def lookup(self, fingerprints):
+        maybe = [fp for fp in set(fingerprints) if self._mightContain(fp)]
+        known = {}
+        with self.lock:
+            try:
+                for start in range(0, len(maybe), self.lookupSize):
+                    group = maybe[start:start + self.lookupSize]
+                    params = ", ".join(["?"] * len(group))
+                    query = self.dbConn.prepareStatement("select fp, artifact_id, obj_id, row_key from fingerprint where fp in (" + params + ") " +
+                                                         "union all select fp, null, obj_id, row_key from occurrence where fp in (" + params + ");")
                     try:
-                        # get the attributes for the 'contact' table
-                        attPMContactName = skCase.getAttributeType("TSK_PM_CONTACT_NAME")
-                        attPMContactCreateTime = skCase.getAttributeType("TSK_PM_CONTACT_CREATETIME")
-                        attPMContactModifyTime = skCase.getAttributeType("TSK_PM_CONTACT_MODIFYTIME")
-                        # process the 'contact' table
-                        queryContact = sqlQuery.executeQuery("select CreateTime, ModifyTime, Name from contact;")
-                        while queryContact.next():
-                            art = file.newArtifact(artPMContact)
-                            art.addAttribute(BlackboardAttribute(attPMContactName, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContact.getString("Name")))
-                            art.addAttribute(BlackboardAttribute(attPMContactCreateTime, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContact.getInt("CreateTime")))
-                            art.addAttribute(BlackboardAttribute(attPMContactModifyTime, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContact.getInt("ModifyTime")))
-
-                        # get the attributes for the 'contact_data' table
-                        attPMContactDataName = skCase.getAttributeType("TSK_PM_CONTACTDATA_NAME")
-                        attPMContactDataPrimaryEmail = skCase.getAttributeType("TSK_PM_CONTACTDATA_PRIMARYEMAIL")
-                        # process the 'contact_data' table
-                        queryContactData = sqlQuery.executeQuery("select Name, PrimaryEMail from contact_data;")
-                        while queryContactData.next():
-                            art = file.newArtifact(artPMContactData)
-                            art.addAttribute(BlackboardAttribute(attPMContactDataName, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContactData.getString("Name")))
-                            art.addAttribute(BlackboardAttribute(attPMContactDataPrimaryEmail, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContactData.getString("PrimaryEmail")))
-
-
-                        # get the attributes for the 'contact_emails' table
-                        attPMContactEmailsName = skCase.getAttributeType("TSK_PM_CONTACTEMAILS_NAME")
-                        attPMContactEmailsEmail = skCase.getAttributeType("TSK_PM_CONTACTEMAILS_EMAIL")
-                        # process the 'contact_emails' table
-                        queryContactEmails = sqlQuery.executeQuery("select Name, Email from contact_emails;")
-                        while queryContactEmails.next():
-                            art = file.newArtifact(artPMContactEmails)
-                            art.addAttribute(BlackboardAttribute(attPMContactEmailsName, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContactEmails.getString("Name")))
-                            art.addAttribute(BlackboardAttribute(attPMContactEmailsEmail, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContactEmails.getString("Email")))
-
-                        # get the attributes for the 'label' table
-                        attPMContactLabelName = skCase.getAttributeType("TSK_PM_CONTACTLABEL_NAME")
-                        attPMContactLabelColor = skCase.getAttributeType("TSK_PM_CONTACTLABEL_COLOR")
-                        # process the 'label' table
-                        queryContactLabel = sqlQuery.executeQuery("select Name, Color from label;")
-                        while queryContactLabel.next():
-                            art = file.newArtifact(artPMContactLabel)
-                            art.addAttribute(BlackboardAttribute(attPMContactLabelName, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContactEmails.getString("Name")))
-                            art.addAttribute(BlackboardAttribute(attPMContactLabelColor, ProtonMailDataSourceIngestModuleFactory.moduleName, queryContactEmails.getString("Color")))
-
-                        # get the attributes for the 'message' table
-                        attPMContactMessageBCCList = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_BCCLIST")
-                        attPMContactMessageBody = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_BODY")
-                        attPMContactMessageCCList = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_CCLIST")
-                        attPMContactMessageHeader = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_HEADER")
-                        attPMContactMessageIsDownloaded = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_ISDOWNLOADED")
-                        attPMContactMessageIsEncrypted = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_ISENCRYPTED")
-                        attPMContactMessageIsForwarded = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_ISFORWARDED")
-                        attPMContactMessageIsRead = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_ISREAD")
-                        attPMContactMessageIsReplied = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_ISREPLIED")
-                        attPMContactMessageIsRepliedAll = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_ISREPLIEDALL")
-                        attPMContactMessageReplyTo = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_REPLYTO")
-                        attPMContactMessageSenderAddress = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_SENDERADDRESS")
-                        attPMContactMessageSenderName = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_SENDERNAME")
-                        attPMContactMessageTotalSize = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_TOTALSIZE")
-                        attPMContactMessageSpamScore = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_SPAMSCORE")
-                        attPMContactMessageStarred = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_STARRED")
-                        attPMContactMessageSubject = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_SUBJECT")
-                        attPMContactMessageTime = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_TIME")
-                        attPMContactMessageTo = skCase.getAttributeType("TSK_PM_CONTACTMESSAGE_TO")
-                        # process the 'message' table
-                        queryContactMessage = sqlQuery.executeQuery("select BCCListString, Body, CCListString, Header, IsDownloaded, \
-                        IsEncrypted, IsForwarded, IsRead, IsReplied, IsRepliedAll, ReplyTosString, SenderAddress, SenderName, \
-                        TotalSize, SpamScore, Starred, Subject, Time, ToListString from message;")
-                        while queryContactMessage.next():
-                            art = file.newArtifact(artPMContactMessage)
-                            bcclist = queryContactMessage.getString("BCCListString")
-                            body = queryContactMessage.getString("Body")
-                            cclist = queryContactMessage.getString("CCListString")
-                            header = queryContactMessage.getString("Header")
-                            isdownloaded = queryContactMessage.getString("IsDownloaded")
-                            isencrypted = queryContactMessage.getString("IsEncrypted")
-                            isforwarded = queryContactMessage.getString("IsForwarded")
-                            isread = queryContactMessage.getString("IsRead")
-                            isreplied = queryContactMessage.getString("IsReplied")
-                            isrepliedall = queryContactMessage.getString("IsRepliedAll")
-                            replyto = queryContactMessage.getString("ReplyTosString")
-                            senderaddress = queryContactMessage.getString("SenderAddress")
-                            sendername = queryContactMessage.getString("SenderName")
-                            totalsize = queryContactMessage.getString("TotalSize")
-                            spamscore = queryContactMessage.getString("SpamScore")
-                            starred = queryContactMessage.getString("Starred")
-                            subject = queryContactMessage.getString("Subject")
-                            time = queryContactMessage.getInt("Time")
-                            to = queryContactMessage.getString("ToListString")
-                            art.addAttributes(((BlackboardAttribute(attPMContactMessageTime, ProtonMailDataSourceIngestModuleFactory.moduleName, time)), \
-                                               (BlackboardAttribute(attPMContactMessageTo, ProtonMailDataSourceIngestModuleFactory.moduleName, to)), \
-                                               (BlackboardAttribute(attPMContactMessageReplyTo, ProtonMailDataSourceIngestModuleFactory.moduleName, replyto)), \
-                                               (BlackboardAttribute(attPMContactMessageSenderName, ProtonMailDataSourceIngestModuleFactory.moduleName, sendername)), \
-                                               (BlackboardAttribute(attPMContactMessageSenderAddress, ProtonMailDataSourceIngestModuleFactory.moduleName, senderaddress)), \
-                                               (BlackboardAttribute(attPMContactMessageSubject, ProtonMailDataSourceIngestModuleFactory.moduleName, subject)), \
-                                               (BlackboardAttribute(attPMContactMessageBody, ProtonMailDataSourceIngestModuleFactory.moduleName, body)), \
-                                               (BlackboardAttribute(attPMContactMessageHeader, ProtonMailDataSourceIngestModuleFactory.moduleName, header)), \
-                                               (BlackboardAttribute(attPMContactMessageTotalSize, ProtonMailDataSourceIngestModuleFactory.moduleName, totalsize)), \
-                                               (BlackboardAttribute(attPMContactMessageBCCList, ProtonMailDataSourceIngestModuleFactory.moduleName, bcclist)), \
-                                               (BlackboardAttribute(attPMContactMessageCCList, ProtonMailDataSourceIngestModuleFactory.moduleName, cclist)), \
-                                               (BlackboardAttribute(attPMContactMessageBody, ProtonMailDataSourceIngestModuleFactory.moduleName, body)), \
-                                               (BlackboardAttribute(attPMContactMessageIsDownloaded, ProtonMailDataSourceIngestModuleFactory.moduleName, isdownloaded)), \
-                                               (BlackboardAttribute(attPMContactMessageIsEncrypted, ProtonMailDataSourceIngestModuleFactory.moduleName, isencrypted)), \
-                                               (BlackboardAttribute(attPMContactMessageIsForwarded, ProtonMailDataSourceIngestModuleFactory.moduleName, isforwarded)), \
-                                               (BlackboardAttribute(attPMContactMessageIsRead, ProtonMailDataSourceIngestModuleFactory.moduleName, isread)), \
-                                               (BlackboardAttribute(attPMContactMessageIsReplied, ProtonMailDataSourceIngestModuleFactory.moduleName, isreplied)), \
-                                               (BlackboardAttribute(attPMContactMessageIsRepliedAll, ProtonMailDataSourceIngestModuleFactory.moduleName, isrepliedall)), \
-                                               (BlackboardAttribute(attPMContactMessageSpamScore, ProtonMailDataSourceIngestModuleFactory.moduleName, spamscore))))
-
-                        # get the attributes for the 'notification' table
-                        attPMContactNotificationNotificationBody = skCase.getAttributeType("TSK_PM_CONTACTNOTIFICATION_NOTIFICATIONBODY")
-                        attPMContactNotificationNotificationTitle = skCase.getAttributeType("TSK_PM_CONTACTNOTIFICATION_NOTIFICATIONTITLE")
-                        # process the 'notification' table
-                        queryContactNotification = sqlQuery.executeQuery("select notification_body, notification_title from notification;")
-                        while queryContactNotification.next():
-                            art = file.newArtifact(artPMContactNotification)
-                            notification_body = queryContactNotification.getString("notification_body")
-                            notification_title = queryContactNotification.getString("notification_title")
-                            art.addAttributes(((BlackboardAttribute(attPMContactNotificationNotificationTitle, ProtonMailDataSourceIngestModuleFactory.moduleName, notification_title)), \
-                                               (BlackboardAttribute(attPMContactNotificationNotificationBody, ProtonMailDataSourceIngestModuleFactory.moduleName, notification_body))))
-
-                    except SQLException as e:
-                        self.log(Level.INFO, "SQL Error: " + e.getMessage())
-                except SQLException as e:
-                    self.log(Level.INFO, "Error querying database " + file.getName() + " (" + e.getMessage() + ")")
-
-                # all done?
-                sqlQuery.close()
-                dbConn.close()
-                os.remove(lclDbPath)
+                        for i, fp in enumerate(group):
+                            query.setLong(i + 1, fp)
+                            query.setLong(i + 1 + len(group), fp)
+                        resultSet = query.executeQuery()
+                        while resultSet.next():
+                            fp = resultSet.getLong(1)
+                            entry = known.setdefault(fp, [None, set()])
+                            if resultSet.getObject(2) is not None:
+                                entry[0] = resultSet.getLong(2)
+                            entry[1].add((resultSet.getLong(3), resultSet.getString(4)))
+                        resultSet.close()
+                    finally:
+                        query.close()
+            finally:
+                # autocommit is off, so end the read transaction rather than
+                # keep other connections to the index from writing
+                if maybe:
+                    self.dbConn.rollback()
+        return dict([(fp, tuple(entry)) for fp, entry in known.items() if entry[0] is not None])
 
-            # Update the progress bar
-            progressBar.progress(fileCount)
+    # add (fingerprint, artifact ID, object ID, row key) entries for new
+    # artifacts and (fingerprint, object ID, row key) for the other rows
+    # messages were found in
+    def add(self, entries, occurrences):
+        with self.lock:
+            self._add(entries, occurrences)
 
-        # done processing
-        if numFiles == 0:
-            message = IngestMessage.createMessage(IngestMessage.MessageType.DATA,
-                                                  "ProtonMail",
-                                                  "No files to analyze")
-            PostBoard.postMessage(message)
-        else:
-            message = IngestMessage.createMessage(IngestMessage.MessageType.DATA,
-                                                  "ProtonMail",
-                                                  "Finished to analyze %d file(s)" % fileCount)
-            PostBoard.postMessage(message)
+    def _add(self, entries, occurrences):
+        insert = self.dbConn.prepareStatement("insert or ignore into fingerprint (fp, artifact_id, obj_id, row_key) " +
+                                              "values (?, ?, ?, ?);")
+        insertOccurrence = self.dbConn.prepareStatement("insert or ignore into occurrence (fp, obj_id, row_key) " +
+                                                        "values (?, ?, ?);")
+        try:
+            for fp, artifactId, objId, rowKey in entries:
+                insert.setLong(1, fp)
+                insert.setLong(2, artifactId)
+                insert.setLong(3, objId)
+                insert.setString(4, rowKey)
+                insert.addBatch()
+            insert.executeBatch()
+            for fp, objId, rowKey in occurrences:
+                insertOccurrence.setLong(1, fp)
+                insertOccurrence.setLong(2, objId)
+                insertOccurrence.setString(3, rowKey)
+                insertOccurrence.addBatch()
+            insertOccurrence.executeBatch()
+            self.dbConn.commit()
+        except SQLException as e:
+            # the artifacts are in the case already, we just won't recognise
+            # their duplicates
+            self.log(Level.WARNING, "Unable to update the dedup index (" + e.getMessage() + ")")
+            self.dbConn.rollback()
+            return
+        finally:
+            insert.close()
+            insertOccurrence.close()
+        for fp, artifactId, objId, rowKey in entries:
+            self._remember(fp)
 
-        return IngestModule.ProcessResult.OK
+    # double hashing on the two halves of the fingerprint, which is already a
+    # good hash
+    def _positions(self, fp):
+        low = fp & 0xffffffff
+        high = ((fp >> 32) & 0xffffffff) | 1
+        return [(low + i * high) % self.bitCount for i in range(self.hashCount)]
+
+    def _remember(self, fp):
+        for position in self._positions(fp):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def _mightContain(self, fp):
+        for position in self._positions(fp):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+# The e-mail accounts that turn up in each database, created through the
+# Communications Manager the first time an address is seen in that database
+# and reused after that, and the message relationships between them.  Only
+# used from the writer thread.
+class ProtonMailAccountIndex(object):
+
+    def __init__(self, skCase, logger, metrics):
+        self.manager = skCase.getCommunicationsManager()
+        self._logger = logger
+        self.metrics = metrics
+
+        # (database object ID, address) -> account instance, None if it
+        # couldn't be created
+        self.instances = {}
+
+    def log(self, level, msg):
+        self._logger.logp(level, self.__class__.__name__, inspect.stack()[1][3], msg)
+
+    # Add a relationship between the sender and recipients of each e-mail
+    # message in a committed chunk.  'pending' is the chunk's (content,
+    # artifact type, attributes) and 'artifacts' the artifacts made from it.
+    def addRelationships(self, pending, artifacts):
+        for (content, artifactType, attributes), artifact in zip(pending, artifacts):
+            if artifactType.getTypeName() != "TSK_EMAIL_MSG":
+                continue
+            values = {}
+            for attribute in attributes:
+                values[attribute.getAttributeType().getTypeName()] = attribute
+            senders = self._accounts(content, values, ("TSK_EMAIL_FROM",))
+            recipients = self._accounts(content, values, ("TSK_EMAIL_TO", "TSK_EMAIL_CC", "TSK_EMAIL_BCC"))
+            # reply-to addresses are accounts too, but not recipients
+            self._accounts(content, values, ("TSK_EMAIL_REPLYTO",))
+            sender = senders[0] if senders else None
+            if sender is None and not recipients:
+                continue
+            dateTime = 0
+            if "TSK_DATETIME_SENT" in values:
+                dateTime = values["TSK_DATETIME_SENT"].getValueLong()
+            try:
+                self.manager.addRelationships(sender, recipients, artifact, Relationship.Type.MESSAGE, dateTime)
+                self.metrics.count("relationships added", len(recipients))
+            except (TskCoreException, TskDataException) as e:
+                self.log(Level.WARNING, "Unable to add relationships for artifact " + str(artifact.getArtifactID()) +
+                         " (" + e.getMessage() + ")")
+
+    # the account instances for the addresses in the 'names' attributes, in
+    # order and without repeats
+    def _accounts(self, content, values, names):
+        accounts = []
+        seen = set()
+        for name in names:
+            attribute = values.get(name)
+            if attribute is None:
+                continue
+            for address in emailAddresses(attribute.getValueString()):
+                if address in seen:
+                    continue
+                seen.add(address)
+                instance = self._instance(content, address)
+                if instance is not None:
+                    accounts.append(instance)
+        return accounts
+
+    def _instance(self, content, address):
+        key = (content.getId(), address)
+        if key in self.instances:
+            return self.instances[key]
+        instance = None
+        try:
+            instance = self.manager.createAccountFileInstance(Account.Type.EMAIL, address,
+                                                              ProtonMailDataSourceIngestModuleFactory.moduleName, content)
+            self.metrics.count("accounts added")
+        except (TskCoreException, TskDataException) as e:
+            self.log(Level.WARNING, "Unable to add e-mail account " + address + " (" + e.getMessage() + ")")
+        self.instances[key] = instance
+        return instance
+
+
+# Read the SQLite header straight from 'file' in the image, see
+# parseSqliteHeader().  None when the file isn't a SQLite database.
+def readSqliteHeader(file):
+    size = file.getSize()
+    if size < SQLITE_HEADER_SIZE:
+        return None
+    buf = jarray.zeros(SQLITE_HEADER_SIZE, "b")
+    try:
+        if file.read(buf, 0, SQLITE_HEADER_SIZE) != SQLITE_HEADER_SIZE:
+            return None
+    except TskCoreException:
+        return None
+
+    # Java bytes are signed
+    return parseSqliteHeader([b & 0xff for b in buf], size)
+
+
+# Copy 'file' out of the image to 'path' in COPY_BUFFER_SIZE chunks, checking
+# for cancellation between chunks and feeding 'digest' (a MessageDigest) if
+# one is given.  Returns False if the job was cancelled.
+def copyToLocal(file, path, context, digest=None):
+    size = file.getSize()
+    buf = jarray.zeros(min(COPY_BUFFER_SIZE, max(size, 1)), "b")
+    out = FileOutputStream(path)
+    try:
+        offset = 0
+        while offset < size:
+            if context.isJobCancelled():
+                return False
+            count = file.read(buf, offset, min(len(buf), size - offset))
+            if count <= 0:
+                break
+            out.write(buf, 0, count)
+            if digest is not None:
+                digest.update(buf, 0, count)
+            offset += count
+    finally:
+        out.close()
+    return True
+
+
+# A stable 64 bit fingerprint of a row's key column values, signed so it fits
+# in a SQLite integer
+def fingerprint(values):
+    key = u"\x1f".join([u"" if value is None else u"%s" % (value,) for value in values])
+    fp = int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:16], 16)
+    if fp >= 1 << 63:
+        fp -= 1 << 64
+    return fp
+
+
+# The row key of a carved record for the dedup index: its rowid, or when
+# that's lost a fingerprint of its values, which tells it apart from the
+# database's other carved records the same way the carver does
+def carvedRowKey(rowid, values):
+    if rowid is not None:
+        return u"%d" % (rowid,)
+    return u"carved %d" % (fingerprint(values),)
+
+
+# The columns of 'mapping' (lower-cased) its rows are fingerprinted on, given
+# the lower-cased column names the table actually has.  Empty if the table
+# isn't deduplicated.
+def dedupColumns(mapping, present):
+    if mapping.dedup is None:
+        return set()
+    alsoPresentType, key, fallbackKey = mapping.dedup
+    if all([column.lower() in present for column in key]):
+        return set([column.lower() for column in key])
+    return set([column.lower() for column in fallbackKey])
+
+
+# The ledger's hash for a database and its sidecar files, None if any of
+# their MD5s isn't known
+def contentHash(md5s):
+    if not all(md5s):
+        return None
+    return ",".join(md5s)
+
+
+# Group WAL and journal files by folder, as parent path -> {suffix: file}.
+# Empty ones are left out and allocated copies win over deleted ones in the
+# same folder.
+def groupSidecars(files):
+    sidecars = {}
+    for sidecar in files:
+        suffix = sidecar.getName().lower()[len("proton.db"):]
+        if suffix not in SQLITE_SIDECARS or sidecar.getSize() == 0:
+            continue
+        found = sidecars.setdefault(sidecar.getParentPath(), {})
+        if suffix not in found or sidecar.isMetaFlagSet(TskData.TSK_FS_META_FLAG_ENUM.ALLOC):
+            found[suffix] = sidecar
+    return sidecars
+
+
+# When the TIME_BUDGET_SECONDS of an ingest job starting now are up, None if
+# there's no time budget
+def budgetDeadline():
+    if TIME_BUDGET_SECONDS > 0:
+        return time.time() + TIME_BUDGET_SECONDS
+    return None
+
+
+# Tell the user how many of the 'fileCount' files found were analyzed, or
+# that there were none, and about any that were cut short
+def postFinishedMessages(fileCount, metrics):
+    if fileCount == 0:
+        text = "No files to analyze"
+    else:
+        text = "Finished to analyze %d file(s)" % fileCount
+    IngestServices.getInstance().postMessage(IngestMessage.createMessage(IngestMessage.MessageType.DATA,
+                                                                         "ProtonMail", text))
+    postCutShortMessage(metrics)
+
+
+# Tell the user how many databases MAX_ROWS_PER_TABLE or TIME_BUDGET_SECONDS
+# left partly read or unread, if any
+def postCutShortMessage(metrics):
+    cutShort = metrics.counters.get("databases cut short", 0) + \
+               metrics.counters.get("databases skipped, out of time", 0)
+    if cutShort == 0:
+        return
+    IngestServices.getInstance().postMessage(IngestMessage.createMessage(
+        IngestMessage.MessageType.DATA,
+        "ProtonMail",
+        "%d database(s) were not read to the end because of MAX_ROWS_PER_TABLE or TIME_BUDGET_SECONDS" % cutShort))
+
+
+# 'seconds' as a rough time for the progress bar, like "about 5 min"
+def formatDuration(seconds):
+    if seconds < 60:
+        return "less than a minute"
+    minutes = int(seconds / 60 + 0.5)
+    if minutes < 60:
+        return "about %d min" % minutes
+    return "about %d h %d min" % (minutes // 60, minutes % 60)
+
+
+# Remove the local copy of a database and any sidecar files copied (or made by
+# SQLite) next to it
+def removeLocalCopy(lclDbPath):
+    for suffix in ("",) + SQLITE_SIDECARS + ("-shm",):
+        if os.path.exists(lclDbPath + suffix):
+            os.remove(lclDbPath + suffix)
+
+
+# A value carved from a record as the type the ResultSet getter for
+# 'valueType' would have returned, or None if it can't be
+def carvedValue(value, valueType):
+    if value is None or isinstance(value, bytearray):
+        return None
+    if valueType == "STRING":
+        return u"%s" % (value,)
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    if valueType == "INTEGER":
+        return value
+    return Long(value)
+
+
+# The module's directory under the case's module output directory
+def moduleOutputDirectory():
+    moduleDir = os.path.join(Case.getCurrentCase().getModuleDirectory(),
+                             ProtonMailDataSourceIngestModuleFactory.moduleName)
+    if not os.path.isdir(moduleDir):
+        try:
+            os.makedirs(moduleDir)
+        except OSError:
+            # another thread beat us to it
+            pass
+    return moduleDir
+
+
+# A query function over the JDBC connection 'dbConn' for protonmail_core:
+# query(sql, params) returns the rows as a list of tuples and raises
+# ProtonMailQueryError if SQLite fails.
+def jdbcQuery(dbConn):
+    def query(sql, params=()):
+        try:
+            statement = dbConn.prepareStatement(sql)
+            try:
+                for i, value in enumerate(params):
+                    statement.setObject(i + 1, value)
+                resultSet = statement.executeQuery()
+                count = resultSet.getMetaData().getColumnCount()
+                rows = []
+                while resultSet.next():
+                    rows.append(tuple([resultSet.getObject(i + 1) for i in range(count)]))
+                resultSet.close()
+                return rows
+            finally:
+                statement.close()
+        except SQLException as e:
+            raise ProtonMailQueryError(e.getMessage())
+    return query
+
+
+# Write 'data' to 'path' via a temp file so no one sees it half written.  Two
+# workers may write the same content at once, which is harmless.
+def writeFileAtomically(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # another worker beat us to it
+            pass
+    tmpPath = path + "." + threading.currentThread().getName() + ".tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(data)
+    try:
+        os.rename(tmpPath, path)
+    except OSError:
+        os.remove(tmpPath)
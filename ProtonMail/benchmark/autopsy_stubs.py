@@ -0,0 +1,1129 @@
+# Lightweight local stand-ins for the parts of the Autopsy and Sleuth Kit
+# APIs the ProtonMail module uses, so it can run under plain CPython 3 for
+# benchmarking: SleuthkitCase, Blackboard, FileManager, the progress bar,
+# JDBC (over the sqlite3 module), java.util.concurrent (over
+# concurrent.futures) and a few java.lang / java.io classes.
+#
+# Nothing is patched on import, Autopsy may load this folder.  Call
+# install() before importing ProtonMail.py, then newCase() to set up a case
+# directory with the 'proton.db' files to ingest.
+#
+# Every method that would be a case database call in Autopsy goes through
+# caseDbCall, which counts it in CALLS by "Class.method".  Calls made inside
+# a CaseDbTransaction are counted under "Class.method (transaction)", since
+# those are statements on an open transaction rather than round trips that
+# each commit on their own.
+
+import os
+import sys
+import time
+import types
+import queue
+import shutil
+import fnmatch
+import sqlite3
+import hashlib
+import itertools
+import threading
+import collections
+import concurrent.futures
+
+
+# case database calls by "Class.method"
+CALLS = collections.Counter()
+CALLS_LOCK = threading.Lock()
+
+
+def countCall(name):
+    with CALLS_LOCK:
+        CALLS[name] += 1
+
+
+def resetCalls():
+    with CALLS_LOCK:
+        CALLS.clear()
+
+
+def caseDbCall(method):
+    name = method.__name__
+
+    def wrapper(self, *args, **kwargs):
+        transaction = kwargs.get("transaction")
+        if transaction is None and args and isinstance(args[-1], CaseDbTransaction):
+            transaction = args[-1]
+        countCall(type(self).__name__ + "." + name + (" (transaction)" if transaction is not None else ""))
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+class JavaException(Exception):
+
+    def getMessage(self):
+        return str(self)
+
+
+# ---- java.io, java.lang, java.security ----
+
+class IOException(JavaException):
+    pass
+
+
+class FileOutputStream(object):
+
+    def __init__(self, path, append=False):
+        self.f = open(str(path), "ab" if append else "wb")
+
+    def write(self, buf, offset=0, length=None):
+        if length is None:
+            length = len(buf)
+        self.f.write(bytes(buf[offset:offset + length]))
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class DriverClass(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def newInstance(self):
+        return object()
+
+
+class Class(object):
+
+    @staticmethod
+    def forName(name):
+        return DriverClass(name)
+
+
+class Runtime(object):
+
+    @staticmethod
+    def getRuntime():
+        return Runtime()
+
+    def availableProcessors(self):
+        return os.cpu_count() or 1
+
+
+class System(object):
+
+    @staticmethod
+    def currentTimeMillis():
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def nanoTime():
+        return time.perf_counter_ns()
+
+
+class Long(int):
+    MAX_VALUE = 2 ** 63 - 1
+
+
+class MessageDigest(object):
+
+    def __init__(self, digest):
+        self.digest_ = digest
+
+    @staticmethod
+    def getInstance(name):
+        return MessageDigest(hashlib.new(name.replace("-", "").lower()))
+
+    def update(self, buf, offset=0, length=None):
+        if length is None:
+            length = len(buf)
+        self.digest_.update(bytes(buf[offset:offset + length]))
+
+    def digest(self, *args):
+        if args:
+            self.update(*args)
+        return bytearray(self.digest_.digest())
+
+
+class Level(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+for name in ("SEVERE", "WARNING", "INFO", "CONFIG", "FINE"):
+    setattr(Level, name, Level(name))
+
+
+# ---- JDBC over sqlite3 ----
+
+class SQLException(JavaException):
+    pass
+
+
+class ResultSet(object):
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.row = None
+        self.lastNull = False
+        self.columns = [d[0] for d in cursor.description] if cursor.description else []
+        self.index = dict((c.lower(), i) for i, c in enumerate(self.columns))
+
+    def next(self):
+        self.row = self.cursor.fetchone()
+        return self.row is not None
+
+    def value(self, column):
+        try:
+            if isinstance(column, int):
+                value = self.row[column - 1]
+            else:
+                value = self.row[self.index[column.lower()]]
+        except KeyError:
+            raise SQLException("no such column: " + column)
+        self.lastNull = value is None
+        return value
+
+    def wasNull(self):
+        return self.lastNull
+
+    def getString(self, column):
+        value = self.value(column)
+        if isinstance(value, bytes):
+            return value.decode("utf-8", "replace")
+        return None if value is None else str(value)
+
+    def getInt(self, column):
+        value = self.value(column)
+        try:
+            return 0 if value is None else int(value)
+        except ValueError:
+            return 0
+
+    getLong = getInt
+
+    def getObject(self, column):
+        return self.value(column)
+
+    def getMetaData(self):
+        return self
+
+    def getColumnCount(self):
+        return len(self.columns)
+
+    def getColumnName(self, i):
+        return self.columns[i - 1]
+
+    def close(self):
+        self.cursor.close()
+
+
+class Statement(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def setFetchSize(self, size):
+        pass
+
+    def executeQuery(self, sql):
+        try:
+            return ResultSet(self.connection.db.execute(sql))
+        except sqlite3.Error as e:
+            raise SQLException(str(e))
+
+    def executeUpdate(self, sql):
+        try:
+            return self.connection.db.execute(sql).rowcount
+        except sqlite3.Error as e:
+            raise SQLException(str(e))
+
+    def close(self):
+        pass
+
+
+class PreparedStatement(Statement):
+
+    def __init__(self, connection, sql):
+        Statement.__init__(self, connection)
+        self.sql = sql
+        self.parameters = {}
+        self.batch = []
+
+    def setParameter(self, i, value):
+        self.parameters[i] = value
+
+    setInt = setLong = setString = setBytes = setObject = setParameter
+
+    def values(self):
+        return [self.parameters[i] for i in sorted(self.parameters)]
+
+    def executeQuery(self, sql=None):
+        try:
+            return ResultSet(self.connection.db.execute(self.sql, self.values()))
+        except sqlite3.Error as e:
+            raise SQLException(str(e))
+
+    def executeUpdate(self, sql=None):
+        try:
+            return self.connection.db.execute(self.sql, self.values()).rowcount
+        except sqlite3.Error as e:
+            raise SQLException(str(e))
+
+    def addBatch(self):
+        self.batch.append(self.values())
+
+    def executeBatch(self):
+        try:
+            self.connection.db.executemany(self.sql, self.batch)
+        except sqlite3.Error as e:
+            raise SQLException(str(e))
+        self.batch = []
+
+    def clearParameters(self):
+        self.parameters = {}
+
+
+class Connection(object):
+
+    def __init__(self, path, readOnly):
+        if readOnly:
+            self.db = sqlite3.connect("file:%s?mode=ro" % path, uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.isolation_level = None
+
+    def createStatement(self):
+        return Statement(self)
+
+    def prepareStatement(self, sql):
+        return PreparedStatement(self, sql)
+
+    def setAutoCommit(self, autoCommit):
+        if not autoCommit:
+            self.db.execute("begin")
+
+    def commit(self):
+        if self.db.in_transaction:
+            self.db.execute("commit")
+        self.db.execute("begin")
+
+    # like the sqlite-jdbc driver, start the next transaction straight away
+    def rollback(self):
+        if self.db.in_transaction:
+            self.db.execute("rollback")
+        self.db.execute("begin")
+
+    def close(self):
+        if self.db.in_transaction:
+            self.db.execute("commit")
+        self.db.close()
+
+
+class DriverManager(object):
+
+    @staticmethod
+    def getConnection(url, properties=None):
+        readOnly = bool(properties and properties.get("open_mode") == "1")
+        try:
+            return Connection(url[len("jdbc:sqlite:"):], readOnly)
+        except sqlite3.Error as e:
+            raise SQLException(str(e))
+
+
+class SQLiteConfig(object):
+
+    def __init__(self):
+        self.readOnly = False
+
+    def setReadOnly(self, readOnly):
+        self.readOnly = readOnly
+
+    def toProperties(self):
+        return {"open_mode": "1"} if self.readOnly else {}
+
+
+# ---- java.util.concurrent over concurrent.futures ----
+
+class ExecutionException(JavaException):
+
+    def __init__(self, cause):
+        JavaException.__init__(self, str(cause))
+        self.cause = cause
+
+    def getCause(self):
+        return self.cause
+
+
+class Callable(object):
+    pass
+
+
+class Future(object):
+
+    def __init__(self, future):
+        self.future = future
+
+    def get(self, *args):
+        try:
+            return self.future.result()
+        except Exception as e:
+            raise ExecutionException(e)
+
+    def isDone(self):
+        return self.future.done()
+
+    def cancel(self, interrupt):
+        return self.future.cancel()
+
+
+class ExecutorService(object):
+
+    def __init__(self, threads):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+    def submit(self, task):
+        return Future(self.executor.submit(task.call if hasattr(task, "call") else task.run))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def shutdownNow(self):
+        self.executor.shutdown(wait=False)
+        return []
+
+    def awaitTermination(self, timeout, unit):
+        self.executor.shutdown(wait=True)
+        return True
+
+
+class Executors(object):
+
+    @staticmethod
+    def newFixedThreadPool(threads):
+        return ExecutorService(threads)
+
+    @staticmethod
+    def newSingleThreadExecutor():
+        return ExecutorService(1)
+
+
+class ExecutorCompletionService(object):
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.done = queue.Queue()
+
+    def submit(self, task):
+        future = self.executor.submit(task)
+        future.future.add_done_callback(lambda f: self.done.put(future))
+        return future
+
+    def take(self):
+        return self.done.get()
+
+    def poll(self, *args):
+        try:
+            return self.done.get(timeout=(args[0] / 1000.0) if args else 0)
+        except queue.Empty:
+            return None
+
+
+class TimeUnit(object):
+    SECONDS = "SECONDS"
+    MILLISECONDS = "MILLISECONDS"
+
+
+# ---- org.sleuthkit.datamodel ----
+
+class TskCoreException(JavaException):
+    pass
+
+
+class BlackboardException(JavaException):
+    pass
+
+
+class TskDataException(JavaException):
+    pass
+
+
+class EnumValue(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def toString(self):
+        return self.name
+
+    def __repr__(self):
+        return self.name
+
+
+class ValueType(object):
+    pass
+
+for name in ("STRING", "INTEGER", "LONG", "DOUBLE", "BYTE", "DATETIME", "JSON"):
+    setattr(ValueType, name, EnumValue(name))
+
+
+class AttributeType(object):
+
+    def __init__(self, typeId, name, displayName, valueType):
+        self.typeId = typeId
+        self.name = name
+        self.displayName = displayName
+        self.valueType = valueType
+
+    def getTypeID(self):
+        return self.typeId
+
+    def getTypeName(self):
+        return self.name
+
+    def getDisplayName(self):
+        return self.displayName
+
+    def getValueType(self):
+        return self.valueType
+
+
+class ArtifactType(object):
+
+    def __init__(self, typeId, name, displayName):
+        self.typeId = typeId
+        self.name = name
+        self.displayName = displayName
+
+    def getTypeID(self):
+        return self.typeId
+
+    def getTypeName(self):
+        return self.name
+
+    def getDisplayName(self):
+        return self.displayName
+
+
+class BlackboardAttribute(object):
+    TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE = ValueType
+    Type = AttributeType
+
+    def __init__(self, attributeType, moduleName, value):
+        self.attributeType = attributeType
+        self.value = value
+
+    def getAttributeType(self):
+        return self.attributeType
+
+    def getValueString(self):
+        return "" if self.value is None else str(self.value)
+
+    def getValueLong(self):
+        return self.value
+
+    def __repr__(self):
+        return "%s=%r" % (self.attributeType.getTypeName(), self.value)
+
+
+# An artifact.  Unless the case keeps artifacts, only the number of
+# attributes is kept, so the benchmark's peak memory is the module's
+# rather than the stand-in blackboard's.
+class BlackboardArtifact(object):
+    Type = ArtifactType
+
+    def __init__(self, case, artifactId, artifactType, objId, attributes):
+        self.case = case
+        self.artifactId = artifactId
+        self.artifactType = artifactType
+        self.objId = objId
+        self.attributes = list(attributes) if case.keepArtifacts else None
+        self.attributeCount = len(attributes)
+
+    def getArtifactID(self):
+        return self.artifactId
+
+    def getId(self):
+        return self.artifactId
+
+    def getArtifactTypeID(self):
+        return self.artifactType.getTypeID()
+
+    def getArtifactTypeName(self):
+        return self.artifactType.getTypeName()
+
+    def getObjectID(self):
+        return self.objId
+
+    @caseDbCall
+    def getAttributes(self):
+        return list(self.attributes or [])
+
+    @caseDbCall
+    def addAttributes(self, attributes, transaction=None):
+        if self.attributes is not None:
+            self.attributes.extend(attributes)
+        self.attributeCount += len(attributes)
+        self.case.attributeCount += len(attributes)
+
+
+class CaseDbTransaction(object):
+
+    def __init__(self, case):
+        self.case = case
+
+    @caseDbCall
+    def commit(self):
+        self.case.commits += 1
+
+    @caseDbCall
+    def rollback(self):
+        self.case.rollbacks += 1
+
+
+class Blackboard(object):
+    BlackboardException = BlackboardException
+
+    def __init__(self, case):
+        self.case = case
+
+    @caseDbCall
+    def newDataArtifact(self, artifactType, objId, dataSourceId, attributes, osAccountId, transaction=None):
+        return self.case.newArtifact(artifactType, objId, attributes)
+
+    @caseDbCall
+    def postArtifacts(self, artifacts, moduleName, jobId=None):
+        self.case.posted += len(artifacts)
+
+
+class AccountType(object):
+    EMAIL = EnumValue("EMAIL")
+
+
+class Account(object):
+    Type = AccountType
+
+
+class RelationshipType(object):
+    MESSAGE = EnumValue("MESSAGE")
+
+
+class Relationship(object):
+    Type = RelationshipType
+
+
+class AccountFileInstance(object):
+
+    def __init__(self, accountType, uniqueId, content):
+        self.accountType = accountType
+        self.uniqueId = uniqueId
+        self.content = content
+
+    def getAccount(self):
+        return self
+
+    def getTypeSpecificID(self):
+        return self.uniqueId
+
+
+class CommunicationsManager(object):
+
+    def __init__(self, case):
+        self.case = case
+
+    @caseDbCall
+    def createAccountFileInstance(self, accountType, uniqueId, moduleName, content):
+        with self.case.lock:
+            self.case.accountInstances += 1
+        return AccountFileInstance(accountType, uniqueId, content)
+
+    @caseDbCall
+    def addRelationships(self, sender, recipients, artifact, relationshipType, dateTime):
+        with self.case.lock:
+            self.case.relationships += len(recipients)
+
+
+class EncodingType(object):
+    NONE = EnumValue("NONE")
+
+
+class MetaFlag(object):
+    ALLOC = EnumValue("ALLOC")
+    UNALLOC = EnumValue("UNALLOC")
+
+
+class TskData(object):
+    EncodingType = EncodingType
+    TSK_FS_META_FLAG_ENUM = MetaFlag
+
+
+class DerivedFile(object):
+
+    def __init__(self, fileId, name, localPath, size, parent):
+        self.fileId = fileId
+        self.name = name
+        self.localPath = localPath
+        self.size = size
+        self.parent = parent
+
+    def getId(self):
+        return self.fileId
+
+    def getName(self):
+        return self.name
+
+    def getSize(self):
+        return self.size
+
+    def getLocalPath(self):
+        return self.localPath
+
+
+STANDARD_ATTRIBUTE_TYPES = (("TSK_DATETIME_SENT", "DATETIME"), ("TSK_EMAIL_TO", "STRING"), ("TSK_EMAIL_CC", "STRING"),
+                            ("TSK_EMAIL_BCC", "STRING"), ("TSK_EMAIL_FROM", "STRING"), ("TSK_EMAIL_REPLYTO", "STRING"),
+                            ("TSK_SUBJECT", "STRING"), ("TSK_EMAIL_CONTENT_PLAIN", "STRING"), ("TSK_HEADERS", "STRING"),
+                            ("TSK_MSG_ID", "STRING"))
+
+
+class SleuthkitCase(object):
+
+    def __init__(self, keepArtifacts=False):
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1000)
+        self.keepArtifacts = keepArtifacts
+        self.artifactTypes = {}
+        self.attributeTypes = {}
+        self.artifacts = {}
+        self.artifactCounts = collections.Counter()
+        self.attributeCount = 0
+        self.derivedFiles = []
+        self.blackboard = Blackboard(self)
+        self.communicationsManager = CommunicationsManager(self)
+        self.accountInstances = 0
+        self.relationships = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self.posted = 0
+        # number of newDataArtifact calls to let through before one fails,
+        # None for no failure
+        self.failAfter = None
+
+        # the standard types the module uses
+        self.artifactTypes["TSK_EMAIL_MSG"] = ArtifactType(next(self.ids), "TSK_EMAIL_MSG", "E-Mail Messages")
+        for name, valueType in STANDARD_ATTRIBUTE_TYPES:
+            self.attributeTypes[name] = AttributeType(next(self.ids), name, name, getattr(ValueType, valueType))
+
+    def newArtifact(self, artifactType, objId, attributes):
+        with self.lock:
+            if self.failAfter is not None:
+                if self.failAfter <= 0:
+                    self.failAfter = None
+                    raise BlackboardException("injected failure")
+                self.failAfter -= 1
+            artifact = BlackboardArtifact(self, next(self.ids), artifactType, objId, attributes)
+            self.artifacts[artifact.artifactId] = artifact
+            self.artifactCounts[artifactType.getTypeName()] += 1
+            self.attributeCount += len(attributes)
+            return artifact
+
+    def getBlackboard(self):
+        return self.blackboard
+
+    def getCommunicationsManager(self):
+        return self.communicationsManager
+
+    @caseDbCall
+    def beginTransaction(self):
+        return CaseDbTransaction(self)
+
+    @caseDbCall
+    def addArtifactType(self, name, displayName):
+        with self.lock:
+            if name in self.artifactTypes:
+                raise TskDataException("Artifact type " + name + " already exists")
+            self.artifactTypes[name] = ArtifactType(next(self.ids), name, displayName)
+            return self.artifactTypes[name].getTypeID()
+
+    @caseDbCall
+    def getArtifactType(self, name):
+        return self.artifactTypes.get(name)
+
+    @caseDbCall
+    def addArtifactAttributeType(self, name, valueType, displayName):
+        with self.lock:
+            if name in self.attributeTypes:
+                raise TskDataException("Attribute type " + name + " already exists")
+            self.attributeTypes[name] = AttributeType(next(self.ids), name, displayName, valueType)
+            return self.attributeTypes[name]
+
+    @caseDbCall
+    def getAttributeType(self, name):
+        return self.attributeTypes.get(name)
+
+    @caseDbCall
+    def getBlackboardArtifact(self, artifactId):
+        artifact = self.artifacts.get(artifactId)
+        if artifact is None:
+            raise TskCoreException("No artifact with ID %d" % artifactId)
+        return artifact
+
+    @caseDbCall
+    def getMatchingArtifacts(self, whereClause):
+        # only "WHERE artifact_id IN (...)" is understood.  Like the real one
+        # the clause is pasted after "FROM blackboard_artifacts", so it has to
+        # start with WHERE (or a JOIN).
+        if not whereClause.lstrip().upper().startswith(("WHERE ", "JOIN ")):
+            raise TskCoreException("Error getting matching artifacts, bad clause: " + whereClause)
+        ids = [int(artifactId) for artifactId in whereClause[whereClause.index("(") + 1:whereClause.rindex(")")].split(",")]
+        return [self.artifacts[artifactId] for artifactId in ids if artifactId in self.artifacts]
+
+    @caseDbCall
+    def findAllFilesWhere(self, where):
+        name = where.split("'")[1] if where.startswith("name = '") else None
+        return [f for f in self.derivedFiles if f.getName() == name]
+
+    @caseDbCall
+    def addDerivedFile(self, name, localPath, size, ctime, crtime, atime, mtime, isFile, parent,
+                       rederiveDetails, toolName, toolVersion, otherDetails, encodingType):
+        with self.lock:
+            derivedFile = DerivedFile(next(self.ids), name, localPath, size, parent)
+            self.derivedFiles.append(derivedFile)
+            return derivedFile
+
+
+# ---- org.sleuthkit.autopsy ----
+
+class ProcessResult(object):
+    OK = "OK"
+    ERROR = "ERROR"
+
+
+class IngestModule(object):
+    ProcessResult = ProcessResult
+
+    def startUp(self, context):
+        pass
+
+    def shutDown(self):
+        pass
+
+
+class DataSourceIngestModule(IngestModule):
+    pass
+
+
+class FileIngestModule(IngestModule):
+    pass
+
+
+class IngestModuleFactoryAdapter(object):
+    pass
+
+
+class MessageType(object):
+    DATA = "DATA"
+    INFO = "INFO"
+    WARNING = "WARNING"
+    ERROR = "ERROR"
+
+
+class IngestMessage(object):
+    MessageType = MessageType
+
+    def __init__(self, args):
+        self.args = args
+
+    @staticmethod
+    def createMessage(*args):
+        return IngestMessage(args)
+
+
+class IngestServices(object):
+    instance = None
+
+    def __init__(self):
+        self.messages = []
+        self.dataEvents = 0
+        self.contentEvents = 0
+
+    @staticmethod
+    def getInstance():
+        if IngestServices.instance is None:
+            IngestServices.instance = IngestServices()
+        return IngestServices.instance
+
+    def postMessage(self, message):
+        self.messages.append(message.args)
+
+    def fireModuleDataEvent(self, event):
+        self.dataEvents += 1
+
+    def fireModuleContentEvent(self, event):
+        self.contentEvents += 1
+
+
+class ModuleDataEvent(object):
+
+    def __init__(self, moduleName, artifactType, artifacts=None):
+        self.moduleName = moduleName
+        self.artifactType = artifactType
+
+
+class ModuleContentEvent(object):
+
+    def __init__(self, content):
+        self.content = content
+
+
+# a java.util.logging.Logger that keeps its records
+class RecordingLogger(object):
+
+    def __init__(self):
+        self.records = []
+
+    def logp(self, level, className, methodName, message):
+        self.records.append((level, className, methodName, message))
+
+    def log(self, level, message, *args):
+        self.records.append((level, None, None, message))
+
+
+class Logger(object):
+    loggers = {}
+
+    @staticmethod
+    def getLogger(name):
+        return Logger.loggers.setdefault(name, RecordingLogger())
+
+
+# An AbstractFile backed by a local file.  'parentPath' is where it would be
+# in the data source.
+class LocalFile(object):
+
+    def __init__(self, fileId, path, name="proton.db", parentPath="/data/data/ch.protonmail.android/databases/",
+                 allocated=True, dataSourceId=1):
+        self.fileId = fileId
+        self.path = path
+        self.name = name
+        self.parentPath = parentPath
+        self.allocated = allocated
+        self.dataSourceId = dataSourceId
+
+    def getId(self):
+        return self.fileId
+
+    def getName(self):
+        return self.name
+
+    def getSize(self):
+        return os.path.getsize(self.path)
+
+    def getParentPath(self):
+        return self.parentPath
+
+    def getUniquePath(self):
+        return "/img_bench" + self.parentPath + self.name
+
+    def getMd5Hash(self):
+        return None
+
+    def isMetaFlagSet(self, flag):
+        return self.allocated == (flag is MetaFlag.ALLOC)
+
+    def getDataSourceObjectId(self):
+        return self.dataSourceId
+
+    def isFile(self):
+        return True
+
+    def read(self, buf, offset, length):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        buf[0:len(data)] = data
+        return len(data)
+
+
+# the data source itself
+class DataSource(object):
+
+    def __init__(self, dataSourceId=1, name="bench.img"):
+        self.dataSourceId = dataSourceId
+        self.name = name
+
+    def getId(self):
+        return self.dataSourceId
+
+    def getName(self):
+        return self.name
+
+
+class FileManager(object):
+
+    def __init__(self, files):
+        self.files = files
+
+    # 'name' is a SQL LIKE pattern, as in Autopsy
+    @caseDbCall
+    def findFiles(self, dataSource, name, parent=None):
+        pattern = name.replace("%", "*").replace("_", "?").lower()
+        return [f for f in self.files if fnmatch.fnmatch(f.getName().lower(), pattern)
+                and (parent is None or parent in f.getParentPath())]
+
+
+class Services(object):
+
+    def __init__(self, fileManager):
+        self.fileManager = fileManager
+
+    def getFileManager(self):
+        return self.fileManager
+
+
+class Case(object):
+    current = None
+
+    def __init__(self, caseDirectory, files, keepArtifacts=False):
+        self.caseDirectory = caseDirectory
+        self.sk = SleuthkitCase(keepArtifacts)
+        self.services = Services(FileManager(files))
+        for directory in ("Temp", "ModuleOutput"):
+            path = os.path.join(caseDirectory, directory)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    @staticmethod
+    def getCurrentCase():
+        return Case.current
+
+    def getSleuthkitCase(self):
+        return self.sk
+
+    def getServices(self):
+        return self.services
+
+    def getCaseDirectory(self):
+        return self.caseDirectory
+
+    def getTempDirectory(self):
+        return os.path.join(self.caseDirectory, "Temp")
+
+    def getModuleDirectory(self):
+        return os.path.join(self.caseDirectory, "ModuleOutput")
+
+    def getModuleOutputDirectoryRelativePath(self):
+        return "ModuleOutput"
+
+    def getName(self):
+        return "bench"
+
+
+class ContentUtils(object):
+
+    @staticmethod
+    def writeToFile(content, outputFile, *args):
+        with open(content.path, "rb") as source, open(str(outputFile), "wb") as output:
+            shutil.copyfileobj(source, output)
+
+
+class IngestJobContext(object):
+
+    def __init__(self, dataSource, jobId=1):
+        self.dataSource = dataSource
+        self.jobId = jobId
+        self.cancelled = False
+        self.addedFiles = []
+
+    def isJobCancelled(self):
+        return self.cancelled
+
+    def dataSourceIngestIsCancelled(self):
+        return self.cancelled
+
+    def fileIngestIsCancelled(self):
+        return self.cancelled
+
+    def getJobId(self):
+        return self.jobId
+
+    def getDataSource(self):
+        return self.dataSource
+
+    def addFilesToJob(self, files):
+        self.addedFiles.extend(files)
+
+
+# DataSourceIngestModuleProgress.  Keeps the last value and how many
+# updates it got.
+class ProgressBar(object):
+
+    def __init__(self):
+        self.total = None
+        self.value = 0
+        self.message = None
+        self.updates = 0
+
+    def switchToIndeterminate(self):
+        self.total = None
+
+    def switchToDeterminate(self, total):
+        self.total = total
+
+    def progress(self, *args):
+        self.updates += 1
+        for arg in args:
+            if isinstance(arg, int):
+                self.value = arg
+            else:
+                self.message = arg
+
+
+# Make a new current case in 'caseDirectory' whose data source holds
+# 'files' (LocalFiles)
+def newCase(caseDirectory, files, keepArtifacts=False):
+    Case.current = Case(caseDirectory, files, keepArtifacts)
+    resetCalls()
+    return Case.current
+
+
+def fakeModule(name, **attributes):
+    module = sys.modules.get(name)
+    if module is None:
+        module = types.ModuleType(name)
+        sys.modules[name] = module
+        if "." in name:
+            parent, _, child = name.rpartition(".")
+            setattr(fakeModule(parent), child, module)
+    for key, value in attributes.items():
+        setattr(module, key, value)
+    return module
+
+
+# Register the stand-ins as the java, org.sqlite and org.sleuthkit modules
+def install():
+    fakeModule("jarray", zeros=lambda length, typeCode: bytearray(length))
+    fakeModule("java.io", FileOutputStream=FileOutputStream, IOException=IOException)
+    fakeModule("java.lang", Class=Class, Long=Long, Runtime=Runtime, System=System, Exception=JavaException)
+    fakeModule("java.security", MessageDigest=MessageDigest)
+    fakeModule("java.util.logging", Level=Level)
+    fakeModule("java.util.concurrent", Callable=Callable, Executors=Executors, TimeUnit=TimeUnit,
+               ExecutorCompletionService=ExecutorCompletionService, ExecutionException=ExecutionException)
+    fakeModule("java.sql", DriverManager=DriverManager, SQLException=SQLException)
+    fakeModule("org.sqlite", SQLiteConfig=SQLiteConfig)
+    fakeModule("org.sleuthkit.datamodel", SleuthkitCase=SleuthkitCase, BlackboardArtifact=BlackboardArtifact,
+               BlackboardAttribute=BlackboardAttribute, Blackboard=Blackboard, TskCoreException=TskCoreException,
+               TskDataException=TskDataException, TskData=TskData, DerivedFile=DerivedFile, Account=Account,
+               Relationship=Relationship)
+    fakeModule("org.sleuthkit.datamodel.Blackboard", BlackboardException=BlackboardException)
+    fakeModule("org.sleuthkit.autopsy.ingest", IngestModule=IngestModule, DataSourceIngestModule=DataSourceIngestModule,
+               FileIngestModule=FileIngestModule, IngestModuleFactoryAdapter=IngestModuleFactoryAdapter,
+               IngestMessage=IngestMessage, IngestServices=IngestServices, ModuleDataEvent=ModuleDataEvent,
+               ModuleContentEvent=ModuleContentEvent)
+    fakeModule("org.sleuthkit.autopsy.coreutils", Logger=Logger)
+    fakeModule("org.sleuthkit.autopsy.casemodule", Case=Case)
+    fakeModule("org.sleuthkit.autopsy.datamodel", ContentUtils=ContentUtils)
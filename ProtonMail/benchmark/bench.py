@@ -0,0 +1,279 @@
+# Offline benchmark for the ProtonMail ingest module.  Generates synthetic
+# 'proton.db' files (see generate.py), runs
+# ProtonMailDataSourceIngestModule.process() against the stand-ins in
+# autopsy_stubs.py and reports rows/sec, peak memory and the case database
+# calls the run made.
+#
+# Usage:
+#
+#   python3 bench.py [options]
+#
+# for example
+#
+#   python3 bench.py --messages 100000 --files 4 --workers 4
+#   python3 bench.py --messages 10000 --files 3 --copies --json result.json
+#
+# Run with --help for all the options.  Needs CPython 3 and nothing else;
+# generated databases are kept in the work directory and reused by later
+# runs with the same settings.
+
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not on Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import generate
+import autopsy_stubs
+
+
+# where the app keeps its database for the n-th user profile
+def parentPath(index):
+    return "/data/user/%d/ch.protonmail.android/databases/" % index
+
+
+# Generate the databases the run ingests, or reuse ones from an earlier run
+# with the same settings.  Returns the LocalFiles for them and their WAL
+# files.
+def makeFiles(args, directory):
+    files = []
+    for i in range(args.files):
+        # copies of one mailbox share their message IDs, separate mailboxes don't
+        seed = 1 if args.copies else i + 1
+        idPrefix = "m" if args.copies else "u%d-m" % i
+        name = "proton-%d-%d-%s-%g-%d-%d.db" % (args.messages, seed, idPrefix, args.deleted, args.wal_messages,
+                                                args.body_median)
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            started = time.time()
+            generate.make(path, args.messages, seed, args.body_median, idPrefix, args.deleted, args.wal_messages)
+            log(args, "generated %s (%.1f MB) in %.1f s" % (name, os.path.getsize(path) / 1e6, time.time() - started))
+        fileId = 100 + 10 * i
+        files.append(autopsy_stubs.LocalFile(fileId, path, parentPath=parentPath(i)))
+        if os.path.exists(path + "-wal"):
+            files.append(autopsy_stubs.LocalFile(fileId + 1, path + "-wal", name="proton.db-wal",
+                                                 parentPath=parentPath(i)))
+    return files
+
+
+# Set the module's tuning constants from the command line
+def configure(module, args):
+    module.WORKER_COUNT = args.workers
+    module.ARTIFACT_BATCH_SIZE = args.batch_size
+    module.PAGE_SIZE = args.page_size
+    module.INDEX_ARTIFACTS = not args.no_index
+    module.OFFLOAD_LARGE_FIELDS = not args.no_offload
+    module.DEDUP_MESSAGES = not args.no_dedup
+    module.CARVE_DELETED_RECORDS = not args.no_carve
+    module.EMAIL_ARTIFACTS = args.email
+    module.PLAN_WORK = not args.no_plan
+    module.MAX_ROWS_PER_TABLE = args.max_rows
+    module.TIME_BUDGET_SECONDS = args.time_budget
+
+
+def peakRssMegabytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1e6 if sys.platform == "darwin" else 1e3), 1)
+
+
+# Run the file ingest module the way Autopsy's file pipeline would: one
+# module per file ingest thread, every file in the data source handed to
+# whichever thread is free.  Returns the first result other than OK (or OK)
+# and the job's metrics.
+def runFileLevel(ProtonMail, args, files, context):
+    threadCount = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    modules = [ProtonMail.ProtonMailFileIngestModule() for i in range(threadCount)]
+    for module in modules:
+        module.startUp(context)
+    metrics = modules[0].metrics
+    pending = queue.Queue()
+    for file in files:
+        pending.put(file)
+    results = []
+
+    def ingestThread(module):
+        while True:
+            try:
+                file = pending.get_nowait()
+            except queue.Empty:
+                return
+            results.append(module.process(file))
+
+    threads = [threading.Thread(target=ingestThread, args=(module,)) for module in modules]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for module in modules:
+        module.shutDown()
+    failed = [result for result in results if result != "OK"]
+    return (failed[0] if failed else "OK"), metrics
+
+
+def runOnce(ProtonMail, args, files, caseDirectory):
+    if os.path.isdir(caseDirectory):
+        shutil.rmtree(caseDirectory)
+    case = autopsy_stubs.newCase(caseDirectory, files)
+    context = autopsy_stubs.IngestJobContext(autopsy_stubs.DataSource())
+    progressBar = autopsy_stubs.ProgressBar()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    if args.file_level:
+        result, metrics = runFileLevel(ProtonMail, args, files, context)
+    else:
+        module = ProtonMail.ProtonMailDataSourceIngestModule()
+        module.startUp(context)
+        result = module.process(context.getDataSource(), progressBar)
+        metrics = module.metrics
+    seconds = time.perf_counter() - started
+    tracedPeak = None
+    if args.tracemalloc:
+        tracedPeak = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+        tracemalloc.stop()
+
+    rows = sum([count for name, count in metrics.counters.items() if name.startswith("rows read: ")])
+    # every database and WAL is carved once
+    carveSeconds = metrics.stages.get("carve", (0, 0))[0]
+    carvedBytes = sum([file.getSize() for file in files])
+    calls = dict(autopsy_stubs.CALLS)
+    roundTrips = sum([count for name, count in calls.items() if not name.endswith(" (transaction)")])
+    return {"result": str(result),
+            "seconds": round(seconds, 3),
+            "rowsRead": rows,
+            "rowsPerSecond": round(rows / seconds, 1) if seconds > 0 else None,
+            "carveMBPerSecond": round(carvedBytes / carveSeconds / 1e6, 1) if carveSeconds > 0 else None,
+            "artifacts": sum(case.sk.artifactCounts.values()),
+            "artifactsByType": dict(case.sk.artifactCounts),
+            "attributes": case.sk.attributeCount,
+            "derivedFiles": len(case.sk.derivedFiles),
+            "accountInstances": case.sk.accountInstances,
+            "relationships": case.sk.relationships,
+            "peakTracedMB": tracedPeak,
+            "peakRssMB": peakRssMegabytes(),
+            "caseDbCalls": sum(calls.values()),
+            "caseDbRoundTrips": roundTrips,
+            "caseDbCallsByMethod": calls,
+            "commits": case.sk.commits,
+            "rollbacks": case.sk.rollbacks,
+            "progressUpdates": progressBar.updates,
+            "progressTotal": progressBar.total,
+            "progressValue": progressBar.value,
+            "counters": dict(metrics.counters),
+            "stages": dict([(name, round(seconds, 3)) for name, (seconds, calls) in metrics.stages.items()])}
+
+
+def report(args, run):
+    log(args, "  result %s in %.2f s" % (run["result"], run["seconds"]))
+    log(args, "  rows read          %d (%.0f rows/s)" % (run["rowsRead"], run["rowsPerSecond"] or 0))
+    log(args, "  artifacts          %d (%d attributes, %d derived files)" %
+        (run["artifacts"], run["attributes"], run["derivedFiles"]))
+    if run["carveMBPerSecond"] is not None:
+        log(args, "  carving            %.1f MB/s" % run["carveMBPerSecond"])
+    if run["peakTracedMB"] is not None:
+        log(args, "  peak traced memory %.1f MB" % run["peakTracedMB"])
+    if run["peakRssMB"] is not None:
+        log(args, "  peak RSS           %.1f MB (whole process, so far)" % run["peakRssMB"])
+    log(args, "  case DB calls      %d (%d outside a transaction, %d commits)" %
+        (run["caseDbCalls"], run["caseDbRoundTrips"], run["commits"]))
+    if run["progressTotal"] is not None:
+        log(args, "  progress           %d of %d units in %d updates" %
+            (run["progressValue"], run["progressTotal"], run["progressUpdates"]))
+    if args.verbose:
+        for name, count in sorted(run["caseDbCallsByMethod"].items(), key=lambda item: -item[1]):
+            log(args, "    %-50s %d" % (name, count))
+        for name, seconds in sorted(run["stages"].items(), key=lambda item: -item[1]):
+            log(args, "    %-50s %.3f s" % (name, seconds))
+
+
+def log(args, message):
+    if not args.quiet:
+        print(message)
+        sys.stdout.flush()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the ProtonMail ingest module outside Autopsy.")
+    parser.add_argument("-n", "--messages", type=int, default=10000, help="messages per database (default 10000)")
+    parser.add_argument("-f", "--files", type=int, default=1, help="number of 'proton.db' files (default 1)")
+    parser.add_argument("--copies", action="store_true",
+                        help="make the files copies of one mailbox, to exercise deduplication")
+    parser.add_argument("--body-median", type=int, default=2500, help="median body length (default 2500)")
+    parser.add_argument("--deleted", type=float, default=0.0,
+                        help="fraction of rows to delete, to exercise carving (default 0)")
+    parser.add_argument("--wal-messages", type=int, default=0, help="messages to leave in a WAL file (default 0)")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="WORKER_COUNT, or file ingest threads with --file-level (default 0, one per core)")
+    parser.add_argument("--file-level", action="store_true",
+                        help="run the file ingest module on --workers file ingest threads instead")
+    parser.add_argument("--batch-size", type=int, default=1000, help="ARTIFACT_BATCH_SIZE (default 1000)")
+    parser.add_argument("--page-size", type=int, default=1000, help="PAGE_SIZE (default 1000)")
+    parser.add_argument("--no-index", action="store_true", help="don't post artifacts for indexing")
+    parser.add_argument("--no-offload", action="store_true", help="don't offload large values to derived files")
+    parser.add_argument("--no-dedup", action="store_true", help="don't deduplicate messages")
+    parser.add_argument("--no-carve", action="store_true", help="don't carve deleted records")
+    parser.add_argument("--email", action="store_true",
+                        help="write messages as e-mail artifacts with accounts and relationships")
+    parser.add_argument("--no-plan", action="store_true",
+                        help="don't plan the work: files in the order found, progress in files")
+    parser.add_argument("--max-rows", type=int, default=0, help="MAX_ROWS_PER_TABLE (default 0, no limit)")
+    parser.add_argument("--time-budget", type=float, default=0, help="TIME_BUDGET_SECONDS (default 0, no limit)")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="number of runs (default 1)")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="trace Python allocations for the peak memory (slows the run down)")
+    parser.add_argument("--work", help="work directory, kept afterwards (default a temporary one)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list calls by method and stage times")
+    parser.add_argument("-q", "--quiet", action="store_true", help="print nothing")
+    args = parser.parse_args(argv)
+
+    work = args.work or tempfile.mkdtemp(prefix="protonmail-bench-")
+    databases = os.path.join(work, "databases")
+    if not os.path.isdir(databases):
+        os.makedirs(databases)
+
+    try:
+        files = makeFiles(args, databases)
+        autopsy_stubs.install()
+        sys.path.insert(0, os.path.dirname(HERE))
+        import ProtonMail
+        configure(ProtonMail, args)
+
+        runs = []
+        for i in range(args.repeat):
+            log(args, "run %d of %d" % (i + 1, args.repeat))
+            # a new case directory each run: the module caches types per case
+            run = runOnce(ProtonMail, args, files, os.path.join(work, "case-%d" % i))
+            report(args, run)
+            runs.append(run)
+    finally:
+        if not args.work:
+            shutil.rmtree(work, ignore_errors=True)
+
+    if args.json:
+        settings = dict([(key, value) for key, value in vars(args).items() if key not in ("json", "work", "quiet")])
+        with open(args.json, "w") as f:
+            json.dump({"settings": settings, "runs": runs}, f, indent=1, sort_keys=True)
+    return 0 if all([run["result"] == "OK" for run in runs]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,207 @@
+# Generates synthetic 'proton.db' files for benchmarking the ProtonMail
+# module.  The tables and columns follow the ProtonMail Android app's database
+# (contact, contact_data, contact_emails, label, message, notification) and
+# message bodies and headers get realistic, long tailed sizes.
+#
+# Usage:
+#
+#   python generate.py [options] OUTPUT
+#
+# Run with --help for the options.  This is plain CPython and doesn't need
+# Autopsy.
+
+import os
+import sys
+import math
+import random
+import sqlite3
+import argparse
+import shutil
+
+
+SCHEMA = """
+create table contact (ID text, Name text, CreateTime integer, ModifyTime integer, Size integer);
+create table contact_data (ID text, Name text, PrimaryEmail text);
+create table contact_emails (ID text, ContactID text, Name text, Email text, Type text, LabelIDs text);
+create table label (ID text, Name text, Color text, Display integer, LabelOrder integer, Exclusive integer,
+    Type integer);
+create table message (ID text, ConversationID text, Subject text, Unread integer, Type integer,
+    SenderAddress text, SenderName text, Time integer, TotalSize integer, Location integer, Starred integer,
+    NumAttachments integer, IsEncrypted integer, ExpirationTime integer, IsReplied integer,
+    IsRepliedAll integer, IsForwarded integer, Body text, SpamScore integer, AddressID text,
+    IsDownloaded integer, IsRead integer, Header text, ToListString text, CCListString text,
+    BCCListString text, ReplyTosString text, LabelIDs text);
+create table notification (ID text, notification_title text, notification_body text);
+"""
+
+MESSAGE_COLUMNS = 28
+
+# words the bodies, subjects and names are made of
+WORDS = ("the", "meeting", "invoice", "attached", "please", "review", "thanks", "regards", "tomorrow",
+         "project", "update", "account", "password", "reset", "shipping", "order", "confirmed", "delivery",
+         "schedule", "report", "quarterly", "budget", "contract", "signed", "call", "me", "when", "you",
+         "can", "hello", "team", "weekend", "travel", "flight", "hotel", "booking", "reference", "number",
+         "payment", "received", "overdue", "reminder", "subscription", "renewal", "security", "alert",
+         "login", "new", "device", "location")
+
+FIRST_NAMES = ("Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy",
+               "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil", "Trent", "Victor", "Walter", "Yolanda")
+DOMAINS = ("protonmail.com", "proton.me", "pm.me", "gmail.com", "example.com", "outlook.com")
+COLORS = ("#7272a7", "#cf5858", "#c26cc7", "#7569d1", "#69a9d1", "#4ba332", "#e6c04c", "#e6984c")
+
+
+# A block of random text the bodies are cut from, so generating a million
+# messages doesn't mean generating a million bodies word by word
+def makeCorpus(rand, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rand.choice(WORDS)
+        if rand.random() < 0.08:
+            word += ".\n" if rand.random() < 0.3 else ","
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+# Body sizes are log-normal around 'median' characters: most mail is short,
+# a few messages (HTML newsletters, long threads) are very long
+def bodySize(rand, median):
+    return int(min(256 * 1024, max(64, rand.lognormvariate(math.log(median), 1.0))))
+
+
+def header(rand, messageId, sender, recipient, time):
+    lines = ["Return-Path: <%s>" % sender,
+             "X-Original-To: %s" % recipient,
+             "Delivered-To: %s" % recipient]
+    for hop in range(rand.randint(2, 8)):
+        lines.append("Received: from mail%d.%s (mail%d.%s [10.%d.%d.%d]) by mailin.protonmail.ch with ESMTPS id %08x"
+                     % (hop, rand.choice(DOMAINS), hop, rand.choice(DOMAINS), rand.randint(0, 255),
+                        rand.randint(0, 255), rand.randint(0, 255), rand.getrandbits(32)))
+    lines += ["Message-ID: <%s@protonmail.com>" % messageId,
+              "Date: %d" % time,
+              "From: %s" % sender,
+              "To: %s" % recipient,
+              "MIME-Version: 1.0",
+              "Content-Type: text/html; charset=utf-8",
+              "X-Pm-Origin: internal",
+              "X-Pm-Content-Encryption: end-to-end"]
+    return "\r\n".join(lines) + "\r\n"
+
+
+def address(rand, contacts):
+    name = rand.choice(FIRST_NAMES)
+    return "%s.%d@%s" % (name.lower(), rand.randint(0, contacts), rand.choice(DOMAINS)), name
+
+
+# most mail is to and from people in the address book
+def correspondent(rand, book):
+    if rand.random() < 0.7:
+        return rand.choice(book)
+    return address(rand, len(book))
+
+
+def messageRows(rand, corpus, messages, start, book, labels, idPrefix, bodyMedian):
+    for i in range(start, start + messages):
+        sender, senderName = correspondent(rand, book)
+        recipients = [correspondent(rand, book)[0] for _ in range(rand.randint(1, 3))]
+        cc = [correspondent(rand, book) for _ in range(rand.choice((0, 0, 0, 1, 2)))]
+        size = bodySize(rand, bodyMedian)
+        offset = rand.randint(0, len(corpus) - 1)
+        body = (corpus[offset:] + corpus)[:size]
+        time = 1500000000 + i * 37 + rand.randint(0, 30)
+        messageId = "%s%d" % (idPrefix, i)
+        yield (messageId, "cv%s%d" % (idPrefix, i // 3), " ".join(rand.sample(WORDS, rand.randint(2, 7))).capitalize(),
+               rand.randint(0, 1), 0, sender, senderName, time, size + 1200, rand.choice((0, 0, 1, 2, 3, 6)),
+               int(rand.random() < 0.05), rand.choice((0, 0, 0, 1, 2)), 1, 0, int(rand.random() < 0.2),
+               int(rand.random() < 0.05), int(rand.random() < 0.05), body, 0, "a1", 1, rand.randint(0, 1),
+               header(rand, messageId, sender, recipients[0], time), ";".join(recipients),
+               ";".join(["%s <%s>" % (name, email) for email, name in cc]), "", sender,
+               '["%s"]' % '","'.join(["l%d" % rand.randint(0, labels - 1) for _ in range(rand.randint(1, 3))]))
+
+
+# Write a synthetic 'proton.db' to 'path' with 'messages' messages.
+#
+#   seed        - same seed, same database
+#   bodyMedian  - median body length in characters
+#   idPrefix    - prefix for message IDs.  Databases with the same prefix
+#                 (and seed) hold the same messages, as copies of one
+#                 mailbox would.
+#   deleted     - fraction of messages and contacts to delete afterwards,
+#                 with secure_delete off so they stay in free space
+#   walMessages - messages added last in WAL mode and left in 'path'-wal
+#                 without a checkpoint, as a running app would leave them
+def make(path, messages, seed=1, bodyMedian=2500, idPrefix="m", deleted=0.0, walMessages=0):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    rand = random.Random(seed)
+    corpus = makeCorpus(rand, 1024 * 1024)
+    contacts = max(10, messages // 50)
+    labels = 12
+
+    db = sqlite3.connect(path)
+    db.execute("pragma secure_delete = off")
+    db.executescript(SCHEMA)
+    book = []
+    for i in range(contacts):
+        email, name = address(rand, contacts)
+        book.append((email, name))
+        contactId = "c%d" % i
+        db.execute("insert into contact values (?, ?, ?, ?, ?)",
+                   (contactId, "%s %d" % (name, i), 1400000000 + i * 600, 1400000000 + i * 900, rand.randint(100, 4000)))
+        db.execute("insert into contact_data values (?, ?, ?)", (contactId, "%s %d" % (name, i), email))
+        db.execute("insert into contact_emails values (?, ?, ?, ?, ?, ?)",
+                   ("e%d" % i, contactId, "%s %d" % (name, i), email, "home", '["l%d"]' % (i % labels)))
+    for i in range(labels):
+        db.execute("insert into label values (?, ?, ?, ?, ?, ?, ?)",
+                   ("l%d" % i, "Label %d" % i, COLORS[i % len(COLORS)], 1, i, 0, 1))
+    for i in range(max(1, messages // 100)):
+        db.execute("insert into notification values (?, ?, ?)",
+                   ("n%d" % i, "New message", "You have a new message from %s" % address(rand, contacts)[1]))
+
+    committed = messages - walMessages
+    insert = "insert into message values (%s)" % ", ".join(["?"] * MESSAGE_COLUMNS)
+    db.executemany(insert, messageRows(rand, corpus, committed, 0, book, labels, idPrefix, bodyMedian))
+    db.commit()
+
+    if deleted > 0:
+        step = max(2, int(round(1 / deleted)))
+        db.execute("delete from message where rowid %% %d = 0" % step)
+        db.execute("delete from contact where rowid %% %d = 0" % step)
+        db.commit()
+
+    if walMessages <= 0:
+        db.close()
+        return
+
+    # leave the last messages in the WAL: copy the files while the
+    # connection is still open, closing it would checkpoint them
+    db.execute("pragma journal_mode = wal")
+    db.execute("pragma wal_autocheckpoint = 0")
+    db.executemany(insert, messageRows(rand, corpus, walMessages, committed, book, labels, idPrefix, bodyMedian))
+    db.commit()
+    tmpPath = path + ".tmp"
+    shutil.copyfile(path, tmpPath)
+    shutil.copyfile(path + "-wal", tmpPath + "-wal")
+    db.close()
+    os.rename(tmpPath, path)
+    os.rename(tmpPath + "-wal", path + "-wal")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Generate a synthetic ProtonMail 'proton.db'.")
+    parser.add_argument("output", help="database to write")
+    parser.add_argument("-n", "--messages", type=int, default=1000, help="number of messages (default 1000)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default 1)")
+    parser.add_argument("--body-median", type=int, default=2500, help="median body length (default 2500)")
+    parser.add_argument("--id-prefix", default="m", help="message ID prefix (default 'm')")
+    parser.add_argument("--deleted", type=float, default=0.0, help="fraction of rows to delete (default 0)")
+    parser.add_argument("--wal-messages", type=int, default=0, help="messages to leave in the WAL (default 0)")
+    args = parser.parse_args(argv)
+    make(args.output, args.messages, args.seed, args.body_median, args.id_prefix, args.deleted, args.wal_messages)
+    print("%s: %d bytes" % (args.output, os.path.getsize(args.output)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,136 @@
+# Regression tests for recovering deleted rows: protonmail_core's page
+# carver, the WAL it reads along with the database and the check that leaves
+# out rows that are still live.  The databases come from generate.py.
+#
+# Usage:
+#
+#   python3 -m unittest discover ProtonMail/benchmark
+#
+# Needs CPython 3 and nothing else.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.dirname(HERE))
+
+import generate
+from protonmail_core import ProtonMailPageCarver
+from protonmail_core import ProtonMailRecordLayout
+from protonmail_core import carveDeletedRows
+from protonmail_extract import extractTables
+from protonmail_extract import openDatabase
+from protonmail_extract import sqliteQuery
+
+MESSAGES = 600
+WAL_MESSAGES = 40
+# generate.make() deletes every DELETE_STEP-th rowid of the committed messages
+DELETED = 0.1
+DELETE_STEP = 10
+
+
+# The IDs of the messages generate.make() deleted, by rowid
+def deletedMessages():
+    return dict([(rowid, "t%d" % (rowid - 1)) for rowid in range(1, MESSAGES - WAL_MESSAGES + 1)
+                 if rowid % DELETE_STEP == 0])
+
+
+# Carve the database at 'path'.  Returns the IDs of the recovered messages and
+# of the live ones.
+def carveMessages(path):
+    conn, openPath, tmpDir = openDatabase(path)
+    try:
+        query = sqliteQuery(conn)
+        layouts = [ProtonMailRecordLayout.read(query, table) for table in extractTables(["message"], False)]
+        records = carveDeletedRows(query, openPath, layouts, lambda: False)
+        live = set([row[0] for row in query("select ID from message;")])
+    finally:
+        conn.close()
+        if tmpDir is not None:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+    return [values[layout.index["id"]] for layout, rowid, values, source in records], live
+
+
+class CarverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workDir = tempfile.mkdtemp(prefix="protonmail-carver-")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workDir, ignore_errors=True)
+
+    def makeDatabase(self, bodyMedian):
+        path = os.path.join(self.workDir, "proton-%d.db" % bodyMedian)
+        if not os.path.exists(path):
+            generate.make(path, MESSAGES, 1, bodyMedian, "t", DELETED, WAL_MESSAGES)
+        return path
+
+    # With bodies that fit in a page every deleted message that is still in
+    # the file comes back.  A deleted cell loses its first four bytes to the
+    # freeblock header, which with a one byte rowid takes the record's header
+    # size with it, and SQLite reuses some of the freed space, so those are
+    # the ones with a rowid of 128 or more whose record is still there.
+    def testShortBodiesRecoverTheDeletedMessages(self):
+        path = self.makeDatabase(300)
+        with open(path, "rb") as db, open(path + "-wal", "rb") as wal:
+            data = db.read() + wal.read()
+        expected = set([messageId for rowid, messageId in deletedMessages().items()
+                        if rowid >= 128 and (messageId + "cv").encode("ascii") in data])
+        recovered, live = carveMessages(path)
+        self.assertTrue(expected)
+        self.assertEqual(len(recovered), len(set(recovered)))
+        self.assertEqual(set(recovered), expected)
+
+    # Long bodies are cut off at the end of the page or written over by newer
+    # cells, and the leftover copies of live messages they leave in free
+    # space must not be reported as deleted
+    def testLongBodiesReportNoLiveMessages(self):
+        recovered, live = carveMessages(self.makeDatabase(2500))
+        self.assertTrue(recovered)
+        self.assertEqual(set(recovered) & live, set())
+        self.assertTrue(set(recovered) <= set(deletedMessages().values()))
+
+    # the last committed message was deleted and its rowid handed to the first
+    # message in the WAL, which doesn't make the old one live
+    def testReusedRowidIsRecovered(self):
+        recovered, live = carveMessages(self.makeDatabase(2500))
+        lastCommitted = MESSAGES - WAL_MESSAGES
+        self.assertEqual(lastCommitted % DELETE_STEP, 0)
+        self.assertIn(deletedMessages()[lastCommitted], recovered)
+
+    # the messages only in the WAL are read as live rows, not recovered ones
+    def testWalMessagesAreLive(self):
+        recovered, live = carveMessages(self.makeDatabase(300))
+        walIds = set(["t%d" % i for i in range(MESSAGES - WAL_MESSAGES, MESSAGES)])
+        self.assertTrue(walIds <= live)
+        self.assertEqual(set(recovered) & walIds, set())
+        self.assertEqual(len(live), MESSAGES - len(deletedMessages()))
+
+    # free space is searched for record headers, not decoded at every byte,
+    # so the carver decodes a few records for each one it finds
+    def testScanOnlyDecodesCandidates(self):
+        path = self.makeDatabase(300)
+        calls = [0]
+        record = ProtonMailPageCarver._record
+
+        def countingRecord(carver, *args):
+            calls[0] += 1
+            return record(carver, *args)
+
+        ProtonMailPageCarver._record = countingRecord
+        try:
+            recovered, live = carveMessages(path)
+        finally:
+            ProtonMailPageCarver._record = record
+        self.assertTrue(recovered)
+        self.assertLess(calls[0], 4 * (len(recovered) + WAL_MESSAGES))
+
+
+if __name__ == "__main__":
+    unittest.main()
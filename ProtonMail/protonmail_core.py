@@ -0,0 +1,879 @@
+# The parts of the ProtonMail module that don't need Autopsy: the map of the
+# tables we parse, the contact and label index messages are resolved against
+# and the carver that recovers deleted records.  Shared by the Autopsy module
+# (ProtonMail.py, under Jython) and the standalone extractor
+# (protonmail_extract.py, under CPython), so this file sticks to what both
+# have.
+#
+# Database access goes through a 'query' function, query(sql, params=()),
+# returning the rows as a list of tuples and raising ProtonMailQueryError if
+# SQLite fails, which each side builds on its own driver.
+#
+# This is free and unencumbered software released into the public domain.
+# See ProtonMail.py for the full text.
+
+import io
+import os
+import re
+import struct
+
+
+# Raised by a query function when SQLite fails
+class ProtonMailQueryError(Exception):
+    pass
+
+
+# The ProtonMail tables we parse.  Each table becomes one artifact type and
+# each column one attribute on it:
+#
+#   (table, artifact type, artifact display name,
+#    ((column, attribute type, value type, attribute display name), ...))
+#
+# Columns that a particular version of ProtonMail doesn't have are skipped.
+PM_TABLES = (
+    ("contact", "TSK_PM_CONTACT", "ProtonMail Contact", (
+        ("Name", "TSK_PM_CONTACT_NAME", "STRING", "Name"),
+        ("CreateTime", "TSK_PM_CONTACT_CREATETIME", "DATETIME", "Create Time"),
+        ("ModifyTime", "TSK_PM_CONTACT_MODIFYTIME", "DATETIME", "Modify Time"))),
+    ("contact_data", "TSK_PM_CONTACTDATA", "ProtonMail Contact Data", (
+        ("Name", "TSK_PM_CONTACTDATA_NAME", "STRING", "Name"),
+        ("PrimaryEmail", "TSK_PM_CONTACTDATA_PRIMARYEMAIL", "STRING", "Primary Email"))),
+    ("contact_emails", "TSK_PM_CONTACTEMAILS", "ProtonMail Contact Emails", (
+        ("Name", "TSK_PM_CONTACTEMAILS_NAME", "STRING", "Name"),
+        ("Email", "TSK_PM_CONTACTEMAILS_EMAIL", "STRING", "Email"))),
+    ("label", "TSK_PM_CONTACTLABEL", "ProtonMail User Labels", (
+        ("Name", "TSK_PM_CONTACTLABEL_NAME", "STRING", "Name"),
+        ("Color", "TSK_PM_CONTACTLABEL_COLOR", "STRING", "Color"))),
+    ("message", "TSK_PM_CONTACTMESSAGE", "ProtonMail Messages", (
+        ("Time", "TSK_PM_CONTACTMESSAGE_TIME", "DATETIME", "Time"),
+        ("ToListString", "TSK_PM_CONTACTMESSAGE_TO", "STRING", "To"),
+        ("ReplyTosString", "TSK_PM_CONTACTMESSAGE_REPLYTO", "STRING", "Reply To"),
+        ("SenderName", "TSK_PM_CONTACTMESSAGE_SENDERNAME", "STRING", "From"),
+        ("SenderAddress", "TSK_PM_CONTACTMESSAGE_SENDERADDRESS", "STRING", "Sender Address"),
+        ("Subject", "TSK_PM_CONTACTMESSAGE_SUBJECT", "STRING", "Subject"),
+        ("Body", "TSK_PM_CONTACTMESSAGE_BODY", "STRING", "Body"),
+        ("Header", "TSK_PM_CONTACTMESSAGE_HEADER", "STRING", "Header"),
+        ("TotalSize", "TSK_PM_CONTACTMESSAGE_TOTALSIZE", "STRING", "Total Size"),
+        ("BCCListString", "TSK_PM_CONTACTMESSAGE_BCCLIST", "STRING", "BCC List"),
+        ("CCListString", "TSK_PM_CONTACTMESSAGE_CCLIST", "STRING", "CC List"),
+        ("IsDownloaded", "TSK_PM_CONTACTMESSAGE_ISDOWNLOADED", "STRING", "Is Downloaded?"),
+        ("IsEncrypted", "TSK_PM_CONTACTMESSAGE_ISENCRYPTED", "STRING", "Is Encrypted?"),
+        ("IsForwarded", "TSK_PM_CONTACTMESSAGE_ISFORWARDED", "STRING", "Is Forwarded?"),
+        ("IsRead", "TSK_PM_CONTACTMESSAGE_ISREAD", "STRING", "Is Read?"),
+        ("IsReplied", "TSK_PM_CONTACTMESSAGE_ISREPLIED", "STRING", "Is Replied?"),
+        ("IsRepliedAll", "TSK_PM_CONTACTMESSAGE_ISREPLIEDALL", "STRING", "Is Replied All?"),
+        ("SpamScore", "TSK_PM_CONTACTMESSAGE_SPAMSCORE", "STRING", "Spam Score"),
+        ("Starred", "TSK_PM_CONTACTMESSAGE_STARRED", "STRING", "Starred"),
+        ("ID", "TSK_PM_CONTACTMESSAGE_ID", "STRING", "Message ID"))),
+    ("notification", "TSK_PM_CONTACTNOTIFICATION", "ProtonMail Notifications", (
+        ("notification_title", "TSK_PM_CONTACTNOTIFICATION_NOTIFICATIONTITLE", "STRING", "Notification Title"),
+        ("notification_body", "TSK_PM_CONTACTNOTIFICATION_NOTIFICATIONBODY", "STRING", "Notification Body"))),
+)
+
+# Attributes added to a table's rows when RESOLVE_CONTACTS is on, each made
+# from the values of one or more columns:
+#
+#   table: ((attribute type, display name, lookup, (column, ...)), ...)
+#
+# where lookup is "contacts" for the contacts whose e-mail addresses are in
+# the columns or "labels" for the labels whose IDs are.
+PM_LOOKUP_ATTRIBUTES = {
+    "message": (
+        ("TSK_PM_CONTACTMESSAGE_SENDERCONTACT", "Sender Contact", "contacts", ("SenderAddress",)),
+        ("TSK_PM_CONTACTMESSAGE_RECIPIENTCONTACTS", "Recipient Contacts", "contacts",
+         ("ToListString", "CCListString", "BCCListString")),
+        ("TSK_PM_CONTACTMESSAGE_LABELS", "Labels", "labels", ("LabelIDs",))),
+}
+
+# ProtonMail's built in folders, which are labels that aren't in the 'label'
+# table
+PM_SYSTEM_LABELS = {
+    "0": "Inbox",
+    "1": "All Drafts",
+    "2": "All Sent",
+    "3": "Trash",
+    "4": "Spam",
+    "5": "All Mail",
+    "6": "Archive",
+    "7": "Sent",
+    "8": "Drafts",
+    "9": "Outbox",
+    "10": "Starred",
+}
+
+# sidecar files copied along with each 'proton.db' so SQLite reads them with
+# it: the write-ahead log, which holds the most recent changes, and the
+# rollback journal of an interrupted transaction.  '-shm' is only an index of
+# the WAL that SQLite rebuilds, and a stale one would mislead it.
+SQLITE_SIDECARS = ("-wal", "-journal")
+
+# pages (or WAL frames) read at a time by the carver
+CARVE_READ_PAGES = 256
+
+
+# The contacts and labels of one database: contact names by e-mail address and
+# label names by ID.  Read in one pass over the small contact and label tables
+# before the messages are streamed, so each message's addresses and label IDs
+# are resolved with a dictionary lookup rather than a query.
+class ProtonMailContactIndex(object):
+
+    def __init__(self):
+        self.contacts = {}
+        self.labels = dict(PM_SYSTEM_LABELS)
+
+    @staticmethod
+    def read(query, log=None):
+        index = ProtonMailContactIndex()
+
+        # contact names by contact ID
+        names = {}
+        for contactId, name in ProtonMailContactIndex._rows(query, "contact", ("ID", "Name"), log):
+            if name:
+                names[contactId] = name
+        contactData = ProtonMailContactIndex._rows(query, "contact_data", ("ID", "Name", "PrimaryEmail"), log)
+        for contactId, name, email in contactData:
+            if name:
+                names.setdefault(contactId, name)
+
+        # every address of a contact, then their primary ones in case the
+        # contact_emails table is missing
+        for contactId, name, email in ProtonMailContactIndex._rows(query, "contact_emails",
+                                                                   ("ContactID", "Name", "Email"), log):
+            index._addContact(email, names.get(contactId) or name)
+        for contactId, name, email in contactData:
+            index._addContact(email, names.get(contactId) or name)
+
+        for labelId, name in ProtonMailContactIndex._rows(query, "label", ("ID", "Name"), log):
+            if labelId and name:
+                index.labels[labelId] = name
+        return index
+
+    # all rows of 'columns' from 'table', as strings.  Empty if the table or
+    # any of the columns is missing, or can't be read (which is passed to
+    # 'log').
+    @staticmethod
+    def _rows(query, table, columns, log):
+        try:
+            present = tableColumns(query, table)
+            if not all([column.lower() in present for column in columns]):
+                return []
+            rows = query("select " + ", ".join(['"' + column + '"' for column in columns]) + ' from "' + table + '";')
+        except ProtonMailQueryError as e:
+            if log is not None:
+                log("Unable to read contacts from table '" + table + "' (" + str(e) + ")")
+            return []
+        return [tuple([None if value is None else u"%s" % (value,) for value in row]) for row in rows]
+
+    def _addContact(self, email, name):
+        if email and name:
+            for address in emailAddresses(email):
+                self.contacts.setdefault(address, name)
+
+    # The value of a lookup attribute for the values of its columns: the
+    # contacts as "Name <address>" for "contacts", the label names for
+    # "labels".  Empty if nothing resolved.
+    def resolve(self, lookup, texts):
+        found = []
+        if lookup == "contacts":
+            for text in texts:
+                for address in emailAddresses(text):
+                    name = self.contacts.get(address)
+                    if name is not None:
+                        contact = name + " <" + address + ">"
+                        if contact not in found:
+                            found.append(contact)
+            return "; ".join(found)
+        for text in texts:
+            for labelId in labelIds(text):
+                name = self.labels.get(labelId)
+                if name is not None and name not in found:
+                    found.append(name)
+        return ", ".join(found)
+
+
+# How the records of one table are laid out on disk: its columns in table
+# order with their type affinity and NOT NULL constraint, and which column (if
+# any) is an alias for the rowid and so always stored as NULL.
+class ProtonMailRecordLayout(object):
+
+    def __init__(self, mapping, rootPage, columns, affinities, notNull, rowidColumn):
+        self.mapping = mapping
+        self.table = mapping.table
+        self.rootPage = rootPage
+        self.columns = columns
+        self.index = dict([(column.lower(), i) for i, column in enumerate(columns)])
+        self.affinities = affinities
+        self.notNull = notNull
+        self.rowidColumn = rowidColumn
+
+        # the range of one byte record header sizes this table can have
+        self.minHeader = len(columns) + 1
+        self.maxHeader = min(127, 1 + 4 * len(columns))
+
+        # what the header of one of its records looks like: the header size,
+        # then a serial type each column accepts.  Serial types of more than
+        # one byte are only checked for being a varint.
+        self.headerPattern = _byteClass(range(self.minHeader, self.maxHeader + 1))
+        for column in range(len(columns)):
+            serialTypes = _byteClass([b for b in range(0x80) if self.accepts(column, b)])
+            if self.accepts(column, 0x80) or self.accepts(column, 0x81):
+                serialTypes = "(?:" + serialTypes + "|[\\x80-\\xff]{1,8}[\\x00-\\xff])"
+            self.headerPattern += serialTypes
+        self.header = _headerSearch([self])
+
+    # the layout of mapping.table in the open database, None if it has no
+    # such table or it's a WITHOUT ROWID table.  'mapping' can be anything
+    # with a 'table', and is handed back with each carved record.
+    @staticmethod
+    def read(query, mapping):
+        rows = query("select rootpage, sql from sqlite_master where type = 'table' and name = ?;", (mapping.table,))
+        if not rows:
+            return None
+        rootPage = rows[0][0] or 0
+        sql = rows[0][1] or ""
+        if rootPage <= 0 or "WITHOUT ROWID" in sql.upper():
+            return None
+
+        # PRAGMA table_info rows are (cid, name, type, notnull, dflt_value, pk)
+        columns = []
+        affinities = []
+        notNull = []
+        keys = []
+        for cid, name, declaredType, notnull, default, pk in query('PRAGMA table_info("' + mapping.table + '");'):
+            columns.append(name)
+            affinities.append(columnAffinity(declaredType or ""))
+            notNull.append(notnull != 0)
+            if pk > 0:
+                keys.append((len(columns) - 1, (declaredType or "").upper()))
+
+        # a lone INTEGER PRIMARY KEY is the rowid
+        rowidColumn = None
+        if len(keys) == 1 and keys[0][1] == "INTEGER":
+            rowidColumn = keys[0][0]
+        return ProtonMailRecordLayout(mapping, rootPage, columns, affinities, notNull, rowidColumn)
+
+    # True if a value of SQLite serial type 'serialType' can be in 'column'
+    def accepts(self, column, serialType):
+        if column == self.rowidColumn:
+            return serialType == 0
+        if serialType == 0:
+            return not self.notNull[column]
+        if serialType == 10 or serialType == 11:
+            return False
+        affinity = self.affinities[column]
+        if affinity == "TEXT":
+            return serialType >= 13 and serialType & 1 == 1
+        if affinity == "BLOB":
+            return True
+        return serialType <= 9
+
+
+# Recovers deleted rows from a copy of a SQLite database and its WAL without
+# going through SQLite.  The interior pages of the carved tables' b-trees are
+# read first, using the newest copy of each page (which may be in the WAL), to
+# find their leaf pages, and the freelist is walked to find the free pages.
+# Then the database and the WAL are each read once, front to back,
+# 'readPages' at a time into the same buffer:
+#
+#   - leaf pages of a carved table have their unallocated space and
+#     freeblocks searched for records of that table, and if the WAL has a
+#     newer copy of the page the cells of this older one are read as well
+#   - free pages have their cells read if they still look like a table leaf,
+#     and the rest of the page searched for records of any carved table
+#   - every table leaf in the WAL, including frames from earlier WAL
+#     generations, has its cells and free space read
+#
+# Every other page is skipped after looking at one byte.  Each record found
+# is passed to 'emit' as (layout, rowid or None, values, where it was found,
+# index of the first value that runs past the end of the cell or the free
+# space it was found in or None).  That value and the ones after it were cut
+# off, or written over by newer cells.
+class ProtonMailPageCarver(object):
+
+    # page owner marks, 1 .. len(layouts) are leaves of that layout's table
+    FREE_LEAF = 255
+    FREE_TRUNK = 254
+
+    TABLE_LEAF = 0x0D
+    TABLE_INTERIOR = 0x05
+
+    WAL_HEADER_SIZE = 32
+    WAL_FRAME_HEADER_SIZE = 24
+
+    def __init__(self, path, layouts, readPages=CARVE_READ_PAGES):
+        self.path = path
+        self.walPath = path + "-wal"
+        self.layouts = layouts
+        self.readPages = readPages
+        self.textEncoding = "utf-8"
+        self.anyHeader = _headerSearch(layouts)
+
+    # Run the carve.  Returns False if 'isCancelled' said to stop.
+    def carve(self, emit, isCancelled):
+        db = io.open(self.path, "rb")
+        try:
+            header = bytearray(SQLITE_HEADER_SIZE)
+            if db.readinto(header) != SQLITE_HEADER_SIZE:
+                return True
+            self.pageSize = _u16(header, 16)
+            if self.pageSize == 1:
+                self.pageSize = 65536
+            self.usable = self.pageSize - header[20]
+            self.textEncoding = {2: "utf-16-le", 3: "utf-16-be"}.get(_u32(header, 56), "utf-8")
+            self.db = db
+            self.wal = None
+            self.walFrames = {}
+            if os.path.exists(self.walPath):
+                self.wal = io.open(self.walPath, "rb")
+            try:
+                self._readWalIndex()
+                dbPages = os.path.getsize(self.path) // self.pageSize
+                pageCount = max([dbPages] + list(self.walFrames.keys()))
+                self.owner = bytearray(pageCount + 1)
+                self.pageBuf = bytearray(self.pageSize)
+                for i, layout in enumerate(self.layouts):
+                    self._markTree(layout.rootPage, i + 1)
+                self._markFreelist()
+
+                if not self._carveDatabase(dbPages, emit, isCancelled):
+                    return False
+                if self.wal is not None:
+                    return self._carveWal(emit, isCancelled)
+                return True
+            finally:
+                if self.wal is not None:
+                    self.wal.close()
+        finally:
+            db.close()
+
+    # page number -> offset of its newest committed frame in the WAL
+    def _readWalIndex(self):
+        if self.wal is None:
+            return
+        header = bytearray(self.WAL_HEADER_SIZE)
+        if self.wal.readinto(header) != self.WAL_HEADER_SIZE or _u32(header, 0) not in (0x377f0682, 0x377f0683) \
+                or _u32(header, 8) != self.pageSize:
+            self.wal.close()
+            self.wal = None
+            return
+        salt = header[16:24]
+        frameHeader = bytearray(self.WAL_FRAME_HEADER_SIZE)
+        frameSize = self.WAL_FRAME_HEADER_SIZE + self.pageSize
+        offset = self.WAL_HEADER_SIZE
+        uncommitted = {}
+        while True:
+            self.wal.seek(offset)
+            if self.wal.readinto(frameHeader) != self.WAL_FRAME_HEADER_SIZE or frameHeader[8:16] != salt:
+                break
+            pageNumber = _u32(frameHeader, 0)
+            if pageNumber == 0:
+                break
+            uncommitted[pageNumber] = offset + self.WAL_FRAME_HEADER_SIZE
+            # a non-zero database size marks a commit
+            if _u32(frameHeader, 4) != 0:
+                self.walFrames.update(uncommitted)
+                uncommitted = {}
+            offset += frameSize
+
+    # read the newest copy of page 'pageNumber' into self.pageBuf
+    def _readPage(self, pageNumber):
+        offset = self.walFrames.get(pageNumber)
+        source = self.wal
+        if offset is None:
+            offset = (pageNumber - 1) * self.pageSize
+            source = self.db
+        source.seek(offset)
+        return source.readinto(self.pageBuf) == self.pageSize
+
+    def _headerOffset(self, pageNumber):
+        if pageNumber == 1:
+            return SQLITE_HEADER_SIZE
+        return 0
+
+    # Mark the leaf pages of the b-tree rooted at 'rootPage' with 'mark'.  The
+    # leaves of a b-tree are all at the same depth, so the tree is walked a
+    # level at a time and of the leaf level only the first page is read.
+    # Whether the others really are leaves is checked in the pass over the
+    # file.
+    def _markTree(self, rootPage, mark):
+        level = [rootPage]
+        visited = set()
+        while level:
+            children = []
+            for pageNumber in level:
+                if pageNumber in visited or pageNumber <= 0 or pageNumber >= len(self.owner):
+                    continue
+                visited.add(pageNumber)
+                if not self._readPage(pageNumber):
+                    continue
+                data = self.pageBuf
+                hdr = self._headerOffset(pageNumber)
+                if data[hdr] == self.TABLE_LEAF:
+                    if not children:
+                        for leaf in level:
+                            if 0 < leaf < len(self.owner) and leaf not in visited:
+                                self.owner[leaf] = mark
+                        self.owner[pageNumber] = mark
+                        return
+                    self.owner[pageNumber] = mark
+                elif data[hdr] == self.TABLE_INTERIOR:
+                    for i in range(_u16(data, hdr + 3)):
+                        pointer = hdr + 12 + 2 * i
+                        if pointer + 2 > self.pageSize:
+                            break
+                        cell = _u16(data, pointer)
+                        if cell + 4 <= self.pageSize:
+                            children.append(_u32(data, cell))
+                    children.append(_u32(data, hdr + 8))
+            level = children
+
+    # mark the freelist trunk and leaf pages
+    def _markFreelist(self):
+        if not self._readPage(1):
+            return
+        trunk = _u32(self.pageBuf, 32)
+        visited = set()
+        while 0 < trunk < len(self.owner) and trunk not in visited:
+            visited.add(trunk)
+            if not self._readPage(trunk):
+                return
+            data = self.pageBuf
+            self.owner[trunk] = self.FREE_TRUNK
+            for i in range(min(_u32(data, 4), (self.usable - 8) // 4)):
+                leaf = _u32(data, 8 + 4 * i)
+                if 0 < leaf < len(self.owner):
+                    self.owner[leaf] = self.FREE_LEAF
+            trunk = _u32(data, 0)
+
+    # one pass over the database file
+    def _carveDatabase(self, dbPages, emit, isCancelled):
+        window = bytearray(self.readPages * self.pageSize)
+        self.db.seek(0)
+        pageNumber = 1
+        while pageNumber <= dbPages:
+            if isCancelled():
+                return False
+            count = self.db.readinto(window) // self.pageSize
+            if count <= 0:
+                break
+            for i in range(count):
+                mark = self.owner[pageNumber + i]
+                if mark == 0 or mark == self.FREE_TRUNK:
+                    continue
+                number = pageNumber + i
+                base = i * self.pageSize
+                hdr = base + self._headerOffset(number)
+                if mark == self.FREE_LEAF:
+                    if window[hdr] == self.TABLE_LEAF:
+                        self._cells(window, base, hdr, self.layouts, "Freelist page %d" % number, emit)
+                        self._freeSpace(window, base, hdr, self.layouts, "Freelist page %d" % number, emit)
+                    else:
+                        self._scan(window, base, base + self.usable, base + self.usable, self.layouts,
+                                   "Freelist page %d" % number, emit)
+                elif window[hdr] == self.TABLE_LEAF:
+                    layouts = [self.layouts[mark - 1]]
+                    if number in self.walFrames:
+                        self._cells(window, base, hdr, layouts, "Page %d, older copy" % number, emit)
+                    self._freeSpace(window, base, hdr, layouts, "Unallocated space in page %d" % number, emit)
+            pageNumber += count
+        return True
+
+    # one pass over the WAL file
+    def _carveWal(self, emit, isCancelled):
+        frameSize = self.WAL_FRAME_HEADER_SIZE + self.pageSize
+        window = bytearray(self.readPages * frameSize)
+        self.wal.seek(self.WAL_HEADER_SIZE)
+        frame = 0
+        while True:
+            if isCancelled():
+                return False
+            count = self.wal.readinto(window) // frameSize
+            if count <= 0:
+                return True
+            for i in range(count):
+                frame += 1
+                pageNumber = _u32(window, i * frameSize)
+                base = i * frameSize + self.WAL_FRAME_HEADER_SIZE
+                hdr = base + self._headerOffset(pageNumber)
+                if pageNumber == 0 or window[hdr] != self.TABLE_LEAF:
+                    continue
+                mark = self.owner[pageNumber] if pageNumber < len(self.owner) else 0
+                layouts = self.layouts
+                if 0 < mark <= len(self.layouts):
+                    layouts = [self.layouts[mark - 1]]
+                source = "WAL frame %d (page %d)" % (frame, pageNumber)
+                self._cells(window, base, hdr, layouts, source, emit)
+                self._freeSpace(window, base, hdr, layouts, source, emit)
+
+    # the records in the cells of the table leaf page at 'base'
+    def _cells(self, data, base, hdr, layouts, source, emit):
+        pageEnd = base + self.usable
+        for i in range(_u16(data, hdr + 3)):
+            pointer = hdr + 8 + 2 * i
+            if pointer + 2 > pageEnd:
+                break
+            cell = base + _u16(data, pointer)
+            if cell < pointer or cell >= pageEnd:
+                continue
+            payloadSize, offset = _varint(data, cell, pageEnd)
+            if payloadSize is None:
+                continue
+            rowid, offset = _varint(data, offset, pageEnd)
+            if rowid is None:
+                continue
+            if rowid >= 1 << 63:
+                rowid -= 1 << 64
+            limit = min(offset + self._localSize(payloadSize), pageEnd)
+            for layout in layouts:
+                record = self._record(data, offset, limit, limit, layout, rowid)
+                if record is not None:
+                    emit(layout, rowid, record[0], source, record[2])
+                    break
+
+    # search the unallocated space and freeblocks of the page at 'base'
+    def _freeSpace(self, data, base, hdr, layouts, source, emit):
+        pageEnd = base + self.usable
+        contentStart = _u16(data, hdr + 5) or 65536
+        self._scan(data, hdr + 8 + 2 * _u16(data, hdr + 3), min(base + contentStart, pageEnd), pageEnd,
+                   layouts, source, emit)
+
+        # freeblocks are chained in increasing order
+        block = _u16(data, hdr + 1)
+        while block:
+            offset = base + block
+            if offset + 4 > pageEnd:
+                break
+            self._scan(data, offset + 4, min(offset + _u16(data, offset + 2), pageEnd), pageEnd, layouts, source, emit)
+            following = _u16(data, offset)
+            if following <= block:
+                break
+            block = following
+
+    # look for record headers starting anywhere in [start, stop).  Deleted
+    # cells have lost their size and rowid to the freeblock header, so only
+    # the record itself is left to match against.  The places a header could
+    # start are found with the layouts' header pattern, and only those are
+    # decoded.
+    def _scan(self, data, start, stop, limit, layouts, source, emit):
+        intact = stop
+        stop = min(stop, limit - 1)
+        if stop <= start:
+            return
+        header = self.anyHeader
+        if len(layouts) == 1:
+            header = layouts[0].header
+        # a header starting just before 'stop' can run up to 127 bytes past it
+        text = bytes(data[start:min(stop + 127, limit)])
+        position = 0
+        while True:
+            match = header.search(text, position)
+            if match is None or start + match.start() >= stop:
+                return
+            offset = start + match.start()
+            headerSize = data[offset]
+            record = None
+            for layout in layouts:
+                if layout.minHeader <= headerSize <= layout.maxHeader:
+                    record = self._record(data, offset, limit, intact, layout, None)
+                    # a record of nothing but NULLs is a stray byte before
+                    # zeroed space, not a row
+                    if record is not None and record[0].count(None) == len(record[0]):
+                        record = None
+                    if record is not None:
+                        emit(layout, None, record[0], source, record[2])
+                        break
+            if record is None:
+                position = match.start() + 1
+            else:
+                position = max(match.start() + 1, record[1] - start)
+
+    # bytes of a payload of 'payloadSize' stored on the leaf page itself
+    def _localSize(self, payloadSize):
+        maxLocal = self.usable - 35
+        if payloadSize <= maxLocal:
+            return payloadSize
+        minLocal = ((self.usable - 12) * 32 // 255) - 23
+        local = minLocal + (payloadSize - minLocal) % (self.usable - 4)
+        if local <= maxLocal:
+            return local
+        return minLocal
+
+    # Decode a record of 'layout' starting at 'offset' with its data ending no
+    # later than 'limit'.  A value cut off by 'limit' (the rest of it is in an
+    # overflow page, or was overwritten) is kept as far as it goes if it's
+    # text.  Data past 'intact' may belong to something else.  Returns
+    # (values, end of record, index of the first value past 'intact' or None)
+    # or None if it doesn't match.
+    def _record(self, data, offset, limit, intact, layout, rowid):
+        headerSize, position = _varint(data, offset, limit)
+        if headerSize is None or headerSize < layout.minHeader or offset + headerSize > limit:
+            return None
+        headerEnd = offset + headerSize
+        serialTypes = []
+        for column in range(len(layout.columns)):
+            serialType, position = _varint(data, position, headerEnd)
+            if serialType is None or not layout.accepts(column, serialType):
+                return None
+            serialTypes.append(serialType)
+        if position != headerEnd:
+            return None
+
+        values = []
+        cut = None
+        for column, serialType in enumerate(serialTypes):
+            if column == layout.rowidColumn:
+                values.append(rowid)
+                continue
+            if serialType >= 12:
+                size = (serialType - 12) >> 1
+            else:
+                size = SERIAL_TYPE_SIZES[serialType]
+            if cut is None and size and position + size > intact:
+                cut = column
+            if position + size > limit:
+                if serialType >= 13 and position < limit:
+                    values.append(bytes(data[position:limit]).decode(self.textEncoding, "replace"))
+                values.extend([None] * (len(serialTypes) - len(values)))
+                return values, limit, cut
+            if serialType == 0:
+                values.append(None)
+            elif serialType <= 6:
+                values.append(_signed(data, position, size))
+            elif serialType == 7:
+                values.append(struct.unpack(">d", bytes(data[position:position + 8]))[0])
+            elif serialType <= 9:
+                values.append(serialType - 8)
+            elif serialType & 1:
+                values.append(bytes(data[position:position + size]).decode(self.textEncoding, "replace"))
+            else:
+                values.append(bytearray(data[position:position + size]))
+            position += size
+        return values, position, cut
+
+
+# The first 100 bytes of every SQLite database
+SQLITE_HEADER_SIZE = 100
+SQLITE_MAGIC = "SQLite format 3\x00"
+
+
+def _u16(data, offset):
+    return (data[offset] << 8) | data[offset + 1]
+
+
+def _u32(data, offset):
+    return (data[offset] << 24) | (data[offset + 1] << 16) | (data[offset + 2] << 8) | data[offset + 3]
+
+
+# bytes of data for SQLite record serial types 0 - 11
+SERIAL_TYPE_SIZES = (0, 1, 2, 3, 4, 6, 8, 8, 0, 0, 0, 0)
+
+
+# a regular expression character class of the byte values 'values'
+def _byteClass(values):
+    if not values:
+        return "(?!)"
+    return "[" + "".join(["\\x%02x" % value for value in values]) + "]"
+
+
+# a compiled search for the start of a record of any of 'layouts'
+def _headerSearch(layouts):
+    alternatives = "|".join([layout.headerPattern for layout in layouts]) or "(?!)"
+    return re.compile(("(?=" + alternatives + ")").encode("ascii"))
+
+
+# a big-endian two's complement integer of 'size' bytes
+def _signed(data, offset, size):
+    value = 0
+    for i in range(size):
+        value = (value << 8) | data[offset + i]
+    if data[offset] & 0x80:
+        value -= 1 << (8 * size)
+    return value
+
+
+# Read a SQLite varint at 'offset', not going past 'end'.  Returns (value,
+# offset after it), with None for the value if it runs past 'end'.
+def _varint(data, offset, end):
+    value = 0
+    for i in range(8):
+        if offset + i >= end:
+            return None, offset
+        byte = data[offset + i]
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, offset + i + 1
+    if offset + 8 >= end:
+        return None, offset
+    return (value << 8) | data[offset + 8], offset + 9
+
+
+# The affinity SQLite gives a column declared as 'declaredType'
+def columnAffinity(declaredType):
+    declaredType = declaredType.upper()
+    if "INT" in declaredType:
+        return "INTEGER"
+    if "CHAR" in declaredType or "CLOB" in declaredType or "TEXT" in declaredType:
+        return "TEXT"
+    if "BLOB" in declaredType or not declaredType:
+        return "BLOB"
+    if "REAL" in declaredType or "FLOA" in declaredType or "DOUB" in declaredType:
+        return "REAL"
+    return "NUMERIC"
+
+
+# Check the first SQLITE_HEADER_SIZE bytes ('data', unsigned) of a file of
+# 'size' bytes.  Returns None when the file isn't a SQLite database, otherwise
+# a dict with the page size, the page count (None if the header doesn't record
+# a trustworthy one) and whether the file is shorter than the header says it
+# should be.
+def parseSqliteHeader(data, size):
+    if len(data) < SQLITE_HEADER_SIZE or "".join([chr(b) for b in data[:16]]) != SQLITE_MAGIC:
+        return None
+    pageSize = _u16(data, 16)
+    if pageSize == 1:
+        pageSize = 65536
+    if pageSize < 512 or pageSize & (pageSize - 1):
+        return None
+
+    # the page count is only valid if the change counter matches the
+    # 'version-valid-for' number, otherwise an old SQLite last wrote the file
+    pageCount = _u32(data, 28)
+    if pageCount == 0 or _u32(data, 24) != _u32(data, 92):
+        pageCount = None
+
+    return {"pageSize": pageSize,
+            "pageCount": pageCount,
+            "truncated": pageCount is not None and pageCount * pageSize > size}
+
+
+# an e-mail address, wherever it is in a list like "Name <a@b.c>;d@e.f"
+EMAIL_ADDRESS = re.compile(r"[A-Za-z0-9._%+'-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}")
+
+
+# the e-mail addresses in 'text', lower-cased
+def emailAddresses(text):
+    if not text:
+        return []
+    return [address.lower() for address in EMAIL_ADDRESS.findall(text)]
+
+
+# a label ID in a list like '["0","5","abc=="]' or "0;5"
+LABEL_ID = re.compile(r'[^\s\[\]",;]+')
+
+
+def labelIds(text):
+    if not text:
+        return []
+    return LABEL_ID.findall(text)
+
+
+# Carve the deleted rows of the tables in 'layouts' from the database at
+# 'path' and its WAL, see ProtonMailPageCarver.  The same row often turns up
+# in several places (old WAL frames, freeblocks), so only the first of each is
+# kept, and rows still in the open database behind 'query' are left out (see
+# liveCandidates()).  Returns the rest as (layout, rowid or None, values,
+# where it was found), or None if 'isCancelled' said to stop.
+def carveDeletedRows(query, path, layouts, isCancelled, readPages=CARVE_READ_PAGES, pageSize=1000):
+    candidates = []
+    seen = set()
+    def emit(layout, rowid, values, source, cut):
+        key = (layout.table, rowid) if rowid is not None else (layout.table, tuple(values))
+        if key not in seen:
+            seen.add(key)
+            candidates.append((layout, rowid, values, source, cut))
+    if not ProtonMailPageCarver(path, layouts, readPages).carve(emit, isCancelled):
+        return None
+    live = liveCandidates(query, candidates, pageSize)
+    return [candidate[:4] for i, candidate in enumerate(candidates) if i not in live]
+
+
+# The indexes of the carved rows in 'candidates', (layout, rowid, values,
+# where it was found, index of the first value that may be cut off or None)
+# as the carver emits them, that are still in the database: a live row with
+# the same values in every column that has a (non-blob) value and comes
+# before any value cut off, which would never match.  A row with a rowid only
+# matches the live row with that rowid; SQLite hands the rowid of a deleted
+# last row to the next one inserted, so the rowid alone doesn't make it live.
+# The others are matched in one pass over each table, 'pageSize' rows at a
+# time, since a query for each would scan the table once per row.
+def liveCandidates(query, candidates, pageSize=1000):
+    live = set()
+    # layout -> {rowid: [candidate index, ...]}
+    byRowid = {}
+    # layout -> {column indexes: {values: [candidate index, ...]}}
+    pending = {}
+    for i, (layout, rowid, values, source, cut) in enumerate(candidates):
+        if rowid is not None:
+            byRowid.setdefault(layout, {}).setdefault(rowid, []).append(i)
+            continue
+        columns = intactColumns(values, cut)
+        if columns:
+            byColumns = pending.setdefault(layout, {}).setdefault(columns, {})
+            byColumns.setdefault(tuple([values[column] for column in columns]), []).append(i)
+
+    # SQLite allows 999 parameters to a statement
+    for layout, wanted in byRowid.items():
+        select = "select rowid, " + ", ".join(['"' + column + '"' for column in layout.columns]) + \
+                 ' from "' + layout.table + '" where rowid in ('
+        rowids = sorted(wanted)
+        for start in range(0, len(rowids), min(pageSize, 999)):
+            chunk = rowids[start:start + min(pageSize, 999)]
+            for row in query(select + ", ".join(["?"] * len(chunk)) + ");", chunk):
+                for i in wanted[row[0]]:
+                    values, cut = candidates[i][2], candidates[i][4]
+                    if all([values[column] == row[column + 1] for column in intactColumns(values, cut)]):
+                        live.add(i)
+
+    for layout, byColumns in pending.items():
+        select = "select rowid, " + ", ".join(['"' + column + '"' for column in layout.columns]) + \
+                 ' from "' + layout.table + '"'
+        lastRowid = None
+        while True:
+            if lastRowid is None:
+                rows = query(select + " order by rowid limit ?;", (pageSize,))
+            else:
+                rows = query(select + " where rowid > ? order by rowid limit ?;", (lastRowid, pageSize))
+            for row in rows:
+                for columns, wanted in byColumns.items():
+                    found = wanted.get(tuple([row[column + 1] for column in columns]))
+                    if found is not None:
+                        live.update(found)
+            if len(rows) < pageSize:
+                break
+            lastRowid = rows[-1][0]
+    return live
+
+
+# The indexes of the carved 'values' worth comparing with a live row: those
+# that aren't NULL or a blob and come before 'cut', the first value that may
+# have been cut off or written over
+def intactColumns(values, cut):
+    if cut is not None:
+        values = values[:cut]
+    return tuple([column for column, value in enumerate(values)
+                  if value is not None and not isinstance(value, bytearray)])
+
+
+# The columns to select from a table that has the (lower-cased) columns in
+# 'present': those of 'columns' it has, in order, then any others the
+# 'lookups' ((attribute, lookup, (column, ...)), ...) read.  Returns the
+# column names and the lookups as (attribute, lookup, indexes into the
+# selected columns), leaving out lookups with none of their columns there.
+def selectColumns(columns, lookups, present):
+    selected = [name for name in columns if name.lower() in present]
+    positions = dict([(name.lower(), index) for index, name in enumerate(selected)])
+    planned = []
+    for attribute, lookup, lookupColumns in lookups:
+        for name in lookupColumns:
+            if name.lower() in present and name.lower() not in positions:
+                positions[name.lower()] = len(selected)
+                selected.append(name)
+        indexes = [positions[name.lower()] for name in lookupColumns if name.lower() in positions]
+        if indexes:
+            planned.append((attribute, lookup, indexes))
+    return selected, planned
+
+
+# The lower-cased column names of 'table', empty if the table doesn't exist
+def tableColumns(query, table):
+    return set([row[1].lower() for row in query('PRAGMA table_info("' + table + '");')])
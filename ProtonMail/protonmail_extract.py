@@ -0,0 +1,360 @@
+# Standalone extractor for ProtonMail 'proton.db' files, for sweeping many
+# databases without Autopsy or a case.  Uses the same table map, contact and
+# label lookups and deleted record carver as the Autopsy module (see
+# protonmail_core.py) over Python's own sqlite3 module, and writes one JSON
+# line or CSV row per 'message', 'contact' or 'notification' row.
+#
+# Usage:
+#
+#   python3 protonmail_extract.py [options] INPUT [INPUT ...]
+#
+# for example
+#
+#   python3 protonmail_extract.py -o messages.jsonl /cases/extracted
+#   python3 protonmail_extract.py --format csv --jobs 16 --tables message a.db b.db > out.csv
+#
+# INPUTs are databases or directories, which are searched for files named
+# 'proton.db'.  Each database is parsed by one of a pool of worker processes
+# and its records are written out as soon as it's done, so output order
+# follows completion, not the command line.  Every record has the database
+# it came from ("source"), the table, the rowid and, for rows recovered from
+# free space, where they were found ("recovered"), then the table's columns
+# by name and any resolved lookups by display name.
+#
+# Databases are never written to.  One without a WAL or rollback journal next
+# to it is opened in place with SQLite's immutable flag, which also stops
+# SQLite looking for one.  One with either is copied to a temporary directory
+# with them first, since SQLite has to read the WAL (or roll the journal
+# back) to see the database as the app left it, and that needs somewhere it
+# can write.
+#
+# Run with --help for all the options.  Needs CPython 3 and nothing else.
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from urllib.request import pathname2url
+
+from protonmail_core import PM_TABLES
+from protonmail_core import PM_LOOKUP_ATTRIBUTES
+from protonmail_core import SQLITE_HEADER_SIZE
+from protonmail_core import SQLITE_SIDECARS
+from protonmail_core import ProtonMailQueryError
+from protonmail_core import ProtonMailContactIndex
+from protonmail_core import ProtonMailRecordLayout
+from protonmail_core import parseSqliteHeader
+from protonmail_core import selectColumns
+from protonmail_core import tableColumns
+from protonmail_core import carveDeletedRows
+
+
+DEFAULT_TABLES = ("message", "contact", "notification")
+
+# fields every record starts with
+RECORD_FIELDS = ("source", "table", "rowid", "recovered")
+
+
+# One table from PM_TABLES: its column names, lookups as (display name,
+# lookup, columns) and the columns its records have, which are the table's
+# plus any more its lookups read
+class ExtractTable(object):
+
+    def __init__(self, table, columns, lookups):
+        self.table = table
+        self.columns = columns
+        self.lookups = lookups
+        self.fields = list(columns)
+        for displayName, lookup, lookupColumns in lookups:
+            for name in lookupColumns:
+                if name.lower() not in [field.lower() for field in self.fields]:
+                    self.fields.append(name)
+
+
+def extractTables(names, resolve):
+    tables = []
+    for table, artifactName, artifactDisplayName, columns in PM_TABLES:
+        if table not in names:
+            continue
+        lookups = []
+        if resolve:
+            lookups = [(displayName, lookup, lookupColumns)
+                       for attributeName, displayName, lookup, lookupColumns in PM_LOOKUP_ATTRIBUTES.get(table, ())]
+        tables.append(ExtractTable(table, [column[0] for column in columns], lookups))
+    return tables
+
+
+# The CSV header: every field any record of 'tables' can have
+def fieldNames(tables):
+    names = list(RECORD_FIELDS)
+    for table in tables:
+        for name in table.fields + [lookup[0] for lookup in table.lookups]:
+            if name not in names:
+                names.append(name)
+    return names
+
+
+# A query function for protonmail_core over the sqlite3 connection 'conn'
+def sqliteQuery(conn):
+    def query(sql, params=()):
+        try:
+            return conn.execute(sql, tuple(params)).fetchall()
+        except sqlite3.Error as e:
+            raise ProtonMailQueryError(str(e))
+    return query
+
+
+# Open 'path' without writing to it.  Returns the connection, the path of the
+# file that was opened (for the carver) and the temporary directory it was
+# copied to, or None.
+def openDatabase(path):
+    sidecars = [suffix for suffix in SQLITE_SIDECARS
+                if os.path.isfile(path + suffix) and os.path.getsize(path + suffix) > 0]
+    if not sidecars:
+        uri = "file:" + pathname2url(os.path.abspath(path)) + "?mode=ro&immutable=1"
+        return textConnection(sqlite3.connect(uri, uri=True)), path, None
+
+    tmpDir = tempfile.mkdtemp(prefix="protonmail-")
+    copyPath = os.path.join(tmpDir, "proton.db")
+    try:
+        shutil.copyfile(path, copyPath)
+        for suffix in sidecars:
+            shutil.copyfile(path + suffix, copyPath + suffix)
+        return textConnection(sqlite3.connect(copyPath)), copyPath, tmpDir
+    except (IOError, OSError, sqlite3.Error):
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        raise
+
+
+# Have 'conn' decode text that isn't valid UTF-8 with replacement characters,
+# rather than fail the whole query on it.  Returns 'conn'.
+def textConnection(conn):
+    conn.text_factory = lambda data: data.decode("utf-8", "replace")
+    return conn
+
+
+# JSON and CSV can't hold blobs, so they go out as hex
+def outputValue(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    return value
+
+
+def lookupValue(contacts, lookup, values):
+    return contacts.resolve(lookup, [None if value is None else str(value) for value in values])
+
+
+# Write the live rows of 'table' to 'write'.  Returns the number written.
+def extractRows(source, query, conn, table, contacts, write):
+    present = tableColumns(query, table.table)
+    if not present:
+        return 0
+    selected, lookups = selectColumns(table.columns, table.lookups if contacts is not None else (), present)
+    if not selected:
+        return 0
+    cursor = conn.execute("select rowid, " + ", ".join(['"' + name + '"' for name in selected]) +
+                          ' from "' + table.table + '" order by rowid;')
+    count = 0
+    for row in cursor:
+        record = {"source": source, "table": table.table, "rowid": row[0], "recovered": None}
+        for name, value in zip(selected, row[1:]):
+            record[name] = outputValue(value)
+        for displayName, lookup, indexes in lookups:
+            record[displayName] = lookupValue(contacts, lookup, [row[index + 1] for index in indexes])
+        write(record)
+        count += 1
+    return count
+
+
+# Recover deleted rows of 'tables' from 'carvePath' (and its WAL) and write
+# the ones that aren't still live rows to 'write'.  Returns the number
+# written.
+def carveRows(source, query, carvePath, tables, contacts, write):
+    layouts = []
+    for table in tables:
+        layout = ProtonMailRecordLayout.read(query, table)
+        if layout is not None:
+            layouts.append(layout)
+    if not layouts:
+        return 0
+
+    count = 0
+    for layout, rowid, values, found in carveDeletedRows(query, carvePath, layouts, lambda: False):
+        table = layout.mapping
+        record = {"source": source, "table": table.table, "rowid": rowid, "recovered": found}
+        for name in table.fields:
+            index = layout.index.get(name.lower())
+            if index is not None:
+                record[name] = outputValue(values[index])
+        if contacts is not None:
+            for displayName, lookup, lookupColumns in table.lookups:
+                record[displayName] = lookupValue(contacts, lookup, [values[layout.index[name.lower()]]
+                                                                     for name in lookupColumns
+                                                                     if name.lower() in layout.index])
+        write(record)
+        count += 1
+    return count
+
+
+# Parse one database into a part file in the work directory.  Runs in a
+# worker process.  Returns (database, part file or None, records, recovered
+# records, error or None).
+def extractDatabase(job):
+    path, partPath, options = job
+    with open(path, "rb") as f:
+        header = parseSqliteHeader(bytearray(f.read(SQLITE_HEADER_SIZE)), os.path.getsize(path))
+    if header is None:
+        return path, None, 0, 0, "not a SQLite database"
+    if header["truncated"]:
+        return path, None, 0, 0, "truncated, the header expects %d bytes" % (header["pageCount"] * header["pageSize"])
+
+    tables = extractTables(options["tables"], options["resolve"])
+    conn, carvePath, tmpDir = openDatabase(path)
+    try:
+        query = sqliteQuery(conn)
+        with open(partPath, "w", encoding="utf-8", newline="") as out:
+            if options["format"] == "csv":
+                writer = csv.DictWriter(out, options["fields"], extrasaction="ignore")
+                write = writer.writerow
+            else:
+                write = lambda record: out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+            contacts = None
+            if any([table.lookups for table in tables]):
+                contacts = ProtonMailContactIndex.read(query)
+            count = 0
+            for table in tables:
+                count += extractRows(path, query, conn, table, contacts, write)
+
+            # before the connection is closed, which checkpoints a copied WAL
+            # into the database
+            recovered = 0
+            if options["carve"]:
+                recovered = carveRows(path, query, carvePath, tables, contacts, write)
+        return path, partPath, count + recovered, recovered, None
+    finally:
+        conn.close()
+        if tmpDir is not None:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+
+# extractDatabase(), with a database that can't be read reported rather than
+# stopping the run
+def safeExtractDatabase(job):
+    try:
+        return extractDatabase(job)
+    except (sqlite3.Error, ProtonMailQueryError, IOError, OSError) as e:
+        return job[0], None, 0, 0, str(e)
+
+
+# The databases named 'name' in or under 'inputs', in order and once each
+def findDatabases(inputs, name):
+    found = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = []
+            for directory, subdirectories, files in os.walk(item):
+                subdirectories.sort()
+                paths.extend([os.path.join(directory, f) for f in sorted(files) if f.lower() == name.lower()])
+        else:
+            paths = [item]
+        for path in paths:
+            key = os.path.realpath(path)
+            if key not in seen:
+                seen.add(key)
+                found.append(path)
+    return found
+
+
+def log(args, message):
+    if not args.quiet:
+        sys.stderr.write(message + "\n")
+        sys.stderr.flush()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Extract ProtonMail 'proton.db' files to JSON lines or CSV.")
+    parser.add_argument("inputs", nargs="+", metavar="INPUT", help="database, or directory to search for them")
+    parser.add_argument("-o", "--output", help="file to write (default standard output)")
+    parser.add_argument("-f", "--format", choices=("jsonl", "csv"), default="jsonl", help="output format (default jsonl)")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="worker processes (default 0, one per core; 1 runs in this process)")
+    parser.add_argument("--tables", default=",".join(DEFAULT_TABLES),
+                        help="comma separated tables to extract (default %s)" % ",".join(DEFAULT_TABLES))
+    parser.add_argument("--name", default="proton.db", help="database file name searched for in directories")
+    parser.add_argument("--no-resolve", action="store_true", help="don't resolve contact and label names")
+    parser.add_argument("--no-carve", action="store_true", help="don't recover deleted rows")
+    parser.add_argument("-q", "--quiet", action="store_true", help="don't report progress on standard error")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.tables.split(",") if name.strip()]
+    known = [table[0] for table in PM_TABLES]
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        parser.error("unknown table(s) %s, choose from %s" % (", ".join(unknown), ", ".join(known)))
+    databases = findDatabases(args.inputs, args.name)
+    if not databases:
+        log(args, "no databases found")
+        return 1
+
+    options = {"tables": names,
+               "resolve": not args.no_resolve,
+               "carve": not args.no_carve,
+               "format": args.format,
+               "fields": fieldNames(extractTables(names, not args.no_resolve))}
+    work = tempfile.mkdtemp(prefix="protonmail-extract-")
+    jobs = [(path, os.path.join(work, "part-%d" % i), options) for i, path in enumerate(databases)]
+    workers = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    workers = min(workers, len(jobs))
+
+    started = time.time()
+    records = 0
+    recovered = 0
+    failed = 0
+    out = sys.stdout
+    if args.output and args.output != "-":
+        out = open(args.output, "w", encoding="utf-8", newline="")
+    pool = None
+    try:
+        if args.format == "csv":
+            csv.writer(out).writerow(options["fields"])
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(safeExtractDatabase, jobs, chunksize=1)
+        else:
+            results = (safeExtractDatabase(job) for job in jobs)
+
+        # each database's records go out in one piece as soon as it's done
+        for done, (path, partPath, count, carved, error) in enumerate(results):
+            if error is not None:
+                failed += 1
+                log(args, "[%d/%d] %s: skipped, %s" % (done + 1, len(jobs), path, error))
+                continue
+            with open(partPath, "r", encoding="utf-8", newline="") as part:
+                shutil.copyfileobj(part, out)
+            out.flush()
+            os.remove(partPath)
+            records += count
+            recovered += carved
+            log(args, "[%d/%d] %s: %d records (%d recovered)" % (done + 1, len(jobs), path, count, carved))
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if out is not sys.stdout:
+            out.close()
+        shutil.rmtree(work, ignore_errors=True)
+
+    log(args, "%d databases, %d records (%d recovered), %d skipped in %.1f s" %
+        (len(jobs) - failed, records, recovered, failed, time.time() - started))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))